@@ -27,6 +27,14 @@ bool radioNumber = 0;
  */
 bool DEBUG = false;
 
+/******************************************************************************************************
+ * SERIAL FRAMING CONFIGURATION (USER INPUT REQUIRED)
+ */
+// false = text messages wrapped in '<' and '>' markers
+// true  = binary safe COBS frames with a length and CRC-16 trailer, ended by a zero byte
+// must match the framing used by the host, ex: `radio --binary`
+bool BINARY_FRAMING = false;
+
 /******************************************************************************************************
  * CONTROL FLAGS
  */
@@ -39,17 +47,22 @@ bool new_serial = false;
 bool send_ack = false;
 
 // used to control the action that the transeiver will perform
-// T=transmit, S=stream, R=receive (default)
+// T=transmit, S=stream, P=pipelined stream, R=receive (default)
 char mode = 'R';
 
 //used to control how many paylods must be streamed
 uint32_t num_payloads = 0;
 
+// number of serial frames the host may send ahead during a pipelined stream.
+// each frame is at most 34 bytes, keep this within the serial receive buffer.
+const uint8_t stream_window = 2;
+
 /******************************************************************************************************
  * GLOBAL DATA BUFFERS
  */
 const uint16_t max_buffer_length = 256;
 char serial_buffer[max_buffer_length];
+uint16_t serial_length = 0;   // number of valid bytes in the serial buffer, which may hold zeros in binary mode
 
 /******************************************************************************************************
  * RADIO PARAMETERS
@@ -69,42 +82,54 @@ struct PayloadStruct {
 };
 PayloadStruct payload;
 PayloadStruct ackload;
+const uint8_t ackload_length = 3;   // "ACK", without the terminating zero so binary framing sends exactly "ACK"
+uint8_t payload_length = 0;   // number of valid bytes in the payload
 
 /******************************************************************************************************
  * HEADER FRAME STRUCT
  */
-#define num_substrings 3
-char* header_frame[num_substrings];
 char* header_mode;
 char* header_payloads;
 char* header_data;
 
+/******************************************************************************************************
+ * COBS ENCODER STATE
+ */
+uint8_t cobs_block[254];
+uint8_t cobs_block_length = 0;
+
 /******************************************************************************************************
  * FUNCTION PROTOTYPES
  */
 // serial functions
 void init_serial(void);
-void read_from_serial(void);
+void receive_from_serial(void);
+void receive_cobs_from_serial(void);
 void send_to_serial(void);
+void send_frame(const char* data, uint16_t length);
+void send_status(const __FlashStringHelper* message);
+void send_payload(const char* message, uint8_t length);
+
+// framing functions
+int16_t cobs_decode(uint8_t* buffer, uint16_t length);
+void cobs_put(uint8_t value);
+void cobs_flush(uint8_t code);
+uint16_t crc16_update(uint16_t crc, const uint8_t* data, uint16_t length);
 
 // radio functions
 void init_radio(void);
 void get_radio_number(void);
 void do_transmit(void);
 void do_receive(void);
-void do_stream(void);
+void do_stream(bool pipelined);
 
 // payload functions
 void init_payload(void);
 void make_header(void);
+uint8_t load_payload(void);
 uint32_t get_num_payloads(void);
 char get_mode(void);
 
-// string functions
-void slice(const char *str, char *result, size_t start, size_t end);
-void split_buffer(char* str, char* dlm);
-void copy(char* src, char* dst);
-
 /******************************************************************************************************
  * @brief arduino main setup.
  * @returns void
@@ -132,17 +157,17 @@ void loop() {
     radio.stopListening();
     do_transmit();
     mode = 'R';
-  } else if (mode == 'S'){
+  } else if (mode == 'S' || mode == 'P'){
     radio.stopListening();
-    do_stream();
+    do_stream(mode == 'P');
     mode = 'R';
   } else if (mode == 'R'){
     radio.startListening();
     do_receive();
   } else {
-    Serial.print(F("<error: unknown mode: "));
-    Serial.print(mode);
-    Serial.println(F(">"));
+    char text[24];
+    snprintf(text, sizeof(text), "error: unknown mode: %c", mode);
+    send_frame(text, strlen(text));
     mode = 'R';
   }
 }
@@ -157,7 +182,7 @@ void init_serial(){
     if (DEBUG) {
         Serial.println(F("\t\t***** Mock-Sat Half-Duplex Communication System *****"));
     }
-    Serial.println(F("<ready: serial>"));
+    send_status(F("ready: serial"));
 }
 
 /******************************************************************************************************
@@ -166,7 +191,7 @@ void init_serial(){
  */
 void init_radio(){
     if (!radio.begin()) {
-        Serial.println(F("<error: radio hardware is not responding>"));
+        send_status(F("error: radio hardware is not responding"));
         while (1) {} // hold in infinite loop
     }
 
@@ -182,10 +207,9 @@ void init_radio(){
         radio.printDetails();
     }
 
-    Serial.print(F("<ready: "));
-    Serial.print(F("radio"));
-    Serial.print((int)radioNumber);
-    Serial.println(F(">"));
+    char text[16];
+    snprintf(text, sizeof(text), "ready: radio%d", (int)radioNumber);
+    send_frame(text, strlen(text));
 }
 
 /******************************************************************************************************
@@ -197,7 +221,7 @@ void init_payload(){
 
   // acknowledgement packet
   memcpy(ackload.message, "ACK", 4);
-  radio.writeAckPayload(1, &ackload, sizeof(PayloadStruct));
+  radio.writeAckPayload(1, &ackload, ackload_length);
 }
 
 /******************************************************************************************************
@@ -209,18 +233,19 @@ void init_payload(){
 void do_transmit(){
     radio.flush_tx();
     unsigned long start_timer = micros();                             // start the timer
-    slice(serial_buffer, payload.message, 0, max_payload_length);
-    bool report = radio.write(&payload, sizeof(payload));             // transmit & save the report
+    payload_length = load_payload();
+    bool report = radio.write(&payload, payload_length);              // transmit & save the report
     unsigned long end_timer = micros();                               // end the timer
     if (!report) {
-        Serial.println(F("error: transmission failed or timed out")); // payload was not delivered
+        send_status(F("error: transmission failed or timed out"));    // payload was not delivered
     } else {
         uint8_t pipe;
         if (!radio.available(&pipe)) {                                // expect to have an ACK packet... raise a warning if there is none!
-            Serial.println(F("<warn: empty ACK packet>"));               // empty ACK packet received
+            send_status(F("warn: empty ACK packet"));                 // empty ACK packet received
         } else {
             PayloadStruct received;
-            radio.read(&received, sizeof(received));                  // get incoming ACK payload
+            uint8_t length = radio.getDynamicPayloadSize();
+            radio.read(&received, length);                            // get incoming ACK payload
             if (DEBUG) {
                 Serial.println(F("Transmission Report:"));            // print the timer result
                 Serial.print(F("\t- Transmission Time: "));
@@ -236,9 +261,7 @@ void do_transmit(){
                 Serial.print(F(" bytes on pipe "));
                 Serial.println(pipe);
             } else {
-                Serial.print(F("<"));
-                Serial.print(received.message);
-                Serial.print(F(">"));
+                send_payload(received.message, length);
             }
         }
     }
@@ -252,9 +275,10 @@ void do_receive(){
     uint8_t pipe;
     if (radio.available(&pipe)) {
         PayloadStruct received;
-        radio.read(&received, sizeof(received));
+        uint8_t length = radio.getDynamicPayloadSize();
+        radio.read(&received, length);
         if (send_ack) {
-            radio.writeAckPayload(1, &ackload, sizeof(PayloadStruct));  // send a manual acknowledgement package
+            radio.writeAckPayload(1, &ackload, ackload_length);  // send a manual acknowledgement package
         }
         if (DEBUG) {
             Serial.println(F("Reception Report:"));
@@ -268,9 +292,7 @@ void do_receive(){
             Serial.print(F(" bytes on pipe "));
             Serial.println(pipe);
         } else {
-            Serial.print(F("<"));
-            Serial.print(received.message);
-            Serial.println(F(">"));
+            send_payload(received.message, length);
         }
     }
 }
@@ -278,45 +300,66 @@ void do_receive(){
 /******************************************************************************************************
  * @brief stream payloads to the other radio.
  * @note utilizes the global serial buffer.
- * @note should be setup by receiving a header serial message, ex: <S:078:######>
+ * @note should be setup by receiving a header serial message, ex: <S:078:######> or <P:078:######>
+ * @note in pipelined mode the host is granted <credit: N> frames up front and one more <c> each
+ * time a frame is taken off the serial port. <stream: done> is sent once all payloads are out.
+ * @param   pipelined   - use credit based flow control with the host.
  * @returns void
  */
-void do_stream(){
-    uint8_t i = 0;        // index variable for counting up to the required number of payloads sent
-    uint8_t failures = 0; // radio transmits payload until too many errors occur
+void do_stream(bool pipelined){
+    uint32_t i = 0;           // index variable for counting up to the required number of payloads sent
+    uint8_t failures = 0;     // radio transmits payload until too many errors occur
+    bool need_payload = true; // only take a new frame once the current payload has been accepted
 
-    slice(serial_buffer, payload.message, 0, max_payload_length);
-    bool report = radio.write(&payload, sizeof(payload));
+    payload_length = load_payload();
+    bool report = radio.write(&payload, payload_length);
 
     radio.flush_tx();                       //  clean out the TX FIFO buffer
     radio.setPayloadSize(sizeof(payload));
     unsigned long start_timer = micros();
 
+    if (pipelined) {
+        char text[16];
+        snprintf(text, sizeof(text), "credit: %d", stream_window);
+        send_frame(text, strlen(text));
+    }
+
     while (i < num_payloads) {
-        while (!new_serial){
-            receive_from_serial();
-        }
-        new_serial = false;
-        slice(serial_buffer, payload.message, 0, max_payload_length);
-        if (DEBUG){
-            Serial.print(F("sending: "));
-            Serial.println(payload.message);
+        if (need_payload) {
+            while (!new_serial){
+                receive_from_serial();
+            }
+            new_serial = false;
+            need_payload = false;
+            payload_length = load_payload();
+            if (pipelined) {
+                send_status(F("c"));
+            }
+            if (DEBUG){
+                Serial.print(F("sending: "));
+                Serial.println(payload.message);
+            }
         }
-        if (!radio.writeFast(&payload, sizeof(payload))) {
+        if (!radio.writeFast(&payload, payload_length)) {
             failures++;
             radio.reUseTX();
         } else {
             i++;
+            need_payload = true;
         }
         if (failures >= 100) {
-            Serial.print(F("<error: too many failures detected, aborting at payload: "));
-            Serial.println(payload.message);
-            Serial.print(F(" >"));
+            char text[64];
+            snprintf(text, sizeof(text), "error: too many failures detected, aborting at payload: %lu", (unsigned long)i);
+            send_frame(text, strlen(text));
             break;
         }
     }
     unsigned long end_timer = micros();         // end the timer
 
+    if (pipelined) {
+        send_status(F("stream: done"));
+    }
+
     if (DEBUG){
         Serial.print(F("<time: "));
         Serial.print(end_timer - start_timer);      // print the timer result
@@ -362,6 +405,11 @@ char get_mode(){
  * @returns void
  */
 void receive_from_serial(){
+  if (BINARY_FRAMING) {
+    receive_cobs_from_serial();
+    return;
+  }
+
   static bool recvInProgress = false;
   static byte ndx = 0;
   char startMarker = '<';
@@ -380,6 +428,7 @@ void receive_from_serial(){
           }
         } else{
           serial_buffer[ndx] = '\0';
+          serial_length = ndx;
           recvInProgress = false;
           ndx = 0;
           new_serial = true;
@@ -391,14 +440,174 @@ void receive_from_serial(){
   }
 }
 
+/******************************************************************************************************
+ * @brief receive a binary safe frame from the serial port. Frames are COBS encoded and ended with a
+ * zero byte, the decoded frame ends with its length and a CRC-16/CCITT of the data and length.
+ * Frames that fail either check are dropped.
+ * @note populates the global serial buffer and serial length
+ * @returns void
+ */
+void receive_cobs_from_serial(){
+  static uint16_t ndx = 0;
+  static bool overflow = false;
+  uint8_t rc;
+
+  while (Serial.available() > 0 && new_serial == false){
+    rc = Serial.read();
+    if (rc != 0){
+      if (ndx < max_buffer_length){
+        serial_buffer[ndx++] = rc;
+      } else {
+        overflow = true;
+      }
+      continue;
+    }
+
+    int16_t length = overflow ? -1 : cobs_decode((uint8_t*)serial_buffer, ndx);
+    ndx = 0;
+    overflow = false;
+    if (length < 4) {
+      continue;
+    }
+    uint8_t* trailer = (uint8_t*)serial_buffer + length - 4;
+    uint16_t data_length = ((uint16_t)trailer[0] << 8) | trailer[1];
+    uint16_t crc = ((uint16_t)trailer[2] << 8) | trailer[3];
+    if (data_length != length - 4 || crc != crc16_update(0xFFFF, (uint8_t*)serial_buffer, length - 2)) {
+      continue;
+    }
+    serial_length = data_length;
+    serial_buffer[serial_length] = '\0';
+    new_serial = true;
+  }
+}
+
 /******************************************************************************************************
  * @brief send the contents of the global serial buffer to the serial port.
  * @returns void
  */
 void send_to_serial(){
-  Serial.print(F("<"));
-  Serial.print(serial_buffer);
-  Serial.println(F(">"));
+  send_frame(serial_buffer, serial_length);
+}
+
+/******************************************************************************************************
+ * @brief send a message to the host using the configured framing.
+ * @param   data    - the message, may hold any bytes in binary mode.
+ * @param   length  - the number of bytes in the message.
+ * @returns void
+ */
+void send_frame(const char* data, uint16_t length){
+  if (!BINARY_FRAMING){
+    Serial.print(F("<"));
+    Serial.write(data, length);
+    Serial.print(F(">"));
+    return;
+  }
+
+  uint8_t trailer[2] = {(uint8_t)(length >> 8), (uint8_t)(length & 0xFF)};
+  uint16_t crc = crc16_update(0xFFFF, (const uint8_t*)data, length);
+  crc = crc16_update(crc, trailer, 2);
+
+  cobs_block_length = 0;
+  for (uint16_t i = 0; i < length; i++){
+    cobs_put(data[i]);
+  }
+  cobs_put(trailer[0]);
+  cobs_put(trailer[1]);
+  cobs_put(crc >> 8);
+  cobs_put(crc & 0xFF);
+  cobs_flush(cobs_block_length + 1);
+  Serial.write((uint8_t)0);
+}
+
+/******************************************************************************************************
+ * @brief send a status message stored in flash to the host.
+ * @param   message - the message, ex: F("ready: serial").
+ * @returns void
+ */
+void send_status(const __FlashStringHelper* message){
+  char text[48];
+  strncpy_P(text, (const char*)message, sizeof(text) - 1);
+  text[sizeof(text) - 1] = '\0';
+  send_frame(text, strlen(text));
+}
+
+/******************************************************************************************************
+ * @brief send a payload received from the other radio to the host.
+ * @note in text mode the payload ends at the first zero, in binary mode all bytes are sent.
+ * @param   message - the payload.
+ * @param   length  - the size of the payload reported by the radio.
+ * @returns void
+ */
+void send_payload(const char* message, uint8_t length){
+  if (BINARY_FRAMING){
+    send_frame(message, length);
+  } else {
+    send_frame(message, strnlen(message, length));
+  }
+}
+
+/******************************************************************************************************
+ * @brief decode a COBS encoded frame in place.
+ * @param   buffer  - the encoded frame, without the trailing zero.
+ * @param   length  - the number of encoded bytes.
+ * @returns the number of decoded bytes, -1 if the frame is not valid COBS.
+ */
+int16_t cobs_decode(uint8_t* buffer, uint16_t length){
+  uint16_t read = 0;
+  uint16_t write = 0;
+  while (read < length){
+    uint8_t code = buffer[read++];
+    if (code == 0 || read + code - 1 > length){
+      return -1;
+    }
+    for (uint8_t i = 1; i < code; i++){
+      buffer[write++] = buffer[read++];
+    }
+    if (code != 0xFF && read < length){
+      buffer[write++] = 0;
+    }
+  }
+  return write;
+}
+
+/******************************************************************************************************
+ * @brief add a byte to the frame being COBS encoded to the serial port.
+ * @returns void
+ */
+void cobs_put(uint8_t value){
+  if (value == 0){
+    cobs_flush(cobs_block_length + 1);
+  } else {
+    cobs_block[cobs_block_length++] = value;
+    if (cobs_block_length == sizeof(cobs_block)){
+      cobs_flush(0xFF);
+    }
+  }
+}
+
+/******************************************************************************************************
+ * @brief write the pending COBS block to the serial port.
+ * @param   code    - the block's code byte.
+ * @returns void
+ */
+void cobs_flush(uint8_t code){
+  Serial.write(code);
+  Serial.write(cobs_block, cobs_block_length);
+  cobs_block_length = 0;
+}
+
+/******************************************************************************************************
+ * @brief update a CRC-16/CCITT (polynomial 0x1021, start with 0xFFFF) with more data.
+ * @returns the updated CRC.
+ */
+uint16_t crc16_update(uint16_t crc, const uint8_t* data, uint16_t length){
+  for (uint16_t i = 0; i < length; i++){
+    crc ^= (uint16_t)data[i] << 8;
+    for (uint8_t bit = 0; bit < 8; bit++){
+      crc = (crc & 0x8000) ? (crc << 1) ^ 0x1021 : crc << 1;
+    }
+  }
+  return crc;
 }
 
 /******************************************************************************************************
@@ -427,14 +636,27 @@ uint32_t get_num_payloads(){
  */
 void make_header(){
     if (new_serial){
-        split_buffer(serial_buffer, ":");
-        header_mode = header_frame[0];
-        header_payloads = header_frame[1];
-        header_data = header_frame[2];
+        char* first = (char*)memchr(serial_buffer, ':', serial_length);
+        char* second = first ? (char*)memchr(first + 1, ':', serial_length - (first + 1 - serial_buffer)) : NULL;
+        if (second == NULL){
+            send_status(F("error: malformed header"));
+            mode = 'R';
+            return;
+        }
+        *first = '\0';
+        *second = '\0';
+        header_mode = serial_buffer;
+        header_payloads = first + 1;
+        header_data = second + 1;
 
         mode = get_mode();
         num_payloads = get_num_payloads();
-        copy(header_data, serial_buffer);
+
+        // the data may hold any bytes (including ':' in binary mode), move it to the front of the buffer
+        uint16_t data_length = serial_length - (header_data - serial_buffer);
+        memmove(serial_buffer, header_data, data_length);
+        serial_length = data_length;
+        serial_buffer[serial_length] = '\0';
 
         if (DEBUG){
             Serial.println(F("Received Header Frame!"));
@@ -449,39 +671,12 @@ void make_header(){
 }
 
 /******************************************************************************************************
- * @brief create a substring from str pointer and place into result pointer,
- *  incusive to both start and end character index.
- * @param   str     - pointer to the string to be sliced (source).
- * @param   dst     - pointer to the sub-string created from the slice (destination).
- * @param   start   - index of str that begins the slice (inclusive).
- * @param   end     - index of str that ends the slice (inclusive).
- * @returns void 
- */
-void slice(const char *src, char *dst, size_t start, size_t end){
-    strncpy(dst, src + start, end - start);
-}
-
-/******************************************************************************************************
- * @brief splits a string into multiple substrings seperated by the given deliminator.
- * @param   str   - the string to be split.
- * @param   dlm   - the string of a deliminator sequence
- * @returns void
- */
-void split_buffer(char* str, char* dlm){
-    char* text = strtok(str, dlm);
-    uint8_t i = 0;
-    while (text != 0 && i < num_substrings) {
-        header_frame[i++] = text;
-        text = strtok(0, dlm);
-    }
-}
-
-/******************************************************************************************************
- * @brief copies the source string into the destination string.
- * @param   src   - the input string.
- * @param   dst   - the output string.
- * @returns void
+ * @brief copies up to 32 bytes of the serial buffer into the payload message buffer.
+ * @note should be called after successfully receiving a serial message.
+ * @returns the number of bytes in the payload.
  */
-void copy(char* src, char* dst){
-  memcpy(dst, src, strlen(src)+1);
+uint8_t load_payload(){
+    uint8_t length = min(serial_length, max_payload_length);
+    memcpy(payload.message, serial_buffer, length);
+    return length;
 }
@@ -21,8 +21,12 @@ setuptools.setup(
         'pyserial',
         'argparse',
         'pyyaml',
+        'numpy',
         'ttkthemes',
     ] + (['picamera', 'RPi.GPIO', 'gpiozero', 'smbus2'] if sys.platform == 'linux' else []),
+    extras_require={
+        'async': ['pyserial-asyncio'],
+    },
     classifiers=[
         'Programming Language :: Python :: 3',
         'Operating System :: OS Independent',
@@ -37,7 +41,10 @@ setuptools.setup(
                 'logger = satsystems.common.logger:main',
                 'deployer = satsystems.deployer.deployer:main',
                 'obc = satsystems.obc.obc:main',
-                'groundstation = satsystems.groundstation.groundstation:main'
+                'groundstation = satsystems.groundstation.groundstation:main',
+                'simulator = satsystems.simulator.simulator:main',
+                'benchmark = satsystems.benchmark.benchmark:main',
+                'satsystems = satsystems.cli:main'
             ],
     },
 )
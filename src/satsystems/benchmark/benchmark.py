@@ -0,0 +1,467 @@
+'''Throughput and latency benchmarks for the serial and radio stack.
+
+Every benchmark runs in-process: MCU and RF24 talk over a LoopbackSerial to
+simulated transeivers, so no hardware is needed and results only depend on
+the Python side. Each benchmark reports:
+
+    - frames_per_s, bytes_per_s: throughput.
+    - p50_ms, p99_ms: per message latency, where the benchmark measures it.
+    - cpu_us_per_frame: CPU time of the whole process (including the
+        simulator threads) per frame.
+
+The triage benchmark scores camera frames the size of
+data/red-eyed-tree-frog.jpg instead, one frame per 'frame'.
+
+Results are stored as JSON so runs of different versions can be compared:
+
+    benchmark run -o before.json
+    benchmark run -o after.json
+    benchmark compare before.json after.json
+
+The startup benchmark times each satsystems command in a fresh interpreter
+with -X importtime, to track what a command imports before it can run:
+
+    benchmark startup -o startup.json
+'''
+from ..common.logger import SatelliteLogger
+from ..common.framing import MarkerFramer, CobsFramer
+from ..common.mcu import MCU
+from ..radio.rf24 import RF24
+from ..simulator.loopback import LoopbackSerial
+from ..simulator.transeiver import SimulatedTranseiver
+import argparse
+import io
+import json
+import os
+import platform
+import random
+import statistics
+import string
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+
+# metrics where a larger value is better, the rest are better when smaller
+HIGHER_IS_BETTER = ('frames_per_s', 'bytes_per_s')
+METRICS = ('frames_per_s', 'bytes_per_s', 'p50_ms', 'p99_ms', 'cpu_us_per_frame')
+STARTUP_METRICS = ('import_ms', 'startup_ms')
+
+# the triage benchmark frames, the size of data/red-eyed-tree-frog.jpg
+TRIAGE_FRAME_SIZE = (400, 400)
+TRIAGE_DISTINCT_FRAMES = 16
+
+
+def percentile(values, fraction:float):
+    '''The value below which the given fraction of values fall, None if there are no values.'''
+    if not values:
+        return None
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(fraction * len(ordered)))]
+
+def make_result(frames:int, num_bytes:int, elapsed:float, cpu:float, latencies=()):
+    '''Summarize a benchmark run.'''
+    p50 = percentile(latencies, 0.50)
+    p99 = percentile(latencies, 0.99)
+    return {
+        'frames': frames,
+        'bytes': num_bytes,
+        'seconds': elapsed,
+        'frames_per_s': frames / elapsed if elapsed else None,
+        'bytes_per_s': num_bytes / elapsed if elapsed else None,
+        'p50_ms': None if p50 is None else p50 * 1000,
+        'p99_ms': None if p99 is None else p99 * 1000,
+        'cpu_us_per_frame': cpu / frames * 1e6 if frames else None,
+    }
+
+def make_payloads(count:int, size:int=32, seed:int=0):
+    '''Printable payloads that never contain the frame markers.'''
+    rng = random.Random(seed)
+    alphabet = (string.ascii_letters + string.digits).encode('ascii')
+    return [bytes(rng.choices(alphabet, k=size)) for _ in range(count)]
+
+def make_frames(count:int, size=TRIAGE_FRAME_SIZE, seed:int=0):
+    '''JPEG frames with some detail in them, so none are rejected before they are fully scored.'''
+    from PIL import Image, ImageDraw
+
+    rng = random.Random(seed)
+    frames = []
+    for index in range(count):
+        image = Image.effect_noise(size, rng.uniform(8, 48)).convert('RGB')
+        draw = ImageDraw.Draw(image)
+        for _ in range(8):
+            x, y = rng.randrange(size[0]), rng.randrange(size[1])
+            draw.ellipse((x, y, x + rng.randrange(20, 120), y + rng.randrange(20, 120)),
+                         fill=tuple(rng.randrange(256) for _ in range(3)))
+        out = io.BytesIO()
+        image.save(out, format='JPEG', quality=85)
+        frames.append(out.getvalue())
+    return frames
+
+def make_framer(framing:str):
+    return CobsFramer() if framing == 'cobs' else MarkerFramer()
+
+
+class Bench:
+    '''Shared setup for the benchmarks: loopback ports, simulated radios and quiet loggers.'''
+
+    def __init__(self, frames:int=2000, payload_size:int=32, framing:str='marker', baud:int=0,
+                 latency:float=0.0, loss:float=0.0, log_level:str='warning'):
+        self.frames = frames
+        self.payload_size = payload_size
+        self.framing = framing
+        self.baud = baud
+        self.latency = latency
+        self.loss = loss
+        self.log_level = log_level.upper()
+        self._devices = []
+
+    def radio(self, uid:int, peer:SimulatedTranseiver=None):
+        '''Boot an RF24 on a simulated transeiver.
+
+        Return:
+            - (radio, simulated transeiver)
+        '''
+        host, device = LoopbackSerial.pair(f'radio{uid}')
+        simulated = SimulatedTranseiver(self.baud, self.framing, self.latency, self.loss, seed=uid, serial_port=device)
+        if peer is not None:
+            simulated.link(peer)
+        self._devices.append(simulated.start())
+        radio = RF24(uid, host.port, threaded=True, framing=self.framing, serial_port=host)
+        radio.logger.setLevel(self.log_level)
+        return radio, simulated
+
+    def close(self):
+        for device in self._devices:
+            device.stop()
+        self._devices.clear()
+
+    def mcu_receive(self):
+        '''Parse a backlog of frames by polling receive_over_serial().'''
+        host, device = LoopbackSerial.pair('mcu')
+        mcu = MCU(host.port, framing=self.framing, serial_port=host)
+        payloads = make_payloads(self.frames, self.payload_size)
+        framer = make_framer(self.framing)
+        device.write(b''.join(framer.frame(payload) for payload in payloads))
+
+        received = 0
+        start, cpu_start = time.perf_counter(), time.process_time()
+        while received < self.frames:
+            if mcu.receive_over_serial() != 'xxx':
+                received += 1
+        return make_result(received, received * self.payload_size,
+                           time.perf_counter() - start, time.process_time() - cpu_start)
+
+    def mcu_wait(self):
+        '''Latency from a frame arriving on the port to wait_over_serial() returning it, with the reader thread.'''
+        host, device = LoopbackSerial.pair('mcu')
+        mcu = MCU(host.port, framing=self.framing, threaded=True, serial_port=host)
+        framer = make_framer(self.framing)
+        frames = [framer.frame(payload) for payload in make_payloads(self.frames, self.payload_size)]
+
+        latencies = []
+        start, cpu_start = time.perf_counter(), time.process_time()
+        for frame in frames:
+            sent = time.perf_counter()
+            device.write(frame)
+            if mcu.wait_over_serial(1.0) != 'xxx':
+                latencies.append(time.perf_counter() - sent)
+        result = make_result(len(latencies), len(latencies) * self.payload_size,
+                             time.perf_counter() - start, time.process_time() - cpu_start, latencies)
+        mcu.stop_reader()
+        return result
+
+    def transmit(self):
+        '''Round trip of RF24.transmit() to the ACK from the other radio.'''
+        receiver, simulated = self.radio(1)
+        sender, _ = self.radio(0, simulated)
+        payloads = make_payloads(self.frames, self.payload_size)
+
+        latencies = []
+        start, cpu_start = time.perf_counter(), time.process_time()
+        for payload in payloads:
+            sent = time.perf_counter()
+            sender.transmit(payload)
+            latencies.append(time.perf_counter() - sent)
+        return make_result(len(payloads), len(payloads) * self.payload_size,
+                           time.perf_counter() - start, time.process_time() - cpu_start, latencies)
+
+    def stream(self, pipelined:bool=True):
+        '''RF24.stream() of a file into monitor() on the other radio, end to end.'''
+        receiver, simulated = self.radio(1)
+        sender, _ = self.radio(0, simulated)
+        with tempfile.TemporaryDirectory() as directory:
+            source = os.path.join(directory, 'source')
+            output = os.path.join(directory, 'output')
+            with open(source, mode='wb') as file:
+                file.write(b''.join(make_payloads(self.frames, self.payload_size)))
+            monitor = threading.Thread(target=receiver.monitor, args=(output,), daemon=True)
+            monitor.start()
+
+            start, cpu_start = time.perf_counter(), time.process_time()
+            sender.stream(source, pipelined=pipelined)
+            sender.transmit('STOP')
+            monitor.join()
+            result = make_result(self.frames, self.frames * self.payload_size,
+                                 time.perf_counter() - start, time.process_time() - cpu_start)
+            with open(source, mode='rb') as expected, open(output, mode='rb') as received:
+                result['intact'] = expected.read() == received.read()
+        return result
+
+    def receive_stream(self, through_monitor:bool=False):
+        '''Drain a backlog of stream payloads with _receive_stream(), or with monitor() if through_monitor.'''
+        radio, simulated = self.radio(0)
+        payloads = make_payloads(self.frames, self.payload_size)
+        if through_monitor:
+            simulated.send('receive_stream')
+        for payload in payloads:
+            simulated.send(payload)
+        simulated.send('stop_stream')
+        if through_monitor:
+            simulated.send('STOP')
+
+        with tempfile.TemporaryDirectory() as directory:
+            output = os.path.join(directory, 'output')
+            start, cpu_start = time.perf_counter(), time.process_time()
+            if through_monitor:
+                radio.monitor(output)
+            else:
+                radio._receive_stream(output)
+            result = make_result(len(payloads), len(payloads) * self.payload_size,
+                                 time.perf_counter() - start, time.process_time() - cpu_start)
+            with open(output, mode='rb') as received:
+                result['intact'] = received.read() == b''.join(payloads)
+        return result
+
+    def triage(self):
+        '''Triage.add() on in-memory JPEG frames, decoding included.'''
+        from ..camera.triage import Triage
+
+        frames = make_frames(min(self.frames, TRIAGE_DISTINCT_FRAMES))
+        triage = Triage()
+
+        latencies = []
+        num_bytes = 0
+        start, cpu_start = time.perf_counter(), time.process_time()
+        for index in range(self.frames):
+            frame = frames[index % len(frames)]
+            scored = time.perf_counter()
+            triage.add(frame, str(index))
+            latencies.append(time.perf_counter() - scored)
+            num_bytes += len(frame)
+        return make_result(self.frames, num_bytes, time.perf_counter() - start,
+                           time.process_time() - cpu_start, latencies)
+
+
+BENCHMARKS = {
+    'mcu-receive': Bench.mcu_receive,
+    'mcu-wait': Bench.mcu_wait,
+    'transmit': Bench.transmit,
+    'stream': lambda bench: bench.stream(pipelined=True),
+    'receive-stream': lambda bench: bench.receive_stream(),
+    'monitor': lambda bench: bench.receive_stream(through_monitor=True),
+    'triage': Bench.triage,
+}
+
+
+def run(names, **options):
+    '''Run benchmarks by name.
+
+    Params:
+        - names: the benchmarks to run, see BENCHMARKS.
+        - options: passed to Bench.
+
+    Return:
+        - a dict of results by benchmark name.
+    '''
+    results = {}
+    for name in names:
+        bench = Bench(**options)
+        try:
+            results[name] = BENCHMARKS[name](bench)
+        finally:
+            bench.close()
+    return results
+
+def compare(before:dict, after:dict, threshold:float=0.1):
+    '''Compare the results of two runs.
+
+    Return:
+        - a list of (benchmark, metric, before, after, change, regressed) tuples,
+            change is the relative change, regressed is True if it got worse by
+            more than threshold.
+    '''
+    rows = []
+    for name, result in after['results'].items():
+        previous = before['results'].get(name)
+        if previous is None:
+            continue
+        for metric in METRICS + STARTUP_METRICS:
+            old, new = previous.get(metric), result.get(metric)
+            if not old or new is None:
+                continue
+            change = (new - old) / old
+            worse = -change if metric in HIGHER_IS_BETTER else change
+            rows.append((name, metric, old, new, change, worse > threshold))
+    return rows
+
+def parse_importtime(output:str):
+    '''Read the -X importtime report of an interpreter.
+
+    Return:
+        - a list of (module, self us, cumulative us, depth), in import order.
+    '''
+    imports = []
+    for line in output.splitlines():
+        if not line.startswith('import time:') or 'cumulative' in line:
+            continue
+        own, cumulative, name = line[len('import time:'):].split('|')
+        depth = (len(name) - len(name.lstrip())) // 2 - 1
+        imports.append((name.strip(), int(own), int(cumulative), depth))
+    return imports
+
+def startup(command:str, arguments=('--help',), repeat:int=5, top:int=5):
+    '''Time a satsystems command from a fresh interpreter until it exits.
+
+    Params:
+        - command: one of cli.COMMANDS.
+        - arguments (optional): what the command is run with, by default --help
+            so only the imports needed to parse the arguments are counted.
+        - repeat (optional): runs, the median of each metric is kept.
+        - top (optional): the slowest imports listed in the result.
+
+    Return:
+        - a dict with import_ms, the time spent importing, startup_ms, the
+            time until the interpreter exits, and the slowest imports by
+            cumulative time.
+    '''
+    run = [sys.executable, '-X', 'importtime', '-m', 'satsystems', command, *arguments]
+    imports_ms, startups_ms = [], []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        done = subprocess.run(run, stdout=subprocess.DEVNULL, stderr=subprocess.PIPE, text=True)
+        startups_ms.append((time.perf_counter() - start) * 1000)
+        imports = parse_importtime(done.stderr)
+        imports_ms.append(sum(cumulative for _, _, cumulative, depth in imports if depth == 0) / 1000)
+    slowest = sorted((entry for entry in imports if not entry[0].startswith('satsystems')), key=lambda entry: -entry[2])
+    return {
+        'command': ' '.join([command, *arguments]),
+        'import_ms': statistics.median(imports_ms),
+        'startup_ms': statistics.median(startups_ms),
+        'slowest': [{'module': name, 'cumulative_ms': cumulative / 1000} for name, _, cumulative, _ in slowest[:top]],
+        'exit_code': done.returncode,
+    }
+
+def environment():
+    '''Describe where a run happened, stored next to the results.'''
+    try:
+        from importlib.metadata import version
+        package_version = version('satsystems')
+    except Exception:
+        package_version = 'unknown'
+    return {
+        'version': package_version,
+        'python': platform.python_version(),
+        'platform': platform.platform(),
+        'time': time.strftime('%Y-%m-%dT%H:%M:%S'),
+    }
+
+
+def parse_cmdline():
+    parser = argparse.ArgumentParser(description='Benchmark the serial and radio stack against simulated hardware.')
+
+    subparser = parser.add_subparsers()
+
+    run_parser = subparser.add_parser('run', help='Run benchmarks.')
+    run_parser.add_argument('-b', '--benchmark', nargs='+', choices=BENCHMARKS, default=list(BENCHMARKS), help='The benchmarks to run, all if not given.')
+    run_parser.add_argument('-n', '--frames', type=int, default=2000, help='Frames per benchmark.')
+    run_parser.add_argument('--payload-size', type=int, default=32, help='Bytes per frame, at most 32.')
+    run_parser.add_argument('--binary', action='store_true', help='Use binary safe COBS framing.')
+    run_parser.add_argument('--baud', type=int, default=0, help='Simulated serial port speed in bits per second, 0 for no limit.')
+    run_parser.add_argument('--latency', type=float, default=0.0, help='Simulated seconds each payload spends on air.')
+    run_parser.add_argument('--loss', type=float, default=0.0, help='Simulated probability that a payload is lost on air.')
+    run_parser.add_argument('--log-level', type=str, default='warning', help='Log level of the radios while benchmarking.')
+    run_parser.add_argument('--async-log', action='store_true', help='Write the radio logs from a background thread.')
+    run_parser.add_argument('-o', '--output', type=str, help='Save the results to this JSON file.')
+    run_parser.set_defaults(function=do_run)
+
+    startup_parser = subparser.add_parser('startup', help='Time the startup and imports of the satsystems commands.')
+    startup_parser.add_argument('-c', '--command', nargs='+', help='The commands to time, all if not given.')
+    startup_parser.add_argument('-a', '--arguments', nargs=argparse.REMAINDER, default=['--help'], help='What the commands are run with, --help if not given.')
+    startup_parser.add_argument('-n', '--repeat', type=int, default=5, help='Runs per command, the median is reported.')
+    startup_parser.add_argument('--top', type=int, default=3, help='The slowest imports listed per command.')
+    startup_parser.add_argument('-o', '--output', type=str, help='Save the results to this JSON file, compare them with the compare command.')
+    startup_parser.set_defaults(function=do_startup)
+
+    compare_parser = subparser.add_parser('compare', help='Compare two saved runs.')
+    compare_parser.add_argument('before', type=str, help='The JSON results of the earlier run.')
+    compare_parser.add_argument('after', type=str, help='The JSON results of the later run.')
+    compare_parser.add_argument('-t', '--threshold', type=float, default=0.1, help='Relative change counted as a regression.')
+    compare_parser.set_defaults(function=do_compare)
+
+    return parser.parse_args()
+
+def do_run(options):
+    settings = {
+        'frames': options.frames,
+        'payload_size': options.payload_size,
+        'framing': 'cobs' if options.binary else 'marker',
+        'baud': options.baud,
+        'latency': options.latency,
+        'loss': options.loss,
+        'log_level': options.log_level,
+    }
+    if options.async_log:
+        SatelliteLogger.use_async()
+    results = run(options.benchmark, **settings)
+    settings['async_log'] = options.async_log
+
+    print(f'{"benchmark":>15} {"frames/s":>10} {"bytes/s":>11} {"p50 ms":>8} {"p99 ms":>8} {"cpu us/frame":>12}')
+    for name, result in results.items():
+        cells = [f'{result[metric]:.3f}' if result[metric] is not None else '-' for metric in METRICS]
+        print(f'{name:>15} {cells[0]:>10} {cells[1]:>11} {cells[2]:>8} {cells[3]:>8} {cells[4]:>12}')
+        if result.get('intact') is False:
+            print(f'{name:>15} received data does not match what was sent!')
+
+    if options.output:
+        with open(options.output, mode='w') as file:
+            json.dump({'environment': environment(), 'settings': settings, 'results': results}, file, indent=2)
+    return 0
+
+def do_startup(options):
+    from ..cli import COMMANDS
+
+    results = {}
+    print(f'{"command":>15} {"import ms":>10} {"startup ms":>11}  slowest imports')
+    for command in options.command or COMMANDS:
+        result = results[command] = startup(command, options.arguments, options.repeat, options.top)
+        slowest = ', '.join(f'{entry["module"]} {entry["cumulative_ms"]:.1f}' for entry in result['slowest'])
+        print(f'{command:>15} {result["import_ms"]:>10.1f} {result["startup_ms"]:>11.1f}  {slowest}')
+
+    if options.output:
+        settings = {'arguments': options.arguments, 'repeat': options.repeat}
+        with open(options.output, mode='w') as file:
+            json.dump({'environment': environment(), 'settings': settings, 'results': results}, file, indent=2)
+    return 0
+
+def do_compare(options):
+    with open(options.before) as file:
+        before = json.load(file)
+    with open(options.after) as file:
+        after = json.load(file)
+
+    regressions = 0
+    print(f'{"benchmark":>15} {"metric":>16} {"before":>12} {"after":>12} {"change":>8}')
+    for name, metric, old, new, change, regressed in compare(before, after, options.threshold):
+        regressions += regressed
+        flag = '  REGRESSION' if regressed else ''
+        print(f'{name:>15} {metric:>16} {old:>12.3f} {new:>12.3f} {change:>+8.1%}{flag}')
+    return 1 if regressions else 0
+
+def main():
+    options = parse_cmdline()
+    sys.exit(options.function(options))
+
+if __name__ == '__main__':
+    main()
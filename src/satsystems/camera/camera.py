@@ -1,4 +1,13 @@
+from pathlib import Path
 import argparse
+import json
+import os
+import shutil
+import time
+from .convert import convert
+from .session import CaptureSession, FakeCamera, DEFAULT_CAPACITY, DEFAULT_WARMUP_S
+
+IMAGE_SUFFIXES = ('.jpg', '.jpeg', '.png', '.bmp')
 
 def parse_cmdline():
     parser = argparse.ArgumentParser(description='Control Camera Module.')
@@ -11,34 +20,152 @@ def parse_cmdline():
 
     video_parser = subparser.add_parser('video', help='Record a video.')
     video_parser.add_argument('-f', '--filename', type=str, help='Name of output file.')
+    video_parser.add_argument('-d', '--duration', type=float, default=5, help='Seconds to record.')
     video_parser.set_defaults(function=do_video)
 
+    burst_parser = subparser.add_parser('burst', help='Capture frames continuously after a single warm-up.')
+    burst_parser.add_argument('-r', '--framerate', type=int, default=16, help='Frames per second.')
+    burst_parser.add_argument('-d', '--duration', type=float, help='Seconds to capture for.')
+    burst_parser.add_argument('-n', '--count', type=int, help='Frames to capture, 5 seconds worth if neither this nor --duration is given.')
+    burst_parser.add_argument('-o', '--output-dir', type=str, default='./data/', help='Where the frames are written.')
+    burst_parser.add_argument('--capacity', type=int, default=DEFAULT_CAPACITY, help='Frames buffered in memory before the oldest unwritten one is dropped.')
+    burst_parser.add_argument('--fake', action='store_true', help='Use a fake camera, to try out capture without the Pi camera.')
+    burst_parser.add_argument('--triage', type=int, metavar='N', help='Score frames before they are written, skip the rejected ones and list the best N.')
+    burst_parser.set_defaults(function=do_burst, needs_camera=False)
+
+    triage_parser = subparser.add_parser('triage', help='Score images and queue the best ones for downlink.')
+    triage_parser.add_argument('-f', '--filename', type=str, nargs='+', required=True, help='Images, or directories of them, in capture order.')
+    triage_parser.add_argument('-n', '--top', type=int, default=5, help='Images selected for downlink.')
+    triage_parser.add_argument('-q', '--queue', type=str, help='Copy the selected images to this downlink queue directory.')
+    triage_parser.add_argument('-r', '--report', type=str, help='Save the scores of every image to this JSON file.')
+    triage_parser.set_defaults(function=do_triage, needs_camera=False)
+
     converter_parser = subparser.add_parser('convert', help='Convert to and from Images and Base64 strings.')
-    converter_parser.add_argument('-f', '--filename', type=str, help='Path to the image file.')
+    converter_parser.add_argument('-f', '--filename', type=str, help='Path to the image file, or a directory of them.')
     converter_parser.add_argument('-b', '--base64', action='store_true', help='Change to base64 to iamge conversion.')
-    converter_parser.set_defaults(function=do_conversion)
+    converter_parser.add_argument('--format', type=str, help='Re-encode decoded images to this format, ex: png. Kept as they were encoded if not given.')
+    converter_parser.add_argument('-o', '--output-dir', type=str, default='./data/', help='Where the converted files are written.')
+    converter_parser.add_argument('-w', '--workers', type=int, help='Processes converting a directory, the number of cores if not given.')
+    converter_parser.set_defaults(function=do_conversion, needs_camera=False)
+
+    downlink_parser = subparser.add_parser('downlink', help='Send an image to the ground station, thumbnail first then tile by tile.')
+    downlink_parser.add_argument('-f', '--filename', type=str, help='The image to send.')
+    downlink_parser.add_argument('--capture', action='store_true', help='Capture a new image and send it instead of a file.')
+    downlink_parser.add_argument('--tile-size', type=int, help='The side of a tile in pixels, 128 if not given.')
+    downlink_parser.add_argument('--quality', type=int, help='The JPEG quality of the tiles, 60 if not given.')
+    downlink_parser.add_argument('-w', '--workers', type=int, default=1, help='Processes encoding tiles while the radio sends.')
+    downlink_parser.add_argument('--detail-first', action='store_true', help='Send the tiles with the most detail first instead of the center first.')
+    downlink_parser.set_defaults(function=do_downlink, needs_camera=False)
+
+    receive_parser = subparser.add_parser('receive-downlink', help='Receive an image sent with downlink, saving it as tiles arrive.')
+    receive_parser.add_argument('-f', '--filename', type=str, default='downlink.jpg', help='Where to save the image.')
+    receive_parser.set_defaults(function=do_receive_downlink, needs_camera=False)
 
-    return parser.parse_args()
+    for radio_parser in (downlink_parser, receive_parser):
+        radio_parser.add_argument('-p', '--port', metavar='port', type=str, help='The port the radio is connected to.')
+        radio_parser.add_argument('-i', '--uid', metavar='uid', type=int, help='The unique identification number of the connected radio.')
+        radio_parser.add_argument('--binary', action='store_true', help='Use binary safe COBS framing, the radio firmware must be built with BINARY_FRAMING.')
+
+    options = parser.parse_args()
+    if getattr(options, 'function', None) is do_downlink and not (options.filename or options.capture):
+        downlink_parser.error('an image to send is required, give -f/--filename or --capture')
+    return options
 
 def do_shot(camera, options):
     camera.shot()
 
 def do_video(camera, options):
-    camera.video()
+    camera.video(duration=options.duration)
+
+def do_burst(camera, options):
+    if options.fake:
+        camera = FakeCamera(framerate=options.framerate)
+    else:
+        from .picam import PiCam
+        camera = PiCam(framerate=options.framerate)
+    count = options.count
+    if count is None and options.duration is None:
+        count = options.framerate * 5
+    triage = None
+    if options.triage:
+        from .triage import Triage
+        triage = Triage(options.triage)
+    session = CaptureSession(camera, warmup_s=0 if options.fake else DEFAULT_WARMUP_S,
+                             capacity=options.capacity, output_dir=options.output_dir, triage=triage)
+    with session:
+        start = time.monotonic()
+        captured = session.capture(count, options.duration)
+        elapsed = time.monotonic() - start
+    print(f'captured {captured} frames in {elapsed:.2f} s, {len(session.writer.written)} written, '
+          f'{session.ring.dropped} dropped')
+    if triage is not None:
+        for name in triage.selected():
+            print(name)
+
+def do_triage(camera, options):
+    from .triage import Triage
+
+    paths = []
+    for path in options.filename:
+        if os.path.isdir(path):
+            paths += sorted(str(file) for file in Path(path).iterdir() if file.suffix.lower() in IMAGE_SUFFIXES)
+        else:
+            paths.append(path)
+
+    triage = Triage(options.top)
+    for path in paths:
+        score = triage.add(path)
+        print(f'{score.score:.3f} {score.rejected or "kept":>9} {path}')
+    selected = triage.selected()
+    print(f'selected {len(selected)} of {len(paths)} images')
+    if options.queue:
+        os.makedirs(options.queue, exist_ok=True)
+        for path in selected:
+            shutil.copy2(path, options.queue)
+    if options.report:
+        with open(options.report, mode='w') as file:
+            json.dump({'selected': selected, 'scores': triage.report()}, file, separators=(',', ':'))
 
 def do_conversion(camera, options):
     file_path = options.filename
     use_base64 = options.base64
-    if use_base64:
-        camera.base64_to_image(file_path)
-    else:
-        camera.image_to_base64(file_path)
+    for output in convert(file_path, use_base64, options.output_dir, options.format, options.workers):
+        print(output)
 
-def main():
-    from .picam import PiCam
+def _radio_link(options):
+    from ..radio.rf24 import RF24, RF24Link
+    return RF24Link(RF24(uid=options.uid, port=options.port, framing='cobs' if options.binary else 'marker'))
+
+def do_downlink(camera, options):
+    from .downlink import DownlinkSender, center_first
+    from .triage import detail_first
 
+    filename = options.filename
+    if options.capture:
+        from .picam import PiCam
+        filename = PiCam().shot()
+    settings = {'tile_size': options.tile_size, 'quality': options.quality}
+    settings = {name: value for name, value in settings.items() if value is not None}
+    priority = detail_first if options.detail_first else center_first
+    with DownlinkSender(_radio_link(options), workers=options.workers, priority=priority, **settings) as sender:
+        sent = sender.send_image(filename)
+    print(f'sent {len(sent)} units of {filename}')
+
+def do_receive_downlink(camera, options):
+    from .downlink import DownlinkReceiver
+
+    assembly = DownlinkReceiver(_radio_link(options)).receive_image(options.filename)
+    if assembly.grid is None:
+        print('no image received')
+        return
+    print(f'received {len(assembly.tiles)} of {assembly.grid.num_tiles} tiles into: {options.filename}')
+
+def main():
     option = parse_cmdline()
-    cam = PiCam()
+    cam = None
+    if getattr(option, 'needs_camera', True):
+        from .picam import PiCam
+        cam = PiCam()
     option.function(cam, options=option)
 
 if __name__ == '__main__':
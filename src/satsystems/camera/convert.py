@@ -0,0 +1,174 @@
+'''Convert images to and from base64 text files in constant memory.
+
+Files are streamed in chunks: encoding reads a multiple of 3 bytes at a
+time and decoding a multiple of 4 characters, so every chunk maps to a
+whole number of base64 quanta and the chunks join without padding in
+between. Decoding writes the original bytes straight back out, the image
+is only opened with PIL when a format conversion is asked for.
+'''
+from pathlib import Path
+import base64
+import binascii
+import os
+import tempfile
+from ..common import metrics
+from ..common.files import file_mode
+
+# bytes read per encoding step and characters read per decoding step, both are 192 KiB of data
+ENCODE_CHUNK = 3 * 64 * 1024
+DECODE_CHUNK = 4 * 64 * 1024
+
+CONVERT_TIME = metrics.histogram('camera.convert_ms')
+CONVERTED_BYTES = metrics.counter('camera.converted_bytes')
+
+# file signatures, to name a decoded file after what it holds
+SIGNATURES = (
+    (b'\xff\xd8\xff', '.jpg'),
+    (b'\x89PNG\r\n\x1a\n', '.png'),
+    (b'GIF8', '.gif'),
+    (b'BM', '.bmp'),
+)
+
+_WHITESPACE = b' \t\r\n'
+
+
+def encode_file(input_file:str, output_file:str, chunk_size:int=ENCODE_CHUNK):
+    '''Write the base64 encoding of a file, on a single line.
+
+    Params:
+        - chunk_size (optional): bytes read at a time, rounded down to a multiple of 3.
+
+    Return:
+        - the number of characters written.
+    '''
+    chunk_size = max(3, chunk_size // 3 * 3)
+    written = 0
+    with CONVERT_TIME.time():
+        with open(input_file, mode='rb') as source, open(output_file, mode='wb') as out:
+            while True:
+                chunk = source.read(chunk_size)
+                if not chunk:
+                    break
+                written += out.write(base64.b64encode(chunk))
+    CONVERTED_BYTES.inc(written)
+    return written
+
+def decode_chunks(source, chunk_size:int=DECODE_CHUNK):
+    '''Decode base64 text from a binary file object, ignoring line breaks and spaces.
+
+    Return:
+        - a generator of decoded byte strings.
+
+    Raises:
+        ValueError: if the text is not valid base64.
+    '''
+    chunk_size = max(4, chunk_size // 4 * 4)
+    pending = b''
+    while True:
+        chunk = source.read(chunk_size)
+        if not chunk:
+            break
+        if any(space in chunk for space in _WHITESPACE):
+            chunk = chunk.translate(None, _WHITESPACE)
+        pending += chunk
+        usable = len(pending) // 4 * 4
+        if usable:
+            try:
+                yield base64.b64decode(pending[:usable], validate=True)
+            except binascii.Error as e:
+                raise ValueError(f'not valid base64: {e}') from e
+            pending = pending[usable:]
+    if pending:
+        raise ValueError(f'base64 text ends with {len(pending)} stray characters')
+
+def guess_suffix(data:bytes):
+    '''The file extension matching the first bytes of a file, .bin if unknown.'''
+    for signature, suffix in SIGNATURES:
+        if data.startswith(signature):
+            return suffix
+    return '.bin'
+
+def decode_file(input_file:str, output_file:str=None, output_dir:str='./data/', image_format:str=None,
+                chunk_size:int=DECODE_CHUNK):
+    '''Write the bytes a base64 text file holds.
+
+    Params:
+        - output_file (optional): where to write, by default the input's name
+            in output_dir with an extension guessed from the decoded bytes,
+            or the one of image_format.
+        - image_format (optional): re-encode the image to this PIL format, ex:
+            'png'. If not given the bytes are written as they were encoded.
+
+    Return:
+        - the path written.
+
+    Raises:
+        ValueError: if the text is not valid base64.
+    '''
+    if output_file is None:
+        os.makedirs(output_dir, exist_ok=True)
+    with CONVERT_TIME.time():
+        with open(input_file, mode='rb') as source, tempfile.NamedTemporaryFile(
+                dir=os.path.dirname(output_file) if output_file else output_dir, delete=False) as out:
+            try:
+                first = b''
+                for data in decode_chunks(source, chunk_size):
+                    first = first or data
+                    out.write(data)
+            except ValueError:
+                out.close()
+                os.remove(out.name)
+                raise
+
+        if output_file is None:
+            suffix = f'.{image_format.lower()}' if image_format else guess_suffix(first)
+            output_file = os.path.join(output_dir, Path(input_file).stem + suffix)
+        if image_format:
+            from PIL import Image
+            try:
+                with Image.open(out.name) as image:
+                    image.save(output_file, format=image_format)
+            finally:
+                os.remove(out.name)
+        else:
+            os.chmod(out.name, file_mode(output_file))     # not the temp file's 0600
+            os.replace(out.name, output_file)
+    CONVERTED_BYTES.inc(os.path.getsize(output_file))
+    return output_file
+
+def _convert_one(path:str, to_image:bool, output_dir:str, image_format:str):
+    if to_image:
+        return decode_file(path, output_dir=output_dir, image_format=image_format)
+    output_file = os.path.join(output_dir, Path(path).stem + '.txt')
+    encode_file(path, output_file)
+    return output_file
+
+def convert(path:str, to_image:bool=False, output_dir:str='./data/', image_format:str=None, workers:int=None):
+    '''Convert a file, or every file in a directory, to or from base64.
+
+    Directories are converted in a process pool, one file per worker, so
+    large batches use every core.
+
+    Params:
+        - path: a file, or a directory of files.
+        - to_image (optional): decode the .txt files to images instead of encoding images.
+        - output_dir (optional): where the converted files are written.
+        - image_format (optional): see decode_file.
+        - workers (optional): processes for a directory, the number of cores if not given.
+
+    Return:
+        - the list of files written.
+    '''
+    os.makedirs(output_dir, exist_ok=True)
+    if not os.path.isdir(path):
+        return [_convert_one(path, to_image, output_dir, image_format)]
+
+    inputs = sorted(str(file) for file in Path(path).iterdir()
+                    if file.is_file() and (file.suffix == '.txt') == to_image)
+    if len(inputs) <= 1 or workers == 1:
+        return [_convert_one(file, to_image, output_dir, image_format) for file in inputs]
+
+    from concurrent.futures import ProcessPoolExecutor
+    with ProcessPoolExecutor(max_workers=workers) as pool:
+        return list(pool.map(_convert_one, inputs, [to_image] * len(inputs), [output_dir] * len(inputs),
+                             [image_format] * len(inputs)))
@@ -0,0 +1,356 @@
+'''Progressive image downlink: a thumbnail first, then tiles in priority order.
+
+A full capture takes a whole pass to send over 32 byte payloads. Instead,
+the image is cut into units that are each useful on their own:
+
+    - the manifest: the image size and the tile grid.
+    - the thumbnail: the whole image, small and heavily compressed.
+    - the tiles: independent JPEGs of tile_size squares, most important first.
+
+Each unit is sent as its own reliable transfer (see radio.arq) and starts
+with a header naming the image and the unit, so units can arrive in any
+order. After every unit the ground station may answer with a control
+packet: stop, or send these tiles next. If no answer comes the tiles keep
+coming in priority order.
+
+The ground station only answers once its receiver has stopped lingering,
+so it keeps answering a sender whose FINISHED reply was lost, and the
+receiver of the next unit answers a status request still left over. The
+timings must nest: the sender's retry timeout < the receiver's linger <
+the sender's control_timeout.
+
+Units are encoded in a process pool, one task per unit, so the next units
+are being encoded while the current one is on air and capture can carry on.
+
+    with DownlinkSender(RF24Link(radio)) as sender:
+        sender.send_image(camera.shot())
+
+    receiver = DownlinkReceiver(RF24Link(radio))
+    assembly = receiver.receive_image('pass.jpg')
+'''
+from concurrent.futures import ProcessPoolExecutor
+from dataclasses import dataclass, field
+import io
+import os
+import struct
+from PIL import Image
+from ..radio.arq import ReliableSender, ReliableReceiver, PacketError, CRC_SIZE, encode_packet, decode_packet, data_size
+from ..radio.filesource import PacketSource
+
+UNIT_HEADER = struct.Struct('>BBH')             # image id, kind, index
+MANIFEST = struct.Struct('>HHHHHH')             # width, height, tile width, tile height, columns, rows
+MAX_TILES = 1 << 16                             # tile indices are sent as '>H'
+
+KIND_MANIFEST = 0
+KIND_THUMBNAIL = 1
+KIND_TILE = 2
+KIND_END = 3
+
+CONTROL = b'C'
+CONTROL_NEXT = b'N'         # carry on in priority order
+CONTROL_STOP = b'S'         # nothing more of this image
+CONTROL_REQUEST = b'R'      # followed by '>H' tile indices to send next, in that order
+
+DEFAULT_TILE_SIZE = 128
+DEFAULT_THUMBNAIL_SIZE = (64, 48)
+DEFAULT_QUALITY = 60
+THUMBNAIL_QUALITY = 40
+
+
+@dataclass
+class TileGrid:
+    '''How an image is cut into tiles, tiles are numbered row by row.'''
+    width: int
+    height: int
+    tile_width: int
+    tile_height: int
+
+    @property
+    def columns(self):
+        return -(-self.width // self.tile_width)
+
+    @property
+    def rows(self):
+        return -(-self.height // self.tile_height)
+
+    @property
+    def num_tiles(self):
+        return self.columns * self.rows
+
+    def box(self, index:int):
+        '''The (left, upper, right, lower) pixels of a tile.'''
+        row, column = divmod(index, self.columns)
+        left, upper = column * self.tile_width, row * self.tile_height
+        return left, upper, min(left + self.tile_width, self.width), min(upper + self.tile_height, self.height)
+
+    def pack(self):
+        return MANIFEST.pack(self.width, self.height, self.tile_width, self.tile_height, self.columns, self.rows)
+
+    @classmethod
+    def unpack(cls, data:bytes):
+        width, height, tile_width, tile_height, _, _ = MANIFEST.unpack(data[:MANIFEST.size])
+        return cls(width, height, tile_width, tile_height)
+
+
+def center_first(grid:TileGrid, path:str=None):
+    '''The default tile order: nearest to the center of the image first.'''
+    center_x, center_y = grid.width / 2, grid.height / 2
+
+    def distance(index):
+        left, upper, right, lower = grid.box(index)
+        return ((left + right) / 2 - center_x) ** 2 + ((upper + lower) / 2 - center_y) ** 2
+    return sorted(range(grid.num_tiles), key=distance)
+
+
+_OPEN_IMAGE = (None, None)
+
+def _load(path:str):
+    '''Decode an image once per worker process, every unit of it reuses the pixels.'''
+    global _OPEN_IMAGE
+    key = (path, os.path.getmtime(path))
+    if _OPEN_IMAGE[0] != key:
+        with Image.open(path) as image:
+            _OPEN_IMAGE = (key, image.convert('RGB'))
+    return _OPEN_IMAGE[1]
+
+def encode_unit(path:str, kind:int, index:int, grid:TileGrid, quality:int=DEFAULT_QUALITY,
+                thumbnail_size=DEFAULT_THUMBNAIL_SIZE):
+    '''Encode a single unit of an image, without its header. Runs in a worker process.'''
+    if kind == KIND_MANIFEST:
+        return grid.pack()
+    image = _load(path)
+    if kind == KIND_THUMBNAIL:
+        image = image.copy()
+        image.thumbnail(thumbnail_size)
+        quality = THUMBNAIL_QUALITY
+    else:
+        image = image.crop(grid.box(index))
+    out = io.BytesIO()
+    image.save(out, format='JPEG', quality=quality, optimize=True)
+    return out.getvalue()
+
+
+class DownlinkSender:
+    '''Sends images unit by unit over a packet link, encoding ahead in a process pool.'''
+
+    def __init__(self, link, tile_size:int=DEFAULT_TILE_SIZE, quality:int=DEFAULT_QUALITY, workers:int=1,
+                 priority=center_first, control_timeout:float=3.0, timeout:float=0.5):
+        '''
+        Params:
+            - link: the link to send over, see radio.arq.
+            - tile_size (optional): the side of a tile in pixels.
+            - quality (optional): the JPEG quality of the tiles.
+            - workers (optional): processes encoding units.
+            - priority (optional): a function of (grid, path) returning the tile
+                indices in the order they should be sent.
+            - control_timeout (optional): seconds to wait for the ground
+                station's answer after each unit.
+            - timeout (optional): seconds between status requests, see
+                ReliableSender. Must be shorter than the receiver's linger.
+
+        Raises:
+            ValueError: if tile_size is not between 1 and 65535 pixels.
+        '''
+        if not 0 < tile_size < 1 << 16:
+            raise ValueError(f'tile size of {tile_size} pixels, between 1 and 65535 is expected.')
+        self.tile_size = tile_size
+        self.quality = quality
+        self.priority = priority
+        self.control_timeout = control_timeout
+        self._link = link
+        self._sender = ReliableSender(link, timeout)
+        self._pool = ProcessPoolExecutor(max_workers=workers)
+        self._futures = {}          # unit to the encoding of it not sent yet, for the image being sent
+        self._next_image = 0
+
+    def send_image(self, path:str, image_id:int=None):
+        '''Send an image until every tile is sent or the ground station stops it.
+
+        If the ground station stops answering the image is ended early.
+
+        Return:
+            - the list of (kind, index) units sent, in order.
+
+        Raises:
+            ValueError: if the image is larger than 65535 pixels a side, or cuts into more than MAX_TILES tiles.
+        '''
+        with Image.open(path) as image:
+            grid = TileGrid(image.width, image.height, self.tile_size, self.tile_size)
+        if max(grid.width, grid.height) >= 1 << 16 or grid.num_tiles > MAX_TILES:
+            raise ValueError(f'{grid.width}x{grid.height} image in {grid.num_tiles} tiles, use a larger tile size.')
+        if image_id is None:
+            image_id, self._next_image = self._next_image, (self._next_image + 1) % 256
+
+        # the encoding of every unit is queued at once, workers keep ahead of the radio
+        encode = lambda kind, index: self._pool.submit(encode_unit, path, kind, index, grid, self.quality)
+        order = [(KIND_MANIFEST, 0), (KIND_THUMBNAIL, 0)] + [(KIND_TILE, index) for index in self.priority(grid, path)]
+        futures = self._futures = {unit: encode(*unit) for unit in order}
+
+        sent = []
+        try:
+            while order:
+                unit = order.pop(0)
+                self._send_unit(image_id, *unit, futures.pop(unit).result())
+                sent.append(unit)
+                command, tiles = self._wait_for_control()
+                if command == CONTROL_STOP:
+                    break
+                if command == CONTROL_REQUEST:
+                    requested = list(dict.fromkeys((KIND_TILE, index) for index in tiles if index < grid.num_tiles))
+                    order = requested + [unit for unit in order if unit not in requested]
+                    for unit in requested:
+                        if unit not in futures:     # already sent once, send it again
+                            futures[unit] = encode(*unit)
+        except TimeoutError:
+            pass        # the ground station is gone, end the image in case it comes back
+        finally:
+            self._cancel()
+        try:
+            self._send_unit(image_id, KIND_END, 0, b'')
+        except TimeoutError:
+            pass
+        return sent
+
+    def close(self):
+        self._cancel()
+        self._pool.shutdown(wait=True)
+
+    def _cancel(self):
+        '''Drop the encodings queued and not started yet.'''
+        for future in self._futures.values():
+            future.cancel()
+        self._futures = {}
+
+    def _send_unit(self, image_id:int, kind:int, index:int, data:bytes):
+        payload_size = data_size(self._link.packet_size)
+        data = UNIT_HEADER.pack(image_id, kind, index) + data
+        self._sender.send(PacketSource(data[i:i + payload_size] for i in range(0, len(data), payload_size)))
+
+    def _wait_for_control(self):
+        '''
+        Return:
+            - (command, requested tile indices), (None, []) if the ground station did not answer.
+        '''
+        while True:
+            packet = self._link.receive(self.control_timeout)
+            if packet is None:
+                return None, []
+            try:
+                kind, body = decode_packet(packet)
+            except PacketError:
+                continue
+            if kind != CONTROL or not body:
+                continue    # a late reply to the transfer that just finished
+            command, rest = body[:1], body[1:]
+            tiles = [index for (index,) in struct.iter_unpack('>H', rest[:len(rest) // 2 * 2])]
+            return command, tiles
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+
+@dataclass
+class ImageAssembly:
+    '''The units of an image received so far.'''
+    image_id: int
+    grid: TileGrid = None
+    thumbnail: bytes = None
+    tiles: dict = field(default_factory=dict)
+    complete: bool = False
+
+    @property
+    def missing_tiles(self):
+        if self.grid is None:
+            return None
+        return [index for index in range(self.grid.num_tiles) if index not in self.tiles]
+
+    def render(self):
+        '''The best picture so far: the thumbnail scaled up, with the tiles received pasted over it.
+
+        Return:
+            - a PIL image, or None before the manifest has arrived.
+        '''
+        if self.grid is None:
+            return None
+        canvas = Image.new('RGB', (self.grid.width, self.grid.height))
+        if self.thumbnail:
+            with Image.open(io.BytesIO(self.thumbnail)) as thumbnail:
+                canvas.paste(thumbnail.convert('RGB').resize(canvas.size))
+        for index, data in self.tiles.items():
+            with Image.open(io.BytesIO(data)) as tile:
+                canvas.paste(tile.convert('RGB'), self.grid.box(index)[:2])
+        return canvas
+
+
+class DownlinkReceiver:
+    '''Receives the units of images sent by a DownlinkSender.'''
+
+    def __init__(self, link, timeout:float=30.0, linger:float=1.0):
+        '''
+        Params:
+            - link: the link to receive on, see radio.arq.
+            - timeout (optional): seconds without any packet before giving up on a unit.
+            - linger (optional): see ReliableReceiver. Must be longer than the
+                sender's timeout and shorter than its control_timeout.
+        '''
+        self._link = link
+        self._receiver = ReliableReceiver(link, timeout, linger)
+
+    def receive_image(self, filename:str=None, select=None):
+        '''Receive the units of one image until the sender ends it.
+
+        Params:
+            - filename (optional): save the picture here after every unit, so
+                it sharpens as tiles arrive.
+            - select (optional): a function called with the ImageAssembly after
+                every unit, returning None to carry on, 'stop', or a list of
+                tile indices to get next.
+
+        Return:
+            - the ImageAssembly, with what arrived if the sender went quiet before ending the image.
+
+        Raises:
+            TimeoutError: if the sender goes quiet before any unit arrived.
+        '''
+        assembly = None
+        while True:
+            sink = io.BytesIO()
+            try:
+                self._receiver.receive(sink)
+            except TimeoutError:
+                if assembly is None:
+                    raise
+                return assembly
+            data = sink.getvalue()
+            image_id, kind, index = UNIT_HEADER.unpack(data[:UNIT_HEADER.size])
+            body = data[UNIT_HEADER.size:]
+            if assembly is None or assembly.image_id != image_id:
+                assembly = ImageAssembly(image_id)
+
+            if kind == KIND_END:
+                assembly.complete = assembly.missing_tiles == []
+                return assembly
+            if kind == KIND_MANIFEST:
+                assembly.grid = TileGrid.unpack(body)
+            elif kind == KIND_THUMBNAIL:
+                assembly.thumbnail = body
+            elif kind == KIND_TILE:
+                assembly.tiles[index] = body
+
+            if filename and assembly.grid is not None:
+                assembly.render().save(filename)
+            self._send_control(select(assembly) if select else None)
+
+    def _send_control(self, answer):
+        if answer is None:
+            body = CONTROL_NEXT
+        elif answer == 'stop':
+            body = CONTROL_STOP
+        else:
+            # as many tiles as fit in one packet, the rest can be asked for after the next unit
+            room = (self._link.packet_size - len(CONTROL) - len(CONTROL_REQUEST) - CRC_SIZE) // 2
+            body = CONTROL_REQUEST + b''.join(struct.pack('>H', index) for index in list(answer)[:room])
+        self._link.send(encode_packet(CONTROL, body))
@@ -2,10 +2,13 @@ import sys, os, io
 from time import sleep
 from datetime import datetime
 from picamera import PiCamera
-import base64
 from pathlib import Path
-from PIL import Image
+from ..common import metrics
+from .convert import encode_file, decode_file
 
+CAPTURES = metrics.counter('camera.captures', short='cc')
+CAPTURE_TIME = metrics.histogram('camera.capture_ms', short='ct')      # from the start of the preview to the saved file
+RECORDINGS = metrics.counter('camera.recordings')
 
 class PiCam(PiCamera):
 
@@ -15,36 +18,34 @@ class PiCam(PiCamera):
         self.resolution = resolution
         self.framerate = framerate
 
-    def shot(self, filename:str='image'):
+    def shot(self, filename:str='image', warmup_s:float=2):
         time_stamp = datetime.now().strftime("%Y-%m-%d-%H:%M:%S")
         output = filename + time_stamp + '.jpg'
 
-        self.start_preview()
-        sleep(2)
-        self.capture(output)
+        with CAPTURE_TIME.time():
+            self.start_preview()
+            sleep(warmup_s)
+            self.capture(output)
+        CAPTURES.inc()
+        return output
 
-    def video(self, filename:str='video'):
+    def video(self, filename:str='video', duration:float=5):
         time_stamp = datetime.now().strftime("%Y-%m-%d-%H:%M:%S")
         output = filename + time_stamp + '.h264'
 
         self.start_preview()
         self.start_recording(output)
-        sleep(5)
+        self.wait_recording(duration)
         self.stop_recording()
         self.stop_preview()
+        RECORDINGS.inc()
 
     def image_to_base64(self, input_file:str):
         output_file = Path(input_file).stem + ".txt"
         output_path = "./data/" + output_file
-        with open(input_file, "rb") as img_file:
-            b64_string = base64.b64encode(img_file.read())
-        with open(output_path, "wb") as txt_file:
-            txt_file.write(b64_string)
+        encode_file(input_file, output_path)
+        return output_path
 
-    def base64_to_image(self, input_file:str):
-        output_file = Path(input_file).stem + ".png"
-        output_path = "./data/" + output_file
-        with open(input_file, "r") as text_file:
-                b64_string = base64.b64decode(text_file.read())
-                img = Image.open(io.BytesIO(b64_string))
-                img.save(output_path)
\ No newline at end of file
+    def base64_to_image(self, input_file:str, image_format:str=None):
+        '''Decode a base64 text file into ./data/, re-encoded to image_format (ex: 'png') only if given.'''
+        return decode_file(input_file, output_dir="./data/", image_format=image_format)
\ No newline at end of file
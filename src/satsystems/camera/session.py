@@ -0,0 +1,232 @@
+'''Continuous capture: warm the camera up once, then capture as fast as the frame rate allows.
+
+PiCam.shot() starts the preview and waits for the sensor to settle on
+every capture. A CaptureSession does that once, then takes JPEGs from the
+video port into a ring buffer in memory. A background thread writes them
+to disk, so a slow card never holds capture up. If the writer falls behind
+by more than the ring holds, the oldest unwritten frames are dropped and
+counted. Given a Triage, the writer scores each frame first and only
+writes the ones it keeps.
+
+    with CaptureSession(PiCam(framerate=10)) as session:
+        session.capture(duration=5)
+
+FakeCamera stands in for the Pi camera, so sessions run on any machine:
+
+    with CaptureSession(FakeCamera(framerate=30), warmup_s=0) as session:
+        session.capture(count=100)
+'''
+from collections import deque
+from dataclasses import dataclass
+from datetime import datetime
+import io
+import os
+import threading
+import time
+from ..common import metrics
+
+DEFAULT_WARMUP_S = 2.0
+DEFAULT_CAPACITY = 32       # frames held in memory waiting to be written
+
+FRAMES = metrics.counter('camera.frames', short='cf')
+FRAMES_DROPPED = metrics.counter('camera.frames_dropped', short='cd')
+FRAME_TIME = metrics.histogram('camera.frame_ms')           # from one frame to the next
+WRITE_TIME = metrics.histogram('camera.frame_write_ms')
+
+
+@dataclass
+class Frame:
+    index: int
+    timestamp: float
+    data: bytes
+
+
+class FrameRing:
+    '''A bounded buffer of frames, putting never blocks: when full the oldest frame is dropped.'''
+
+    def __init__(self, capacity:int=DEFAULT_CAPACITY):
+        self._frames = deque(maxlen=capacity)
+        self._ready = threading.Condition()
+        self._closed = False
+        self.dropped = 0
+
+    def put(self, frame:Frame):
+        with self._ready:
+            if len(self._frames) == self._frames.maxlen:
+                self.dropped += 1
+                FRAMES_DROPPED.inc()
+            self._frames.append(frame)
+            self._ready.notify()
+
+    def get(self):
+        '''Wait for the oldest frame.
+
+        Return:
+            - the Frame, or None once the ring is closed and empty.
+        '''
+        with self._ready:
+            while not self._frames and not self._closed:
+                self._ready.wait()
+            return self._frames.popleft() if self._frames else None
+
+    def close(self):
+        with self._ready:
+            self._closed = True
+            self._ready.notify_all()
+
+    def __len__(self):
+        return len(self._frames)
+
+
+class FrameWriter:
+    '''Writes the frames of a ring to numbered files from a background thread.'''
+
+    def __init__(self, ring:FrameRing, output_dir:str='./data/', prefix:str='frame', triage=None):
+        os.makedirs(output_dir, exist_ok=True)
+        self.written = []
+        self.triage = triage
+        self._ring = ring
+        self._output_dir = output_dir
+        self._prefix = prefix
+        self._thread = threading.Thread(target=self._run, name='frame-writer', daemon=True)
+        self._thread.start()
+
+    def join(self):
+        '''Wait until every frame in the ring is written, the ring must be closed first.'''
+        self._thread.join()
+
+    def _run(self):
+        while True:
+            frame = self._ring.get()
+            if frame is None:
+                return
+            output = os.path.join(self._output_dir, f'{self._prefix}-{frame.index:06d}.jpg')
+            if self.triage is not None and self.triage.add(frame.data, output).rejected:
+                continue
+            with WRITE_TIME.time():
+                with open(output, mode='wb') as out:
+                    out.write(frame.data)
+            self.written.append(output)
+
+
+class FakeCamera:
+    '''A stand-in for PiCamera that makes numbered test pictures at the frame rate.
+
+    Only the members a CaptureSession uses are provided.
+    '''
+
+    def __init__(self, resolution=(320, 240), framerate:int=16):
+        self.resolution = resolution
+        self.framerate = framerate
+        self.previewing = False
+        self.closed = False
+
+    def start_preview(self):
+        self.previewing = True
+
+    def stop_preview(self):
+        self.previewing = False
+
+    def capture_continuous(self, output, format:str='jpeg', use_video_port:bool=False):
+        '''Write a frame to output every 1/framerate seconds and yield output after each one.'''
+        from PIL import Image, ImageDraw
+
+        width, height = self.resolution
+        next_frame = time.monotonic()
+        index = 0
+        while not self.closed:
+            delay = next_frame - time.monotonic()
+            if delay > 0:
+                time.sleep(delay)
+            next_frame += 1 / self.framerate
+
+            image = Image.effect_noise((width, height), 16 + index % 48).convert('RGB')
+            ImageDraw.Draw(image).text((8, 8), f'frame {index}', fill=(255, 255, 255))
+            image.save(output, format=format)
+            index += 1
+            yield output
+
+    def close(self):
+        self.closed = True
+
+
+class CaptureSession:
+    '''A camera kept warm between captures, with frames buffered in memory and written in the background.'''
+
+    def __init__(self, camera=None, warmup_s:float=DEFAULT_WARMUP_S, capacity:int=DEFAULT_CAPACITY,
+                 output_dir:str='./data/', prefix:str=None, triage=None):
+        '''
+        Params:
+            - camera (optional): a PiCam, PiCamera or FakeCamera, a PiCam if not given.
+            - warmup_s (optional): seconds the preview runs before the first frame.
+            - capacity (optional): frames the ring buffer holds before dropping the oldest.
+            - output_dir (optional): where the frames are written.
+            - prefix (optional): the start of the frame file names, 'burst' and the time if not given.
+            - triage (optional): a Triage scoring frames before they are written,
+                rejected frames are never written.
+        '''
+        if camera is None:
+            from .picam import PiCam
+            camera = PiCam()
+        self.camera = camera
+        self.warmup_s = warmup_s
+        self.ring = FrameRing(capacity)
+        self.writer = FrameWriter(self.ring, output_dir,
+                                  prefix or 'burst' + datetime.now().strftime('%Y-%m-%d-%H:%M:%S'), triage)
+        self.frames = 0
+        self._stream = io.BytesIO()
+        self._frames = None
+
+    def open(self):
+        '''Start the preview and wait for the sensor to settle, only the first call waits.'''
+        if self._frames is None:
+            self.camera.start_preview()
+            time.sleep(self.warmup_s)
+            self._frames = self.camera.capture_continuous(self._stream, format='jpeg', use_video_port=True)
+        return self
+
+    def capture(self, count:int=None, duration:float=None):
+        '''Capture frames into the ring until count frames are taken or duration seconds pass.
+
+        Return:
+            - the number of frames captured.
+        '''
+        if count is None and duration is None:
+            raise ValueError('a frame count or a duration is needed')
+        self.open()
+        end = None if duration is None else time.monotonic() + duration
+        captured = 0
+        last = time.monotonic()
+        while (count is None or captured < count) and (end is None or time.monotonic() < end):
+            next(self._frames)
+            now = time.monotonic()
+            FRAME_TIME.record((now - last) * 1e6)
+            last = now
+
+            self.ring.put(Frame(self.frames, time.time(), self._stream.getvalue()))
+            self._stream.seek(0)
+            self._stream.truncate()
+            self.frames += 1
+            captured += 1
+            FRAMES.inc()
+        return captured
+
+    def close(self):
+        '''Stop capturing and wait for the writer to empty the ring.
+
+        Return:
+            - the paths of the frames written.
+        '''
+        if self._frames is not None:
+            self._frames.close()
+            self._frames = None
+            self.camera.stop_preview()
+        self.ring.close()
+        self.writer.join()
+        return self.writer.written
+
+    def __enter__(self):
+        return self.open()
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
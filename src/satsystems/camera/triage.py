@@ -0,0 +1,161 @@
+'''Score captured frames on board so only useful ones spend airtime.
+
+Most frames are black space, a saturated Earth limb, or the same view as
+the frame before. Each frame is decoded at reduced size (JPEGs are scaled
+down while decoding, see Image.draft) to a small grayscale array. It is
+then scored with a few whole-array NumPy operations:
+
+    - brightness: the mean level, and the fraction of dark and saturated pixels.
+    - entropy: bits per pixel of the gray level histogram, low for flat frames.
+    - sharpness: the variance of the Laplacian, low for blurred frames.
+    - difference: the mean absolute change from the previous frame kept.
+
+Frames that fail a threshold are rejected with the reason. The rest are
+ranked by score, and only the scores and the top N frames go to the
+downlink queue:
+
+    triage = Triage(top_n=5)
+    for path in frames:
+        triage.add(path)
+    queue = triage.selected()
+    report = triage.report()
+
+Run `benchmark run -b triage` for the cost per frame.
+'''
+from dataclasses import dataclass, asdict
+import io
+import numpy as np
+from PIL import Image
+from ..common import metrics
+
+# frames are analysed at this size, enough to see blur and too small to cost much
+ANALYSIS_SIZE = (160, 120)
+
+DARK_LEVEL = 0.05           # pixels below this are black space
+SATURATED_LEVEL = 0.95      # pixels above this are blown out
+MAX_DARK = 0.95             # reject frames with more than this fraction of dark pixels
+MAX_SATURATED = 0.5         # reject frames with more than this fraction of saturated pixels
+MIN_ENTROPY = 2.0           # bits per pixel
+MIN_SHARPNESS = 1e-4        # variance of the Laplacian of levels in [0, 1]
+SHARPNESS_HALF = 5e-3       # the sharpness that earns half the sharpness credit in the score
+MIN_DIFFERENCE = 0.01       # mean absolute change below which a frame duplicates the previous one
+
+TRIAGE_TIME = metrics.histogram('camera.triage_ms')
+FRAMES_REJECTED = metrics.counter('camera.frames_rejected', short='cr')
+
+
+@dataclass
+class FrameScore:
+    '''The triage of a single frame, score is in [0, 1] and 0 for rejected frames.'''
+    name: str
+    brightness: float
+    dark: float
+    saturated: float
+    entropy: float
+    sharpness: float
+    difference: float
+    score: float = 0.0
+    rejected: str = None        # the reason a frame was rejected, None if kept
+
+
+def load_gray(source, size=ANALYSIS_SIZE):
+    '''Decode an image to a grayscale array of levels in [0, 1], about size big.
+
+    Params:
+        - source: a path, a file object or the encoded bytes.
+    '''
+    if isinstance(source, (bytes, bytearray)):
+        source = io.BytesIO(source)
+    with Image.open(source) as image:
+        image.draft('L', size)      # JPEGs decode straight to a fraction of their size
+        image = image.convert('L')
+        if image.size != size:
+            image = image.resize(size, Image.BILINEAR)
+        return np.asarray(image, dtype=np.float32) / 255
+
+def measure(gray:np.ndarray, previous:np.ndarray=None, name:str=''):
+    '''Measure a grayscale frame, see FrameScore.'''
+    levels = (gray * 255).astype(np.uint8).ravel()
+    histogram = np.bincount(levels, minlength=256)
+    p = histogram[histogram > 0] / levels.size
+    laplacian = 4 * gray[1:-1, 1:-1] - gray[:-2, 1:-1] - gray[2:, 1:-1] - gray[1:-1, :-2] - gray[1:-1, 2:]
+    difference = 1.0 if previous is None or previous.shape != gray.shape else float(np.abs(gray - previous).mean())
+    return FrameScore(
+        name=name,
+        brightness=float(gray.mean()),
+        dark=float((gray < DARK_LEVEL).mean()),
+        saturated=float((gray > SATURATED_LEVEL).mean()),
+        entropy=float(abs((p * np.log2(p)).sum())),
+        sharpness=float(laplacian.var()),
+        difference=difference,
+    )
+
+def judge(score:FrameScore):
+    '''Fill in the rejection reason and the score of a measured frame.'''
+    if score.dark > MAX_DARK:
+        score.rejected = 'dark'
+    elif score.saturated > MAX_SATURATED:
+        score.rejected = 'saturated'
+    elif score.entropy < MIN_ENTROPY:
+        score.rejected = 'flat'
+    elif score.sharpness < MIN_SHARPNESS:
+        score.rejected = 'blurry'
+    elif score.difference < MIN_DIFFERENCE:
+        score.rejected = 'duplicate'
+    else:
+        useful = max(0.0, 1 - score.dark - score.saturated)
+        score.score = useful * score.entropy / 8 * score.sharpness / (score.sharpness + SHARPNESS_HALF)
+    return score
+
+
+class Triage:
+    '''Scores frames one after the other and keeps the best for downlink.'''
+
+    def __init__(self, top_n:int=5):
+        '''
+        Params:
+            - top_n (optional): frames selected for downlink.
+        '''
+        self.top_n = top_n
+        self.scores = []
+        self._previous = None
+
+    def add(self, source, name:str=None):
+        '''Score a frame against the last frame kept.
+
+        Params:
+            - source: a path, a file object or the encoded bytes.
+            - name (optional): how the frame is reported, the path if not given.
+
+        Return:
+            - the FrameScore.
+        '''
+        with TRIAGE_TIME.time():
+            gray = load_gray(source)
+            score = judge(measure(gray, self._previous, name or str(source)))
+        if score.rejected:
+            FRAMES_REJECTED.inc()
+        if not score.rejected:
+            self._previous = gray
+        self.scores.append(score)
+        return score
+
+    def selected(self):
+        '''The names of the top_n frames kept, best first.'''
+        kept = sorted((score for score in self.scores if not score.rejected), key=lambda score: -score.score)
+        return [score.name for score in kept[:self.top_n]]
+
+    def report(self):
+        '''Every score as a list of dicts, rounded to 4 significant digits for downlink.'''
+        return [{key: float(f'{value:.4g}') if isinstance(value, float) else value for key, value in asdict(score).items()}
+                for score in self.scores]
+
+
+def detail_first(grid, path:str):
+    '''A DownlinkSender priority: the tiles with the most detail first.'''
+    gray = load_gray(path, (grid.width, grid.height))
+    detail = []
+    for index in range(grid.num_tiles):
+        left, upper, right, lower = grid.box(index)
+        detail.append(gray[upper:lower, left:right].std())
+    return [int(index) for index in np.argsort(detail)[::-1]]
@@ -0,0 +1,51 @@
+'''One entry point for every subsystem: satsystems <command> [arguments].
+
+    satsystems radio beacon -s healthy
+    satsystems camera burst --fake -n 50
+    satsystems benchmark startup
+
+Only the module of the command given is imported, and the subsystems
+import their hardware libraries (picamera, smbus2, gpiozero, PIL,
+tkinter...) when a subcommand needs them, not when they are loaded. A
+cron job that asks the radio for a beacon never loads the camera stack.
+The standalone commands (radio, camera...) still work as before.
+'''
+import importlib
+import sys
+
+# the command, the module whose main() runs it, and what it does
+COMMANDS = {
+    'radio': ('satsystems.radio.radio', 'Control the radio.'),
+    'gps': ('satsystems.gps.gps', 'Control the GPS.'),
+    'camera': ('satsystems.camera.camera', 'Capture, convert, triage and downlink images.'),
+    'logger': ('satsystems.common.logger', 'Read, slice and downlink logs.'),
+    'deployer': ('satsystems.deployer.deployer', 'Deploy the antennas.'),
+    'obc': ('satsystems.obc.obc', 'Talk to the MCUs and scan the I2C bus.'),
+    'groundstation': ('satsystems.groundstation.groundstation', 'Open the ground station GUI.'),
+    'simulator': ('satsystems.simulator.simulator', 'Simulate hardware behind pseudo-terminals.'),
+    'benchmark': ('satsystems.benchmark.benchmark', 'Benchmark the stack and its startup time.'),
+}
+
+
+def usage():
+    lines = ['usage: satsystems <command> [arguments]', '', 'commands:']
+    lines += [f'  {name:<15} {description}' for name, (_, description) in COMMANDS.items()]
+    lines += ['', 'Run satsystems <command> --help for the arguments of a command.']
+    return '\n'.join(lines)
+
+def main(argv=None):
+    argv = sys.argv[1:] if argv is None else argv
+    if not argv or argv[0] in ('-h', '--help'):
+        print(usage())
+        return 0 if argv else 2
+    command, arguments = argv[0], argv[1:]
+    if command not in COMMANDS:
+        print(f'satsystems: unknown command: {command}\n\n{usage()}', file=sys.stderr)
+        return 2
+
+    module = importlib.import_module(COMMANDS[command][0])
+    sys.argv = [f'satsystems {command}'] + arguments      # so argparse names the command in its usage
+    return module.main()
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,124 @@
+import asyncio
+from .framing import make_framer
+
+
+class SerialFrameProtocol(asyncio.Protocol):
+    '''Asyncio protocol that splits incoming serial data into frames.'''
+
+    def __init__(self, start_marker='<', end_marker='>', framing='marker'):
+        self.frames = asyncio.Queue()
+        self.transport = None
+        self._framer = make_framer(framing, start_marker, end_marker)
+        self._can_write = asyncio.Event()
+        self._can_write.set()
+
+    def connection_made(self, transport):
+        self.transport = transport
+
+    def data_received(self, data):
+        for frame in self._framer.feed(data):
+            self.frames.put_nowait(frame)
+
+    def connection_lost(self, exc):
+        self.transport = None
+        self._can_write.set()
+
+    def pause_writing(self):
+        self._can_write.clear()
+
+    def resume_writing(self):
+        self._can_write.set()
+
+    async def drain(self):
+        '''Wait until the transport's write buffer has room again.'''
+        await self._can_write.wait()
+
+
+class AsyncMCU:
+    '''Asyncio version of MCU that talks to a microcontroller over serial.
+
+    Many instances can share a single event loop, so one process can
+    service several serial devices concurrently. Requires the
+    pyserial-asyncio package.
+    '''
+
+    def __init__(self, port='/dev/ttyAMA0', baud=115200, start_marker='<', end_marker='>', framing='marker'):
+        '''
+        Params:
+            - framing (optional): 'marker' or 'cobs', as for MCU, see common.framing.
+        '''
+        self._port = port
+        self._baud = baud
+        self._start_marker = start_marker
+        self._end_marker = end_marker
+        self._framing = framing
+        self._framer = make_framer(framing, start_marker, end_marker)     # frames what is sent
+        self._transport = None
+        self._protocol = None
+
+    async def open(self):
+        '''Open the serial port and start receiving frames on the running event loop.'''
+        try:
+            import serial_asyncio
+        except ImportError as e:
+            raise ImportError('AsyncMCU requires pyserial-asyncio: pip install pyserial-asyncio') from e
+
+        loop = asyncio.get_running_loop()
+        self._transport, self._protocol = await serial_asyncio.create_serial_connection(
+            loop,
+            lambda: SerialFrameProtocol(self._start_marker, self._end_marker, self._framing),
+            self._port,
+            baudrate=self._baud,
+            rtscts=True,
+        )
+        self._transport.serial.reset_input_buffer()
+
+    def close(self):
+        if self._transport is not None:
+            self._transport.close()
+            self._transport = None
+
+    async def send_over_serial(self, data):
+        '''Frame and write a message, a string (sent as UTF-8) or bytes, waiting if the transport is applying back pressure.'''
+        await self._protocol.drain()
+        self._transport.write(self._framer.frame(data))
+
+    async def receive_over_serial(self, timeout:float=10.0):
+        '''Wait for a single message from the serial port.
+
+        Params:
+            - timeout (optional): the maximum number of seconds to wait.
+
+        Return:
+            - if received, the oldest complete message.
+            - if not received, 'xxx'
+        '''
+        frame = await self.receive_bytes_over_serial(timeout)
+        if frame is None:
+            return 'xxx'
+        return frame.decode('utf-8', errors='replace')
+
+    async def receive_bytes_over_serial(self, timeout:float=10.0):
+        '''Wait for a single message, without decoding it.
+
+        Params:
+            - timeout (optional): the maximum number of seconds to wait.
+
+        Return:
+            - if received, the oldest complete message as bytes.
+            - if not received, None
+        '''
+        try:
+            return await asyncio.wait_for(self._protocol.frames.get(), timeout)
+        except asyncio.TimeoutError:
+            return None
+
+
+async def open_all(*devices):
+    '''Run the open() coroutine (boot handshake) of every device concurrently.
+
+    Return:
+        - the devices, in the order they were given.
+    '''
+    await asyncio.gather(*(device.open() for device in devices))
+    return devices
@@ -0,0 +1,493 @@
+'''Compact binary log files with a block index.
+
+A text log line repeats its message and module name on every record. A
+binary log writes each message template and module name once, as a
+definition, and every record after that is a fixed size header holding
+the timestamp, level, module id and template id, followed by the
+arguments:
+
+    magic           b'SATBLOG1'
+    definition      '<BIH' kind (b'T' template or b'M' module), id, length, then utf-8 text
+    record          '<BdBBHIH' b'R', created, levelno, flags, module id, template id, args length, then args
+
+Next to the log, a .idx file holds the same definitions plus one entry
+per block of records with the time range, start and end offsets and a
+mask of the levels and modules in it. The reader only loads the index,
+then reads the blocks that can match a time window, module or level, so
+a query does not scan the whole file. If the index is lost the reader
+rebuilds it with one scan.
+'''
+from dataclasses import dataclass
+import logging
+import os
+import struct
+import traceback
+
+MAGIC = b'SATBLOG1'
+RECORD = struct.Struct('<BdBBHIH')
+DEFINITION = struct.Struct('<BIH')
+BLOCK = struct.Struct('<BddQQIIQ')
+ARG_LENGTH = struct.Struct('<H')
+
+KIND_RECORD = ord('R')
+KIND_TEMPLATE = ord('T')
+KIND_MODULE = ord('M')
+KIND_BLOCK = ord('B')
+
+FLAG_EXCEPTION = 0x01       # the last argument is the formatted traceback
+
+# records per index entry
+DEFAULT_BLOCK_RECORDS = 256
+
+# templates interned before the rest are stored as formatted text, f-string messages never repeat
+MAX_TEMPLATES = 4096
+TEXT_TEMPLATE = 0           # '%s', the formatted message is the only argument
+
+
+def _level_bit(levelno:int):
+    return 1 << min(levelno // 10, 31)
+
+def _module_bit(module_id:int):
+    return 1 << (module_id % 64)
+
+def index_path(path:str):
+    return path + '.idx'
+
+
+def encode_args(args):
+    '''Pack log arguments, anything that is not a number, text or bytes is stored as str().'''
+    out = bytearray()
+    for arg in args:
+        if arg is None:
+            out += b'n'
+        elif isinstance(arg, bool):
+            out += b't' if arg else b'f'
+        elif isinstance(arg, int) and -2**63 <= arg < 2**63:
+            out += b'i' + struct.pack('<q', arg)
+        elif isinstance(arg, float):
+            out += b'd' + struct.pack('<d', arg)
+        else:
+            tag, data = (b'b', bytes(arg)) if isinstance(arg, (bytes, bytearray)) else (b's', str(arg).encode('utf-8', errors='replace'))
+            data = data[:0xFFFF]
+            out += tag + ARG_LENGTH.pack(len(data)) + data
+    return bytes(out)
+
+def decode_args(data:bytes):
+    args = []
+    i = 0
+    while i < len(data):
+        tag = data[i:i + 1]
+        i += 1
+        if tag == b'n':
+            args.append(None)
+        elif tag in (b't', b'f'):
+            args.append(tag == b't')
+        elif tag == b'i':
+            args.append(struct.unpack_from('<q', data, i)[0])
+            i += 8
+        elif tag == b'd':
+            args.append(struct.unpack_from('<d', data, i)[0])
+            i += 8
+        elif tag in (b's', b'b'):
+            length, = ARG_LENGTH.unpack_from(data, i)
+            value = bytes(data[i + 2:i + 2 + length])
+            args.append(value.decode('utf-8', errors='replace') if tag == b's' else value)
+            i += 2 + length
+        else:
+            raise ValueError(f'unknown argument tag: {tag!r}')
+    return tuple(args)
+
+
+@dataclass
+class LogEntry:
+    '''A single record read back from a binary log.'''
+    created: float
+    levelno: int
+    module: str
+    template: str
+    args: tuple
+    exc_text: str = None
+
+    @property
+    def levelname(self):
+        return logging.getLevelName(self.levelno)
+
+    @property
+    def message(self):
+        try:
+            message = self.template % self.args if self.args else self.template
+        except (TypeError, ValueError):
+            message = f'{self.template} {self.args}'
+        if self.exc_text:
+            message = f'{message}\n{self.exc_text}'
+        return message
+
+
+@dataclass
+class Block:
+    '''An index entry: where a run of records is, and what is in it.'''
+    first: float
+    last: float
+    start: int
+    end: int
+    count: int
+    levels: int
+    modules: int
+
+    @classmethod
+    def unpack(cls, data:bytes, offset:int=0):
+        return cls(*BLOCK.unpack_from(data, offset)[1:])
+
+    def pack(self):
+        return BLOCK.pack(KIND_BLOCK, self.first, self.last, self.start, self.end, self.count, self.levels, self.modules)
+
+    def matches(self, start:float=None, end:float=None, module_bits:int=None, min_level:int=0):
+        if start is not None and self.last < start:
+            return False
+        if end is not None and self.first > end:
+            return False
+        if module_bits is not None and not self.modules & module_bits:
+            return False
+        return self.levels >= _level_bit(min_level)
+
+
+class BinaryLogWriter:
+    '''Appends records to a binary log and its index.
+
+    Writes are buffered, the file is flushed when a block is closed, on
+    flush() and after any record at or above flush_level, so an error
+    reaches the SD card before a crash but routine records are written
+    in batches.
+    '''
+
+    def __init__(self, path:str, block_records:int=DEFAULT_BLOCK_RECORDS, flush_level:int=logging.WARNING):
+        self.path = path
+        self.block_records = block_records
+        self.flush_level = flush_level
+        self._templates = {'%s': TEXT_TEMPLATE}
+        self._modules = {}
+
+        if os.path.exists(path) and os.path.getsize(path) > 0:
+            # carry on with the ids already defined, dropping a record torn by a crash
+            reader = BinaryLogReader(path)
+            self._templates.update({template: i for i, template in reader.templates.items()})
+            self._modules.update({module: i for i, module in reader.modules.items()})
+            reader.write_index()    # also indexes the records of a writer that did not close
+            end = reader.data_end
+            self._file = open(path, mode='r+b')
+            self._file.truncate(end)
+            self._file.seek(end)
+            self._index = open(index_path(path), mode='ab')
+        else:
+            self._file = open(path, mode='wb')
+            self._file.write(MAGIC)
+            self._index = open(index_path(path), mode='wb')
+            self._index.write(MAGIC)
+            self._define(KIND_TEMPLATE, TEXT_TEMPLATE, '%s')
+        self._new_block()
+
+    def write(self, created:float, levelno:int, module:str, template:str, args:tuple=(), exc_text:str=None):
+        '''Append a record.
+
+        Params:
+            - created: the time.time() the record was made.
+            - levelno: the logging level, ex: logging.INFO.
+            - module: the logger name.
+            - template: the %-style message template.
+            - args (optional): the arguments of the template.
+            - exc_text (optional): a formatted traceback.
+        '''
+        module_id = self._intern(self._modules, KIND_MODULE, module)
+        template_id = self._templates.get(template)
+        if template_id is None:
+            if len(self._templates) < MAX_TEMPLATES:
+                template_id = self._intern(self._templates, KIND_TEMPLATE, template)
+            else:
+                template_id, args = TEXT_TEMPLATE, (LogEntry(created, levelno, module, template, args).message,)
+
+        flags = 0
+        if exc_text:
+            flags |= FLAG_EXCEPTION
+            args = tuple(args) + (exc_text,)
+        packed = encode_args(args)
+        if len(packed) > 0xFFFF:
+            template_id, packed = TEXT_TEMPLATE, encode_args((LogEntry(created, levelno, module, template, args[:-1] if exc_text else args).message[:0xFFF0],))
+            flags = 0
+
+        if self._block_count == 0:
+            self._block_first = self._block_last = created
+        self._file.write(RECORD.pack(KIND_RECORD, created, levelno, flags, module_id, template_id, len(packed)) + packed)
+        self._block_first = min(self._block_first, created)
+        self._block_last = max(self._block_last, created)
+        self._block_levels |= _level_bit(levelno)
+        self._block_modules |= _module_bit(module_id)
+        self._block_count += 1
+
+        if self._block_count >= self.block_records:
+            self._close_block()
+        elif levelno >= self.flush_level:
+            self._file.flush()
+
+    def flush(self):
+        '''Write out the buffered records and index the block in progress.'''
+        self._close_block()
+
+    def close(self):
+        self.flush()
+        self._file.close()
+        self._index.close()
+
+    def _intern(self, table:dict, kind:int, text:str):
+        if text not in table:
+            table[text] = len(table) if kind == KIND_MODULE else max(table.values()) + 1
+            self._define(kind, table[text], text)
+        return table[text]
+
+    def _define(self, kind:int, number:int, text:str):
+        data = text.encode('utf-8', errors='replace')[:0xFFFF]
+        definition = DEFINITION.pack(kind, number, len(data)) + data
+        self._file.write(definition)
+        self._index.write(definition)
+
+    def _new_block(self):
+        self._block_start = self._file.tell()
+        self._block_first = self._block_last = 0.0
+        self._block_levels = 0
+        self._block_modules = 0
+        self._block_count = 0
+
+    def _close_block(self):
+        self._file.flush()
+        if self._block_count:
+            self._index.write(Block(self._block_first, self._block_last, self._block_start, self._file.tell(),
+                                    self._block_count, self._block_levels, self._block_modules).pack())
+            self._index.flush()
+            self._new_block()
+
+
+class BinaryLogHandler(logging.Handler):
+    '''A logging handler writing to a binary log, see SatelliteLogger.get_logger(binary_log_file=...).'''
+
+    def __init__(self, path:str, block_records:int=DEFAULT_BLOCK_RECORDS):
+        super().__init__()
+        self.writer = BinaryLogWriter(path, block_records)
+
+    def emit(self, record):
+        try:
+            if isinstance(record.msg, str) and isinstance(record.args, tuple):
+                template, args = record.msg, record.args
+            else:
+                template, args = '%s', (record.getMessage(),)
+            exc_text = None
+            if record.exc_info:
+                exc_text = record.exc_text or ''.join(traceback.format_exception(*record.exc_info)).rstrip()
+            with self.lock:
+                self.writer.write(record.created, record.levelno, record.name, template, args, exc_text)
+        except Exception:
+            self.handleError(record)
+
+    def flush(self):
+        with self.lock:
+            self.writer.flush()
+
+    def close(self):
+        with self.lock:
+            self.writer.close()
+        super().close()
+
+
+class BinaryLogReader:
+    '''Reads a binary log through its index.
+
+        reader = BinaryLogReader('logger.bin')
+        for entry in reader.entries(start=pass_start, modules=['radio'], min_level=logging.WARNING):
+            print(entry.message)
+    '''
+
+    def __init__(self, path:str):
+        '''
+        Raises:
+            ValueError: if path is not a binary log.
+        '''
+        self.path = path
+        self.templates = {}
+        self.modules = {}
+        self.blocks = []
+        with open(path, mode='rb') as file:
+            if file.read(len(MAGIC)) != MAGIC:
+                raise ValueError(f'{path} is not a binary log')
+        self.indexed = self._load_index()
+        if not self.indexed:
+            self.blocks = self._scan(len(MAGIC))
+        start = self.blocks[-1].end if self.blocks else len(MAGIC)
+
+        # the records after the last block were not indexed yet (ex: the writer did not close), this also
+        # learns their definitions
+        self.tail = self._scan(start)
+        self.data_end = self._last_end
+
+    def entries(self, start:float=None, end:float=None, modules=None, min_level:int=0):
+        '''Iterate over the records matching all the given filters.
+
+        Params:
+            - start, end (optional): the time window, as time.time() values.
+            - modules (optional): the logger names to keep.
+            - min_level (optional): the lowest level to keep, ex: logging.WARNING.
+
+        Return:
+            - a generator of LogEntry, in the order they were written.
+        '''
+        module_ids = None
+        module_bits = None
+        if modules is not None:
+            modules = set(modules)
+            module_ids = {i for i, name in self.modules.items() if name in modules}
+            module_bits = 0
+            for i in module_ids:
+                module_bits |= _module_bit(i)
+
+        for block in self.blocks + self.tail:
+            if not block.matches(start, end, module_bits, min_level):
+                continue
+            for module_id, levelno, created, entry in self._read(block.start, block.end):
+                if start is not None and created < start:
+                    continue
+                if end is not None and created > end:
+                    continue
+                if module_ids is not None and module_id not in module_ids:
+                    continue
+                if levelno < min_level:
+                    continue
+                yield entry
+
+    def summary(self):
+        '''
+        Return:
+            - (records, first created, last created) over the whole log, from the index.
+        '''
+        blocks = self.blocks + self.tail
+        records = sum(block.count for block in blocks)
+        first = min((block.first for block in blocks), default=None)
+        last = max((block.last for block in blocks), default=None)
+        return records, first, last
+
+    def export(self, path:str, start:float=None, end:float=None, modules=None, min_level:int=0):
+        '''Write the matching records to a new, self contained binary log, ex: to downlink a slice.
+
+        Return:
+            - the number of records written.
+        '''
+        writer = BinaryLogWriter(path)
+        count = 0
+        try:
+            for entry in self.entries(start, end, modules, min_level):
+                writer.write(entry.created, entry.levelno, entry.module, entry.template, entry.args, entry.exc_text)
+                count += 1
+        finally:
+            writer.close()
+        return count
+
+    def write_index(self):
+        '''Save the index, ex: after it was rebuilt because the .idx file was lost.'''
+        with open(index_path(self.path), mode='wb') as file:
+            file.write(MAGIC)
+            for kind, table in ((KIND_MODULE, self.modules), (KIND_TEMPLATE, self.templates)):
+                for number, text in table.items():
+                    data = text.encode('utf-8', errors='replace')
+                    file.write(DEFINITION.pack(kind, number, len(data)) + data)
+            for block in self.blocks + self.tail:
+                file.write(block.pack())
+
+    def _load_index(self):
+        try:
+            with open(index_path(self.path), mode='rb') as file:
+                data = file.read()
+        except FileNotFoundError:
+            return False
+        if not data.startswith(MAGIC):
+            return False
+
+        i = len(MAGIC)
+        while i < len(data):
+            kind = data[i]
+            if kind == KIND_BLOCK and i + BLOCK.size <= len(data):
+                self.blocks.append(Block.unpack(data, i))
+                i += BLOCK.size
+            elif kind in (KIND_TEMPLATE, KIND_MODULE) and i + DEFINITION.size <= len(data):
+                _, number, length = DEFINITION.unpack_from(data, i)
+                if i + DEFINITION.size + length > len(data):
+                    break
+                text = data[i + DEFINITION.size:i + DEFINITION.size + length].decode('utf-8', errors='replace')
+                (self.templates if kind == KIND_TEMPLATE else self.modules)[number] = text
+                i += DEFINITION.size + length
+            else:
+                break   # torn by a crash, the tail scan picks up what is missing
+        return True
+
+    def _scan(self, start:int):
+        '''Index the records from start to the end of the file in blocks of DEFAULT_BLOCK_RECORDS.'''
+        blocks = []
+        block = None
+        for module_id, levelno, created, _ in self._read(start, None, headers_only=True):
+            if block is None:
+                block = Block(created, created, self._record_start, 0, 0, 0, 0)
+            block.first = min(block.first, created)
+            block.last = max(block.last, created)
+            block.levels |= _level_bit(levelno)
+            block.modules |= _module_bit(module_id)
+            block.count += 1
+            block.end = self._last_end
+            if block.count >= DEFAULT_BLOCK_RECORDS:
+                blocks.append(block)
+                block = None
+        if block is not None:
+            blocks.append(block)
+        return blocks
+
+    def _read(self, start:int, end:int, headers_only:bool=False):
+        '''Parse records between two offsets, end None for the end of the file.
+
+        Definitions met on the way are added to the tables, a torn record at
+        the end is ignored.
+
+        Return:
+            - a generator of (module id, levelno, created, LogEntry or None if headers_only).
+        '''
+        self._last_end = start
+        with open(self.path, mode='rb') as file:
+            file.seek(start)
+            data = file.read() if end is None else file.read(end - start)
+
+        i = 0
+        while i < len(data):
+            kind = data[i]
+            if kind == KIND_RECORD:
+                if i + RECORD.size > len(data):
+                    break
+                _, created, levelno, flags, module_id, template_id, length = RECORD.unpack_from(data, i)
+                if i + RECORD.size + length > len(data):
+                    break
+                entry = None
+                if not headers_only:
+                    args = decode_args(data[i + RECORD.size:i + RECORD.size + length])
+                    exc_text = None
+                    if flags & FLAG_EXCEPTION and args:
+                        args, exc_text = args[:-1], args[-1]
+                    entry = LogEntry(created, levelno, self.modules.get(module_id, f'module{module_id}'),
+                                     self.templates.get(template_id, '%s'), args, exc_text)
+                self._record_start = start + i
+                i += RECORD.size + length
+                self._last_end = start + i
+                yield module_id, levelno, created, entry
+            elif kind in (KIND_TEMPLATE, KIND_MODULE):
+                if i + DEFINITION.size > len(data):
+                    break
+                _, number, length = DEFINITION.unpack_from(data, i)
+                if i + DEFINITION.size + length > len(data):
+                    break
+                text = data[i + DEFINITION.size:i + DEFINITION.size + length].decode('utf-8', errors='replace')
+                (self.templates if kind == KIND_TEMPLATE else self.modules)[number] = text
+                i += DEFINITION.size + length
+                self._last_end = start + i
+            else:
+                break
@@ -0,0 +1,17 @@
+import os
+import stat
+
+
+def file_mode(path:str):
+    '''The permissions a file written in place of path should get.
+
+    Temporary files are created readable by the owner only, so before one
+    is renamed into place it gets the mode of the file it replaces, or the
+    mode open() would have given a new file.
+    '''
+    try:
+        return stat.S_IMODE(os.stat(path).st_mode)
+    except FileNotFoundError:
+        umask = os.umask(0)
+        os.umask(umask)
+        return 0o666 & ~umask
@@ -0,0 +1,192 @@
+import binascii
+import struct
+
+
+class MarkerFramer:
+    '''Incremental parser for frames delimited by a start and an end marker.
+
+    Bytes are accumulated in a single reusable buffer. Every call to
+    feed() extracts all of the complete frames in one pass, while a
+    partially received frame is kept until the rest of it arrives.
+    Any bytes outside of a start/end marker pair are discarded.
+    '''
+
+    def __init__(self, start_marker='<', end_marker='>'):
+        self._start_marker = start_marker.encode('utf-8')
+        self._end_marker = end_marker.encode('utf-8')
+        self._buffer = bytearray()
+
+    def feed(self, data:bytes):
+        '''Add newly received bytes and return every completed frame.
+
+        Params:
+            - data: the bytes read from the port.
+
+        Return:
+            - a list of frame contents (markers stripped) as bytes, oldest first.
+        '''
+        buffer = self._buffer
+        buffer += data
+        frames = []
+        position = 0
+        while True:
+            start = buffer.find(self._start_marker, position)
+            if start == -1:
+                position = len(buffer)  # nothing but noise left, drop it
+                break
+            end = buffer.find(self._end_marker, start + 1)
+            if end == -1:
+                position = start        # keep the partial frame for the next call
+                break
+            frames.append(bytes(buffer[start + 1:end]))
+            position = end + 1
+        del buffer[:position]
+        return frames
+
+    def frame(self, data):
+        '''Wrap a message in the start and end markers.
+
+        Params:
+            - data: the message as a string (sent as UTF-8) or bytes.
+
+        Return:
+            - the framed message as bytes.
+        '''
+        if isinstance(data, str):
+            data = data.encode('utf-8')
+        return self._start_marker + data + self._end_marker
+
+    def reset(self):
+        '''Discard any partially received frame.'''
+        self._buffer.clear()
+
+    @property
+    def pending(self):
+        '''The number of buffered bytes that are not yet part of a complete frame.'''
+        return len(self._buffer)
+
+
+def cobs_encode(data:bytes):
+    '''Consistent Overhead Byte Stuffing, the result contains no zero bytes.'''
+    encoded = bytearray()
+    for chunk in data.split(b'\x00'):
+        while len(chunk) >= 254:
+            encoded.append(0xFF)
+            encoded += chunk[:254]
+            chunk = chunk[254:]
+        encoded.append(len(chunk) + 1)
+        encoded += chunk
+    return bytes(encoded)
+
+def cobs_decode(data:bytes):
+    '''Reverse cobs_encode.
+
+    Raises:
+        ValueError: if the data is not validly encoded.
+    '''
+    decoded = bytearray()
+    index = 0
+    while index < len(data):
+        code = data[index]
+        end = index + code
+        if code == 0 or end > len(data):
+            raise ValueError('invalid cobs data')
+        decoded += data[index + 1:end]
+        index = end
+        if code != 0xFF and index < len(data):
+            decoded.append(0)
+    return bytes(decoded)
+
+
+class CobsFramer:
+    '''Incremental parser for binary safe, COBS encoded frames.
+
+    Each frame is the message followed by a trailer of its length and a
+    CRC-16/CCITT over the message and the length, COBS encoded and ended
+    with a zero byte. Messages can hold any bytes, including the '<' and
+    '>' markers and zeros. Frames that fail the length or CRC check are
+    dropped and counted in dropped.
+
+    Has the same interface as MarkerFramer.
+    '''
+
+    DELIMITER = b'\x00'
+
+    def __init__(self):
+        self._buffer = bytearray()
+        self.dropped = 0
+
+    def feed(self, data:bytes):
+        '''Add newly received bytes and return every completed frame.
+
+        Params:
+            - data: the bytes read from the port.
+
+        Return:
+            - a list of messages (trailer removed) as bytes, oldest first.
+        '''
+        buffer = self._buffer
+        buffer += data
+        end = buffer.rfind(self.DELIMITER)
+        if end == -1:
+            return []
+        complete = bytes(buffer[:end])
+        del buffer[:end + 1]
+
+        frames = []
+        for encoded in complete.split(self.DELIMITER):
+            if not encoded:
+                continue
+            try:
+                frames.append(self._check(cobs_decode(encoded)))
+            except ValueError:
+                self.dropped += 1
+        return frames
+
+    def frame(self, data):
+        '''Encode a message as a frame.
+
+        Params:
+            - data: the message as a string (sent as UTF-8) or bytes.
+
+        Return:
+            - the frame as bytes, including the trailing zero.
+        '''
+        if isinstance(data, str):
+            data = data.encode('utf-8')
+        body = data + struct.pack('>H', len(data))
+        return cobs_encode(body + struct.pack('>H', binascii.crc_hqx(body, 0xFFFF))) + self.DELIMITER
+
+    def reset(self):
+        '''Discard any partially received frame.'''
+        self._buffer.clear()
+
+    @property
+    def pending(self):
+        '''The number of buffered bytes that are not yet part of a complete frame.'''
+        return len(self._buffer)
+
+    @staticmethod
+    def _check(decoded:bytes):
+        if len(decoded) < 4:
+            raise ValueError('frame is too short')
+        body, (crc,) = decoded[:-2], struct.unpack('>H', decoded[-2:])
+        if binascii.crc_hqx(body, 0xFFFF) != crc:
+            raise ValueError('crc mismatch')
+        message, (length,) = body[:-2], struct.unpack('>H', body[-2:])
+        if len(message) != length:
+            raise ValueError('length mismatch')
+        return message
+
+
+def make_framer(framing:str, start_marker='<', end_marker='>'):
+    '''A new framer for 'marker' or 'cobs' framing.
+
+    Raises:
+        ValueError: if the framing is neither.
+    '''
+    if framing == 'cobs':
+        return CobsFramer()
+    elif framing == 'marker':
+        return MarkerFramer(start_marker, end_marker)
+    raise ValueError(f'unknown framing: {framing}, "marker" or "cobs" are expected.')
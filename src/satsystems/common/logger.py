@@ -1,7 +1,25 @@
 # Imports
 import os
 import sys
+import atexit
+import queue
 import logging
+import argparse
+import threading
+from datetime import datetime
+from logging.handlers import QueueHandler
+
+# records waiting for the listener thread before new ones are dropped
+DEFAULT_QUEUE_SIZE = 10000
+
+# default rotation of the text log, see common.logrotate
+DEFAULT_ROTATION = {
+    'max_bytes': 10 * 1024 * 1024,
+    'interval_s': 24 * 60 * 60,
+    'compression': 'gzip',
+    'min_free_bytes': 64 * 1024 * 1024,
+    'max_segments': 0,
+}
 
 # Logging formatter supporting colorized output
 class LogFormatter(logging.Formatter):
@@ -20,33 +38,184 @@ class LogFormatter(logging.Formatter):
         super(LogFormatter, self).__init__(*args, **kwargs)
         self.color = color
 
+        # Bake the color codes into one formatter per level up front,
+        # so formatting a record is a dict lookup
+        self._plain = self._with_colors("", "")
+        self._by_level = {}
+        for level, code in self.COLOR_CODES.items():
+            self._by_level[level] = self._with_colors(code, self.RESET_CODE) if self.color == True else self._plain
+
+    def _with_colors(self, color_on, color_off):
+        template = self._fmt.replace("%(color_on)s", color_on).replace("%(color_off)s", color_off)
+        formatter = logging.Formatter(template, self.datefmt)
+        # keep templates that use the fields another way working
+        formatter.color_on, formatter.color_off = color_on, color_off
+        return formatter
+
     def format(self, record, *args, **kwargs):
-        if (self.color == True and record.levelno in self.COLOR_CODES):
-            record.color_on  = self.COLOR_CODES[record.levelno]
-            record.color_off = self.RESET_CODE
-        else:
-            record.color_on  = ""
-            record.color_off = ""
-        return super(LogFormatter, self).format(record, *args, **kwargs)
+        formatter = self._by_level.get(record.levelno, self._plain)
+        record.color_on  = formatter.color_on
+        record.color_off = formatter.color_off
+        return formatter.format(record)
+
+class LogListener:
+    '''Writes the records queued by AsyncHandlers from a single background thread.
+
+    The queue is bounded: when it is full (ex: the SD card stalls) new
+    records are dropped instead of blocking the caller, and the number of
+    dropped records is logged once the listener catches up.
+    '''
+
+    def __init__(self, queue_size:int=DEFAULT_QUEUE_SIZE):
+        self.queue = queue.Queue(queue_size)
+        self.dropped = 0
+        self._reported = 0
+        self._lock = threading.Lock()
+        self._thread = threading.Thread(target=self._run, name='log-listener', daemon=True)
+        self._thread.start()
+
+    def enqueue(self, handlers, record):
+        '''Queue a record for handlers, without ever blocking.'''
+        try:
+            self.queue.put_nowait((handlers, record))
+        except queue.Full:
+            with self._lock:
+                self.dropped += 1
+
+    def flush(self):
+        '''Wait until every queued record is written.'''
+        self.queue.join()
+
+    def stop(self, timeout:float=5.0):
+        '''Write the queued records and stop the thread.'''
+        if self._thread.is_alive():
+            self.queue.put((None, None))
+            self._thread.join(timeout)
+
+    def _run(self):
+        while True:
+            handlers, record = self.queue.get()
+            try:
+                if record is None:
+                    return
+                self._handle(handlers, record)
+                if self.dropped != self._reported and self.queue.empty():
+                    dropped, self._reported = self.dropped - self._reported, self.dropped
+                    self._handle(handlers, logging.LogRecord(record.name, logging.WARNING, __file__, 0,
+                                                             '%d log records dropped, the log queue was full', (dropped,), None))
+            finally:
+                self.queue.task_done()
+
+    @staticmethod
+    def _handle(handlers, record):
+        for handler in handlers:
+            if record.levelno >= handler.level:
+                handler.handle(record)
+
+class AsyncHandler(QueueHandler):
+    '''Hands records to a LogListener instead of writing them in the caller's thread.
+
+    Records are queued as they are, the message is only formatted by the
+    listener. Pass arguments %-style, ex: logger.debug('sent %d', n), so the
+    formatting cost leaves the caller too. The arguments are read later, so
+    only pass values that are not changed afterwards.
+    '''
+
+    def __init__(self, listener:LogListener, handlers):
+        super().__init__(listener.queue)
+        self.listener = listener
+        self.handlers = handlers
+        self.setLevel(min(handler.level for handler in handlers))   # do not queue what no handler writes
+
+    def prepare(self, record):
+        return record
+
+    def enqueue(self, record):
+        self.listener.enqueue(self.handlers, record)
 
 class SatelliteLogger:
-    '''Custom logger to be shared across all satellite systems.'''
+    '''Custom logger to be shared across all satellite systems.
+
+    By default records are written by the thread that logs them. After
+    SatelliteLogger.use_async(), new loggers hand their records to a single
+    background thread, so hot loops (ex: radio streams) never wait on disk.
+    '''
 
     _LOG = None
+    _ASYNC = False
+    _QUEUE_SIZE = DEFAULT_QUEUE_SIZE
+    _LISTENER = None
+    _LISTENER_LOCK = threading.Lock()
+    _LOGGERS = {}               # module name to the settings its logger was set up with, and the logger
+    _ATTACHED = {}              # module name to the handlers get_logger added to its logger
+    _LOGGERS_LOCK = threading.Lock()
+    _HANDLERS = {}              # sink settings to the handler shared by every logger using them
+    _ROTATION = dict(DEFAULT_ROTATION)
+    _BINARY = None
 
     @staticmethod
-    def __create_logger(module_name, console_log_output, console_log_level, console_log_color,
-                        logfile_file, logfile_log_level, logfile_log_color, log_line_template):
+    def use_async(enabled:bool=True, queue_size:int=DEFAULT_QUEUE_SIZE):
+        '''Make the loggers created from now on write from a background thread.
+
+        Params:
+            - enabled (optional): False to go back to synchronous loggers.
+            - queue_size (optional): records held before new ones are dropped.
+        '''
+        SatelliteLogger._ASYNC = enabled
+        SatelliteLogger._QUEUE_SIZE = queue_size
+
+    @staticmethod
+    def use_rotation(enabled:bool=True, **settings):
+        '''Set how the log files opened from now on are rotated.
+
+        Params:
+            - enabled (optional): False to write to a single file forever.
+            - settings (optional): max_bytes, interval_s, compression ('gzip',
+                'zstd' or None), min_free_bytes and max_segments, the ones not
+                given keep their DEFAULT_ROTATION value. See common.logrotate.
+        '''
+        SatelliteLogger._ROTATION = dict(DEFAULT_ROTATION, **settings) if enabled else None
+
+    @staticmethod
+    def use_binary(path:str=None):
+        '''Make the loggers created from now on also write to a binary log, see common.binlog.
+
+        Params:
+            - path (optional): the binary log shared by every logger, ex: flight.bin. None to stop.
+        '''
+        SatelliteLogger._BINARY = path
+
+    @staticmethod
+    def listener():
+        '''The listener thread shared by every asynchronous logger, started on first use.'''
+        with SatelliteLogger._LISTENER_LOCK:
+            if SatelliteLogger._LISTENER is None:
+                SatelliteLogger._LISTENER = LogListener(SatelliteLogger._QUEUE_SIZE)
+                atexit.register(SatelliteLogger._LISTENER.stop)
+            return SatelliteLogger._LISTENER
+
+    @staticmethod
+    def dropped_records():
+        '''The number of records dropped because the queue was full.'''
+        listener = SatelliteLogger._LISTENER
+        return listener.dropped if listener is not None else 0
+
+    @staticmethod
+    def flush():
+        '''Wait until every queued record is written, ex: before a reboot.'''
+        if SatelliteLogger._LISTENER is not None:
+            SatelliteLogger._LISTENER.flush()
+
+    @staticmethod
+    def __console_handler(console_log_output, console_log_level, console_log_color, log_line_template):
         """
-        A private method that interacts with the python
-        logging module.
+        A private method that returns the console handler for
+        these settings, created the first time it is asked for.
         """
 
-        # Initialize the class variable with logger object
-        SatelliteLogger._LOG = logging.getLogger(module_name)
-
-        # Set global log level to 'debug' (required for handler levels to work)
-        SatelliteLogger._LOG.setLevel(logging.DEBUG)
+        key = ("console", console_log_output.lower(), console_log_level.upper(), console_log_color, log_line_template)
+        if key in SatelliteLogger._HANDLERS:
+            return SatelliteLogger._HANDLERS[key]
 
         # Create console handler
         console_log_output = console_log_output.lower()
@@ -66,14 +235,33 @@ class SatelliteLogger:
             print("Failed to set console log level: invalid level: '%s'" % console_log_level)
             return False
 
-        # Create and set formatter, add console handler to logger
+        # Create and set formatter
         console_formatter = LogFormatter(fmt=log_line_template, color=console_log_color)
         console_handler.setFormatter(console_formatter)
-        SatelliteLogger._LOG.addHandler(console_handler)
 
-        # Create log file handler
+        SatelliteLogger._HANDLERS[key] = console_handler
+        return console_handler
+
+    @staticmethod
+    def __file_handler(logfile_file, logfile_log_level, logfile_log_color, log_line_template):
+        """
+        A private method that returns the log file handler for
+        these settings, so every module shares one open file.
+        """
+
+        rotation = SatelliteLogger._ROTATION
+        key = ("file", os.path.abspath(logfile_file), logfile_log_level.upper(), logfile_log_color, log_line_template,
+               tuple(sorted(rotation.items())) if rotation else None)
+        if key in SatelliteLogger._HANDLERS:
+            return SatelliteLogger._HANDLERS[key]
+
+        # Create log file handler, rotated if configured
         try:
-            logfile_handler = logging.FileHandler(logfile_file)
+            if rotation:
+                from .logrotate import RotatingLogHandler
+                logfile_handler = RotatingLogHandler(logfile_file, **rotation)
+            else:
+                logfile_handler = logging.FileHandler(logfile_file)
         except Exception as exception:
             print("Failed to set up log file: %s" % str(exception))
             return False
@@ -82,32 +270,206 @@ class SatelliteLogger:
         try:
             logfile_handler.setLevel(logfile_log_level.upper()) # only accepts uppercase level names
         except:
+            logfile_handler.close()
             print("Failed to set log file log level: invalid level: '%s'" % logfile_log_level)
             return False
 
-        # Create and set formatter, add log file handler to logger
+        # Create and set formatter
         logfile_formatter = LogFormatter(fmt=log_line_template, color=logfile_log_color)
         logfile_handler.setFormatter(logfile_formatter)
-        SatelliteLogger._LOG.addHandler(logfile_handler)
+
+        SatelliteLogger._HANDLERS[key] = logfile_handler
+        return logfile_handler
+
+    @staticmethod
+    def __binary_handler(binary_log_file, logfile_log_level):
+        """
+        A private method that returns the binary log handler
+        for a file, shared by every module logging to it.
+        """
+
+        key = ("binary", os.path.abspath(binary_log_file), logfile_log_level.upper())
+        if key in SatelliteLogger._HANDLERS:
+            return SatelliteLogger._HANDLERS[key]
+
+        # Create binary log handler
+        try:
+            from .binlog import BinaryLogHandler
+            binary_handler = BinaryLogHandler(binary_log_file)
+        except Exception as exception:
+            print("Failed to set up binary log file: %s" % str(exception))
+            return False
+
+        # Set binary log level
+        try:
+            binary_handler.setLevel(logfile_log_level.upper()) # only accepts uppercase level names
+        except:
+            binary_handler.close()
+            print("Failed to set binary log level: invalid level: '%s'" % logfile_log_level)
+            return False
+
+        SatelliteLogger._HANDLERS[key] = binary_handler
+        return binary_handler
+
+    @staticmethod
+    def __create_logger(module_name, console_log_output, console_log_level, console_log_color,
+                        logfile_file, logfile_log_level, logfile_log_color, log_line_template, asynchronous,
+                        binary_log_file):
+        """
+        A private method that interacts with the python
+        logging module.
+        """
+
+        # Initialize the class variable with logger object
+        SatelliteLogger._LOG = logging.getLogger(module_name)
+
+        # Set global log level to 'debug' (required for handler levels to work),
+        # only once so a level set on the logger later is kept
+        if SatelliteLogger._LOG.level == logging.NOTSET:
+            SatelliteLogger._LOG.setLevel(logging.DEBUG)
+
+        console_handler = SatelliteLogger.__console_handler(console_log_output, console_log_level, console_log_color, log_line_template)
+        if not console_handler:
+            return False
+        logfile_handler = SatelliteLogger.__file_handler(logfile_file, logfile_log_level, logfile_log_color, log_line_template)
+        if not logfile_handler:
+            return False
+        handlers = [console_handler, logfile_handler]
+
+        # Write to a binary log too if asked for
+        if binary_log_file:
+            binary_handler = SatelliteLogger.__binary_handler(binary_log_file, logfile_log_level)
+            if not binary_handler:
+                return False
+            handlers.append(binary_handler)
+
+        # Replace the handlers set up before for this module, behind the listener thread if asynchronous
+        attached = [AsyncHandler(SatelliteLogger.listener(), handlers)] if asynchronous else handlers
+        previous = SatelliteLogger._ATTACHED.get(module_name, [])
+        for handler in previous:
+            SatelliteLogger._LOG.removeHandler(handler)
+        for handler in attached:
+            SatelliteLogger._LOG.addHandler(handler)
+        SatelliteLogger._ATTACHED[module_name] = attached
+        SatelliteLogger.__retire(previous)
 
         return SatelliteLogger._LOG
 
+    @staticmethod
+    def __retire(handlers):
+        '''Close the shared handlers no logger uses anymore, so two handlers never write one file.'''
+        def unwrap(handlers):
+            for handler in handlers:
+                yield from unwrap(handler.handlers) if isinstance(handler, AsyncHandler) else (handler,)
+
+        in_use = {id(handler) for attached in SatelliteLogger._ATTACHED.values() for handler in unwrap(attached)}
+        unused = [handler for handler in unwrap(handlers) if id(handler) not in in_use]
+        if not unused:
+            return
+        SatelliteLogger.flush()     # write what is still queued for them first
+        for key, handler in list(SatelliteLogger._HANDLERS.items()):
+            if handler in unused:
+                del SatelliteLogger._HANDLERS[key]
+        for handler in unused:
+            handler.close()
+
     @staticmethod
     def get_logger(module_name, console_log_output="stdout", console_log_level="debug", console_log_color=True,
                     logfile_file="logger.log", logfile_log_level="info", logfile_log_color=False,
-                    log_line_template="%(color_on)s[%(created)d] [%(name)s] [%(levelname)-8s] %(message)s%(color_off)s"):
+                    log_line_template="%(color_on)s[%(created)d] [%(name)s] [%(levelname)-8s] %(message)s%(color_off)s",
+                    asynchronous=None, binary_log_file=None):
         """
         A static method called by other modules to initialize
-        logger in their own module.
+        logger in their own module. Calling it again with the
+        same settings returns the same logger, with other
+        settings its handlers are replaced, never added to.
+        Handlers are shared between modules.
+
+        asynchronous selects the background listener thread for
+        this logger, None follows SatelliteLogger.use_async().
+        binary_log_file also writes the records at the log file
+        level to a compact binary log, see common.binlog. None
+        follows SatelliteLogger.use_binary(), '' writes none.
         """
 
-        logger = SatelliteLogger.__create_logger(module_name, console_log_output, console_log_level, console_log_color,
-                                    logfile_file, logfile_log_level, logfile_log_color, log_line_template)
+        if asynchronous is None:
+            asynchronous = SatelliteLogger._ASYNC
+        if binary_log_file is None:
+            binary_log_file = SatelliteLogger._BINARY
+
+        # a logger is set up once per module, asking again with the same sinks returns it as it is
+        key = (console_log_output.lower(), console_log_level.upper(), console_log_color,
+               os.path.abspath(logfile_file), logfile_log_level.upper(), logfile_log_color, log_line_template, asynchronous,
+               os.path.abspath(binary_log_file) if binary_log_file else None)
+        with SatelliteLogger._LOGGERS_LOCK:
+            settings, logger = SatelliteLogger._LOGGERS.get(module_name, (None, None))
+            if settings == key:
+                return logger
+            logger = SatelliteLogger.__create_logger(module_name, console_log_output, console_log_level, console_log_color,
+                                        logfile_file, logfile_log_level, logfile_log_color, log_line_template, asynchronous,
+                                        binary_log_file)
+            if logger:
+                SatelliteLogger._LOGGERS[module_name] = (key, logger)
         # return the logger object
         return logger
 
-# Main function
-def main():
+def parse_time(value:str):
+    '''A time given as seconds since the epoch or an ISO date, ex: 2026-10-17T14:05.'''
+    try:
+        return float(value)
+    except ValueError:
+        return datetime.fromisoformat(value).timestamp()
+
+def parse_cmdline():
+    from ..radio.compression import CODECS
+
+    parser = argparse.ArgumentParser(description='Write demo log messages, or read binary and rotated logs.')
+    parser.set_defaults(function=do_demo)
+
+    subparser = parser.add_subparsers()
+
+    filters = argparse.ArgumentParser(add_help=False)
+    filters.add_argument('filename', type=str, help='The binary log, ex: logger.bin.')
+    filters.add_argument('-s', '--start', type=parse_time, help='Only records from this time, epoch seconds or an ISO date.')
+    filters.add_argument('-e', '--end', type=parse_time, help='Only records up to this time, epoch seconds or an ISO date.')
+    filters.add_argument('-m', '--module', nargs='+', help='Only records of these loggers, ex: radio obc.')
+    filters.add_argument('-l', '--level', type=str, default='notset', help='Only records at or above this level, ex: warning.')
+
+    cat_parser = subparser.add_parser('cat', parents=[filters], help='Print a log: a binary log, or a text log or segment, compressed or not.')
+    cat_parser.add_argument('-a', '--all', action='store_true', help='Print every rotated segment of a text log, oldest first, then the log itself.')
+    cat_parser.set_defaults(function=do_cat)
+
+    list_parser = subparser.add_parser('list', help='List the rotated segments of a text log.')
+    list_parser.add_argument('filename', type=str, nargs='?', default='logger.log', help='The live log, ex: logger.log.')
+    list_parser.set_defaults(function=do_list)
+
+    decompress_parser = subparser.add_parser('decompress', help='Decompress rotated segments next to themselves.')
+    decompress_parser.add_argument('segments', type=str, nargs='+', help='The compressed segments, ex: logger.log.20261017-140500.gz.')
+    decompress_parser.set_defaults(function=do_decompress)
+
+    index_parser = subparser.add_parser('index', help='Summarize a binary log from its index.')
+    index_parser.add_argument('filename', type=str, help='The binary log, ex: logger.bin.')
+    index_parser.add_argument('-b', '--blocks', action='store_true', help='List every indexed block.')
+    index_parser.set_defaults(function=do_index)
+
+    slice_parser = subparser.add_parser('slice', parents=[filters], help='Copy the matching records to a new binary log.')
+    slice_parser.add_argument('-o', '--output', type=str, required=True, help='The binary log to write.')
+    slice_parser.set_defaults(function=do_slice)
+
+    downlink_parser = subparser.add_parser('downlink', parents=[filters], help='Stream the matching records to another radio.')
+    downlink_parser.add_argument('-p', '--port', type=str, required=True, help='The port the radio is connected to.')
+    downlink_parser.add_argument('-i', '--uid', type=int, default=0, help='The unique identification number of the connected radio.')
+    downlink_parser.add_argument('--binary', action='store_true', help='Use binary safe COBS framing.')
+    downlink_parser.add_argument('-c', '--compress', choices=CODECS, default='zlib', help='Compress the slice with this codec, see radio.compression.')
+    downlink_parser.set_defaults(function=do_downlink)
+
+    return parser.parse_args()
+
+def _filters(options):
+    return dict(start=options.start, end=options.end, modules=options.module,
+                min_level=logging.getLevelName(options.level.upper()))
+
+def do_demo(options):
 
     # Setup logging
     logger_file_name = os.path.splitext(os.path.basename(sys.argv[0]))[0] + '.log'
@@ -123,6 +485,78 @@ def main():
     custom_logger.error("Error message")
     custom_logger.critical("Critical message")
 
+def do_cat(options):
+    from .binlog import BinaryLogReader, MAGIC
+    from .logrotate import segments, open_segment
+
+    with open(options.filename, mode='rb') as file:
+        binary = file.read(len(MAGIC)) == MAGIC
+    if binary:
+        reader = BinaryLogReader(options.filename)
+        for entry in reader.entries(**_filters(options)):
+            print(f'[{entry.created:.3f}] [{entry.module}] [{entry.levelname:<8}] {entry.message}')
+        return
+
+    # text logs are printed as they are, the filters only apply to binary logs
+    paths = segments(options.filename) + [options.filename] if options.all else [options.filename]
+    for path in paths:
+        with open_segment(path) as file:
+            for line in file:
+                sys.stdout.write(line)
+
+def do_list(options):
+    from .logrotate import SUFFIXES, segments
+
+    for path in segments(options.filename) + [options.filename]:
+        if not os.path.exists(path):
+            continue
+        stat = os.stat(path)
+        state = 'live' if path == options.filename else ('compressed' if path.endswith(tuple(SUFFIXES.values())) else 'pending')
+        print(f'{datetime.fromtimestamp(stat.st_mtime).isoformat(timespec="seconds")} {stat.st_size:>12} {state:<10} {path}')
+
+def do_decompress(options):
+    from .logrotate import decompress_file
+
+    for path in options.segments:
+        print(f'{path} -> {decompress_file(path)}')
+
+def do_index(options):
+    from .binlog import BinaryLogReader
+
+    reader = BinaryLogReader(options.filename)
+    records, first, last = reader.summary()
+    print(f'{options.filename}: {records} records, {len(reader.blocks)} blocks, {len(reader.templates)} templates, '
+          f'{os.path.getsize(options.filename)} bytes')
+    if records:
+        print(f'from {datetime.fromtimestamp(first).isoformat()} to {datetime.fromtimestamp(last).isoformat()}')
+    print(f'modules: {", ".join(sorted(reader.modules.values()))}')
+    if options.blocks:
+        for block in reader.blocks + reader.tail:
+            print(f'{block.start:>10} {block.end:>10} {block.count:>6} {block.first:.3f} {block.last:.3f}')
+
+def do_slice(options):
+    from .binlog import BinaryLogReader
+
+    count = BinaryLogReader(options.filename).export(options.output, **_filters(options))
+    print(f'{count} records written to: {options.output}')
+
+def do_downlink(options):
+    from ..radio.rf24 import RF24
+    from .binlog import BinaryLogReader
+    import tempfile
+
+    with tempfile.TemporaryDirectory() as directory:
+        path = os.path.join(directory, os.path.basename(options.filename))
+        count = BinaryLogReader(options.filename).export(path, **_filters(options))
+        radio = RF24(uid=options.uid, port=options.port, framing='cobs' if options.binary else 'marker')
+        radio.stream(path, pipelined=True, compression=options.compress)
+        print(f'{count} records downlinked')
+
+# Main function
+def main():
+    options = parse_cmdline()
+    return options.function(options)
+
 # Call main function
 if (__name__ == "__main__"):
-    sys.exit(main())
\ No newline at end of file
+    sys.exit(main())
@@ -0,0 +1,218 @@
+'''Size and time based rotation of the text log, with background compression.
+
+The live log (ex: logger.log) is renamed to a segment named after the time
+it was rotated, ex: logger.log.20261017-140500, and a new one is started.
+Segments are compressed by a single background thread, so the thread
+that logged the record which triggered the rotation only pays for a
+rename. After each compression the oldest segments are deleted while the
+disk has less than min_free_bytes free, or more than max_segments exist.
+'''
+from logging.handlers import BaseRotatingHandler
+import logging
+import glob
+import gzip
+import io
+import os
+import queue
+import re
+import shutil
+import threading
+import time
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
+
+SUFFIXES = {'gzip': '.gz', 'zstd': '.zst'}
+SEGMENT_TIME_FORMAT = '%Y%m%d-%H%M%S'
+
+
+# ex: logger.log.20261017-140500, .20261017-140500.2 for the next one in the same second, then .gz or .zst
+SEGMENT_PATTERN = re.compile(r'\.(\d{8}-\d{6})(?:\.(\d+))?(\.gz|\.zst)?$')
+
+
+def segments(path:str):
+    '''The rotated segments of a log, oldest first. Other files next to it are never included.'''
+    found = []
+    for name in glob.glob(glob.escape(path) + '.*'):
+        match = SEGMENT_PATTERN.fullmatch(name[len(path):])
+        if match:
+            found.append(((match.group(1), int(match.group(2) or 0)), name))
+    return [name for _, name in sorted(found)]
+
+def open_segment(path:str, binary:bool=False):
+    '''Open a segment for reading text, or bytes if binary, compressed or not.'''
+    if path.endswith(SUFFIXES['gzip']):
+        return gzip.open(path, mode='rb') if binary else gzip.open(path, mode='rt', errors='replace')
+    if path.endswith(SUFFIXES['zstd']):
+        if zstandard is None:
+            raise ImportError('zstandard is required for .zst segments, install it with: pip install zstandard')
+        reader = zstandard.ZstdDecompressor().stream_reader(open(path, mode='rb'), closefd=True)
+        return reader if binary else io.TextIOWrapper(reader, errors='replace')
+    return open(path, mode='rb') if binary else open(path, mode='r', errors='replace')
+
+def compress_file(path:str, compression:str='gzip'):
+    '''Compress a file next to itself and delete the original.
+
+    Return:
+        - the path of the compressed file.
+    '''
+    target = path + SUFFIXES[compression]
+    with open(path, mode='rb') as source, open(target + '.tmp', mode='wb') as raw:
+        if compression == 'gzip':
+            with gzip.GzipFile(fileobj=raw, mode='wb', mtime=int(os.path.getmtime(path))) as out:
+                shutil.copyfileobj(source, out, 1 << 16)
+        else:
+            zstandard.ZstdCompressor().copy_stream(source, raw)
+    shutil.copystat(path, target + '.tmp')     # keep the rotation time for ordering
+    os.replace(target + '.tmp', target)
+    os.remove(path)
+    return target
+
+def decompress_file(path:str, output:str=None):
+    '''Write the uncompressed contents of a segment next to it, or to output.
+
+    Return:
+        - the path written.
+    '''
+    for suffix in SUFFIXES.values():
+        if path.endswith(suffix):
+            output = output or path[:-len(suffix)]
+            break
+    else:
+        raise ValueError(f'{path} is not a compressed segment, {", ".join(SUFFIXES.values())} are expected.')
+    with open_segment(path, binary=True) as source, open(output, mode='wb') as out:
+        shutil.copyfileobj(source, out, 1 << 16)     # bytes as they were logged, even ones that are not UTF-8
+    return output
+
+def enforce_retention(path:str, min_free_bytes:int=0, max_segments:int=0, keep=()):
+    '''Delete the oldest segments of a log until the limits hold, the live log is never deleted.
+
+    Params:
+        - keep (optional): segments counted but not deleted, ex: the ones still queued for compression.
+
+    Return:
+        - the deleted segments.
+    '''
+    deleted = []
+    found = segments(path)
+    count = len(found)
+    candidates = [name for name in found if name not in keep]
+    directory = os.path.dirname(os.path.abspath(path))
+    while candidates:
+        too_many = max_segments and count > max_segments
+        too_full = min_free_bytes and shutil.disk_usage(directory).free < min_free_bytes
+        if not (too_many or too_full):
+            break
+        oldest = candidates.pop(0)
+        count -= 1
+        try:
+            os.remove(oldest)
+        except FileNotFoundError:
+            continue        # already retired by someone else
+        deleted.append(oldest)
+    return deleted
+
+
+class SegmentCompressor:
+    '''Compresses rotated segments one at a time in a background thread.'''
+
+    def __init__(self):
+        self._queue = queue.Queue()
+        self._pending = set()           # segments queued and not compressed yet, kept out of retention
+        self._pending_lock = threading.Lock()
+        self._thread = threading.Thread(target=self._run, name='log-compressor', daemon=True)
+        self._thread.start()
+
+    def submit(self, path:str, compression:str, min_free_bytes:int=0, max_segments:int=0, base:str=None):
+        with self._pending_lock:
+            self._pending.add(path)
+        self._queue.put((path, compression, min_free_bytes, max_segments, base))
+
+    def join(self):
+        '''Wait until the queued segments are compressed.'''
+        self._queue.join()
+
+    def _run(self):
+        while True:
+            path, compression, min_free_bytes, max_segments, base = self._queue.get()
+            try:
+                if compression:
+                    compress_file(path, compression)
+            except FileNotFoundError:
+                pass            # the segment was already retired
+            except OSError as e:
+                logging.getLogger(__name__).error('Failed to compress log segment %s: %s', path, e)
+            finally:
+                with self._pending_lock:
+                    self._pending.discard(path)
+                    pending = set(self._pending)
+            try:
+                enforce_retention(base or path, min_free_bytes, max_segments, keep=pending)
+            except OSError as e:
+                logging.getLogger(__name__).error('Failed to enforce the retention of %s: %s', base or path, e)
+            finally:
+                self._queue.task_done()
+
+_COMPRESSOR = None
+_COMPRESSOR_LOCK = threading.Lock()
+
+def compressor():
+    '''The compressor thread shared by every rotating handler, started on first use.'''
+    global _COMPRESSOR
+    with _COMPRESSOR_LOCK:
+        if _COMPRESSOR is None:
+            _COMPRESSOR = SegmentCompressor()
+        return _COMPRESSOR
+
+
+class RotatingLogHandler(BaseRotatingHandler):
+    '''A FileHandler that starts a new file by size and by age.'''
+
+    def __init__(self, filename:str, max_bytes:int=0, interval_s:float=0, compression:str='gzip',
+                 min_free_bytes:int=0, max_segments:int=0, encoding=None):
+        '''
+        Params:
+            - filename: the live log, ex: logger.log.
+            - max_bytes (optional): rotate once the file is this big, 0 for no limit.
+            - interval_s (optional): rotate once the file is this old, 0 for no limit.
+            - compression (optional): 'gzip', 'zstd' or None to keep segments as text.
+            - min_free_bytes (optional): delete the oldest segments while less is free.
+            - max_segments (optional): keep at most this many segments, 0 for no limit.
+        '''
+        if compression not in (None, *SUFFIXES):
+            raise ValueError(f'unknown compression: {compression}, {", ".join(SUFFIXES)} or None are expected.')
+        if compression == 'zstd' and zstandard is None:
+            raise ImportError('zstandard is required for zstd compression, install it with: pip install zstandard')
+        super().__init__(filename, mode='a', encoding=encoding, delay=False)
+        self.max_bytes = max_bytes
+        self.interval_s = interval_s
+        self.compression = compression
+        self.min_free_bytes = min_free_bytes
+        self.max_segments = max_segments
+        # a file left by an earlier run counts from its last write
+        started = os.path.getmtime(self.baseFilename) if os.path.getsize(self.baseFilename) else time.time()
+        self._rollover_at = started + interval_s if interval_s else None
+
+    def shouldRollover(self, record):
+        if self.stream is None:
+            return False
+        if self._rollover_at is not None and record.created >= self._rollover_at:
+            return True
+        return bool(self.max_bytes) and self.stream.tell() >= self.max_bytes
+
+    def doRollover(self):
+        if self.stream:
+            self.stream.close()
+            self.stream = None
+        if os.path.exists(self.baseFilename) and os.path.getsize(self.baseFilename):
+            stamp = time.strftime(SEGMENT_TIME_FORMAT)
+            # number segments rotated in the same second after the last one, so they stay in order
+            taken = [SEGMENT_PATTERN.fullmatch(name[len(self.baseFilename):]) for name in segments(self.baseFilename)]
+            numbers = [int(match.group(2) or 1) for match in taken if match.group(1) == stamp]
+            segment = f'{self.baseFilename}.{stamp}' + (f'.{max(numbers) + 1}' if numbers else '')
+            os.replace(self.baseFilename, segment)
+            compressor().submit(segment, self.compression, self.min_free_bytes, self.max_segments, self.baseFilename)
+        self.stream = self._open()
+        if self.interval_s:
+            self._rollover_at = time.time() + self.interval_s
@@ -1,93 +1,344 @@
 import serial
-try:
-    import smbus2
-except:
-    print("could not import smbus")
+import queue
+import threading
+import time
+from collections import deque
+from .framing import make_framer
+from . import metrics
+
+FRAMES_RECEIVED = metrics.counter('mcu.frames_rx', short='fr')
+BYTES_RECEIVED = metrics.counter('mcu.bytes_rx')
+FRAMES_SENT = metrics.counter('mcu.frames_tx', short='ft')
+BYTES_SENT = metrics.counter('mcu.bytes_tx')
+WAIT_TIME = metrics.histogram('mcu.wait_ms', short='mw')      # time spent blocked waiting for a frame
+WAIT_TIMEOUTS = metrics.counter('mcu.wait_timeouts', short='mt')
+I2C_TRANSACTIONS = metrics.counter('mcu.i2c_transactions')
+
+
+def load_smbus():
+    '''Import smbus2 on first use, so tools that only use serial ports never load it.
+
+    Raises:
+        ImportError: if smbus2 is not installed.
+    '''
+    try:
+        import smbus2
+    except ImportError:
+        raise ImportError('smbus2 is required for I2C, install it with: pip install smbus2') from None
+    return smbus2
 
 class MCU:
     '''Generic class to represent a microcontroller.
     '''
 
-    def __init__(self, port='/dev/ttyAMA0', address=00, baud=115200, start_marker='<', end_marker='>'):
-        try:
-            self._serial_port = serial.Serial(port=port, baudrate=115200, timeout=10, rtscts=True)
-            self._serial_port.reset_input_buffer()
-        except SerialException as e:
-            print(f"could not open port: {port}")
+    # how long the reader thread blocks on the port before checking if it should stop
+    READER_POLL_INTERVAL = 0.5
+
+    # the largest single I2C transfer the Arduino Wire library buffers
+    I2C_BLOCK_SIZE = 32
+    # the most messages the kernel accepts in a single combined I2C transaction
+    I2C_MAX_MESSAGES = 42
+    # how long to wait before reading again when the MCU has nothing to send over I2C
+    I2C_POLL_INTERVAL = 0.01
+
+    def __init__(self, port='/dev/ttyAMA0', address=00, baud=115200, start_marker='<', end_marker='>', threaded=False, framing='marker',
+                 serial_port=None, i2c_bus=1):
+        '''
+        Params:
+            - framing (optional): 'marker' to wrap text messages in the start and end
+                markers, or 'cobs' for binary safe frames, see common.framing.
+            - serial_port (optional): an already open port to use instead of opening
+                port, ex: a simulator.loopback.LoopbackSerial for benchmarks.
+            - i2c_bus (optional): the I2C bus number, or an already open smbus2.SMBus.
+                The bus is opened the first time it is used.
+        '''
+        if serial_port is not None:
+            self._serial_port = serial_port
+        else:
+            try:
+                self._serial_port = serial.Serial(port=port, baudrate=115200, timeout=10, rtscts=True)
+                self._serial_port.reset_input_buffer()
+            except serial.SerialException as e:
+                print(f"could not open port: {port}")
         self._start_marker = start_marker
         self._end_marker = end_marker
-        self._data_buffer = ""
-        self._data_started = False
-        self._message_complete = False
+        self._framer = self._make_framer(framing)
+        self._frames = deque()
+        self._frame_queue = queue.Queue()
+        self._reader = None
+        self._reader_stop = threading.Event()
+        self._reader_error = None
 
-        try:
-            self._bus = smbus.SMBus(1)
-        except Exception as e:
-            print("could not connect to i2c bus...")
+        self._i2c_bus = i2c_bus
+        self._i2c_framer = self._make_framer(framing)
+        self._i2c_frames = deque()
         self.i2c_address = address
-        self.reading_i2c = False
+        self.i2c_transactions = 0
+
+        if threaded:
+            self.start_reader()
+
+    def start_reader(self):
+        '''Start a background thread that blocks on the serial port and queues every received frame.'''
+        if self._reader is not None:
+            return
+        self._serial_port.timeout = self.READER_POLL_INTERVAL
+        self._reader_stop.clear()
+        self._reader_error = None
+        self._reader = threading.Thread(target=self._reader_loop, name=f'mcu-reader-{self._serial_port.port}', daemon=True)
+        self._reader.start()
+
+    def stop_reader(self):
+        '''Stop the background reader thread. Frames already queued remain available.'''
+        if self._reader is None:
+            return
+        self._reader_stop.set()
+        self._reader.join()
+        self._reader = None
+        self._drain_frame_queue()
+
+    def _reader_loop(self):
+        while not self._reader_stop.is_set():
+            try:
+                data = self._serial_port.read(max(1, self._serial_port.in_waiting))
+            except serial.SerialException as e:
+                self._reader_error = e
+                break
+            for frame in self._parse(data):
+                self._frame_queue.put(frame)
 
     def receive_over_serial(self):
-        while self._serial_port.inWaiting() > 0 and self._message_complete == False:
-            x = self._serial_port.read().decode('utf-8')  # decode needed for Python3
-
-            if self._data_started == True:
-                if x != self._end_marker:
-                    self._data_buffer = self._data_buffer + x
-                else:
-                    self._data_started = False
-                    self._message_complete = True
-            elif x == self._start_marker:
-                self._data_buffer = ''
-                self._data_started = True
-
-        if self._message_complete == True:
-            self._message_complete = False
-            return self._data_buffer
+        '''Receive a single message from the serial port without waiting.
+
+        Return:
+            - if available, the oldest complete message.
+            - if not available, 'xxx'
+        '''
+        if not self._frames:
+            self._read_serial()
+
+        if self._frames:
+            return self._frames.popleft().decode('utf-8', errors='replace')
         else:
             return 'xxx'
 
-    def send_over_serial(self, data:str):
+    def receive_frames_over_serial(self):
+        '''Receive every complete message waiting on the serial port.
+
+        Return:
+            - a list of messages, oldest first. Empty if nothing was received.
+        '''
+        self._read_serial()
+        frames = [frame.decode('utf-8', errors='replace') for frame in self._frames]
+        self._frames.clear()
+        return frames
+
+    def wait_over_serial(self, timeout:float=10.0):
+        '''Block until a single message is received from the serial port.
+
+        The calling thread sleeps until data arrives instead of polling the port.
+
+        Params:
+            - timeout (optional): the maximum number of seconds to wait.
+
+        Return:
+            - if received, the oldest complete message.
+            - if not received, 'xxx'
+        '''
+        frame = self.wait_bytes_over_serial(timeout)
+        if frame is None:
+            return 'xxx'
+        return frame.decode('utf-8', errors='replace')
+
+    def wait_bytes_over_serial(self, timeout:float=10.0):
+        '''Block until a single message is received, without decoding it.
+
+        Params:
+            - timeout (optional): the maximum number of seconds to wait.
+
+        Return:
+            - if received, the oldest complete message as bytes.
+            - if not received, None
+        '''
+        if self._frames:
+            return self._frames.popleft()
+
+        with WAIT_TIME.time():
+            frame = self._wait_for_frame(timeout)
+        if frame is None:
+            WAIT_TIMEOUTS.inc()
+        return frame
+
+    def _wait_for_frame(self, timeout:float):
+        if self._reader is not None:
+            self._check_reader()
+            try:
+                return self._frame_queue.get(timeout=timeout)
+            except queue.Empty:
+                self._check_reader()
+                return None
+
+        deadline = time.monotonic() + timeout
+        port_timeout = self._serial_port.timeout
+        try:
+            while not self._frames:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    return None
+                self._serial_port.timeout = remaining
+                data = self._serial_port.read(max(1, self._serial_port.in_waiting))
+                self._frames.extend(self._parse(data))
+        finally:
+            self._serial_port.timeout = port_timeout
+        return self._frames.popleft()
+
+    def _read_serial(self):
+        '''Queue every complete frame that has been received, without blocking.'''
+        if self._reader is not None:
+            self._check_reader()
+            self._drain_frame_queue()
+            return
+
+        waiting = self._serial_port.in_waiting
+        if waiting > 0:
+            self._frames.extend(self._parse(self._serial_port.read(waiting)))
+
+    def _parse(self, data:bytes):
+        '''Feed received bytes to the framer and count what came in.'''
+        frames = self._framer.feed(data)
+        BYTES_RECEIVED.inc(len(data))
+        FRAMES_RECEIVED.inc(len(frames))
+        return frames
+
+    def _drain_frame_queue(self):
+        while True:
+            try:
+                self._frames.append(self._frame_queue.get_nowait())
+            except queue.Empty:
+                return
+
+    def _check_reader(self):
+        if self._reader_error is not None and self._frame_queue.empty():
+            raise self._reader_error
+
+    def send_over_serial(self, data):
+        '''Frame and send a single message, a string (sent as UTF-8) or bytes.'''
 
-        string_with_markers = self._start_marker
-        string_with_markers += data
-        string_with_markers += self._end_marker
         self._serial_port.flush()
         try:
-            self._serial_port.write(string_with_markers.encode('utf-8'))
+            written = self._serial_port.write(self._framer.frame(data))
         except Exception as e:
             raise e
+        FRAMES_SENT.inc()
+        BYTES_SENT.inc(written or 0)
 
-    def receive_over_i2c(self):
-        self.reading_i2c == True
-        while self._message_complete == False and self.reading_i2c == True:
-            x = self._bus.read_byte_data(self.i2c_address, 1)
-
-            if self._data_started == True:
-                if x != self._end_marker:
-                    self._data_buffer = self._data_buffer + x
-                else:
-                    self._data_started = False
-                    self._message_complete = True
-                    self.reading_i2c == False
-            elif x == self._start_marker:
-                self._data_buffer = ''
-                self._data_started = True
-
-        if self._message_complete == True:
-            self._message_complete = False
-            return self._data_buffer
-        else:
-            return 'xxx'
+    def send_frames_over_serial(self, frames):
+        '''Frame several messages and write them to the port in a single write.
 
-    def send_over_i2c(self, string:str):
+        Unlike send_over_serial, this does not wait for previously written data
+        to drain first, so consecutive batches can be pipelined.
 
-        count = 0
-        for char in string:
-            data = int(ord(char))
-            try:
-                self._bus.write_byte(self.i2c_address, data)
-            except Exception as e:
-                raise e
-            count += 1
-        return count
+        Params:
+            - frames: an iterable of strings or bytes to be sent, in order.
+
+        Return:
+            - the number of bytes written.
+        '''
+        framed = [self._framer.frame(frame) for frame in frames]
+        data = b''.join(framed)
+        self._serial_port.write(data)
+        FRAMES_SENT.inc(len(framed))
+        BYTES_SENT.inc(len(data))
+        return len(data)
+
+    def receive_over_i2c(self, timeout:float=1.0):
+        '''Receive a single message over I2C.
+
+        The MCU is read in blocks of I2C_BLOCK_SIZE bytes, which are framed
+        the same way as on the serial port. When the MCU has nothing to send
+        it should pad the block with zeros, which both framings skip.
+
+        Params:
+            - timeout (optional): the maximum number of seconds to keep reading.
+
+        Return:
+            - if received, the oldest complete message.
+            - if not received, 'xxx'
+        '''
+        deadline = time.monotonic() + timeout
+        while not self._i2c_frames:
+            data = self._read_i2c_blocks(1)
+            if self._i2c_frames:
+                break
+            if time.monotonic() >= deadline:
+                return 'xxx'
+            if not data.strip(b'\x00'):
+                time.sleep(self.I2C_POLL_INTERVAL)     # only padding, give the MCU some time
+        return self._i2c_frames.popleft().decode('utf-8', errors='replace')
+
+    def send_over_i2c(self, data):
+        '''Frame and send a single message over I2C, a string (sent as UTF-8) or bytes.
+
+        The frame is split into blocks of I2C_BLOCK_SIZE bytes, all of which
+        are written in a single combined transaction.
+
+        Return:
+            - the number of bytes written.
+        '''
+        frame = self._i2c_framer.frame(data)
+        self._i2c_transfer(self._write_messages(frame))
+        return len(frame)
+
+    def request_over_i2c(self, data, timeout:float=1.0):
+        '''Send a message over I2C and receive the reply.
+
+        The request and the first block of the reply are combined into a
+        single transaction, so short replies take one bus transaction.
+
+        Params:
+            - data: the request, a string (sent as UTF-8) or bytes.
+            - timeout (optional): the maximum number of seconds to wait for the reply.
+
+        Return:
+            - if received, the reply.
+            - if not received, 'xxx'
+        '''
+        frame = self._i2c_framer.frame(data)
+        read = load_smbus().i2c_msg.read(self.i2c_address, self.I2C_BLOCK_SIZE)
+        self._i2c_transfer(self._write_messages(frame) + [read])
+        self._i2c_frames.extend(self._i2c_framer.feed(bytes(read)))
+        return self.receive_over_i2c(timeout)
+
+    def _read_i2c_blocks(self, count:int):
+        '''Read count blocks from the MCU in a single transaction and queue the completed frames.
+
+        Return:
+            - the bytes read.
+        '''
+        i2c_msg = load_smbus().i2c_msg
+        reads = [i2c_msg.read(self.i2c_address, self.I2C_BLOCK_SIZE) for _ in range(count)]
+        self._i2c_transfer(reads)
+        data = b''.join(bytes(read) for read in reads)
+        self._i2c_frames.extend(self._i2c_framer.feed(data))
+        return data
+
+    def _write_messages(self, data:bytes):
+        size = self.I2C_BLOCK_SIZE
+        i2c_msg = load_smbus().i2c_msg
+        return [i2c_msg.write(self.i2c_address, data[i:i + size]) for i in range(0, len(data), size)]
+
+    def _i2c_transfer(self, messages):
+        '''Run I2C messages as few combined transactions as the kernel allows.'''
+        bus = self._open_i2c()
+        for i in range(0, len(messages), self.I2C_MAX_MESSAGES):
+            bus.i2c_rdwr(*messages[i:i + self.I2C_MAX_MESSAGES])
+            self.i2c_transactions += 1
+            I2C_TRANSACTIONS.inc()
+
+    def _open_i2c(self):
+        if isinstance(self._i2c_bus, int):
+            self._i2c_bus = load_smbus().SMBus(self._i2c_bus)
+        return self._i2c_bus
+
+    def _make_framer(self, framing:str):
+        return make_framer(framing, self._start_marker, self._end_marker)
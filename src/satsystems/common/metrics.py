@@ -0,0 +1,288 @@
+'''Counters, gauges and latency histograms for the hot paths.
+
+Instruments are created once, usually at module level, and registered by
+name in a MetricsRegistry:
+
+    FRAMES = metrics.counter('mcu.frames_rx', short='fr')
+    WAIT = metrics.histogram('mcu.wait_ms', short='mw')
+
+    FRAMES.inc()
+    with WAIT.time():
+        ...
+
+Metrics are off by default. While they are off every update returns after
+a single attribute check, so instruments can stay in the hot paths. Turn
+them on with metrics.enable().
+
+A snapshot can be saved as JSON, or packed into short 'name=value'
+strings that fit in radio headers for the beacon. Only instruments given
+a short name go into the beacon.
+'''
+from contextlib import nullcontext
+import json
+import threading
+import time
+
+# histogram precision: values are kept in buckets 1/2**(SUB_BITS - 1) wide relative to their size, ~3%
+SUB_BITS = 5
+_SUB_COUNT = 1 << SUB_BITS
+_HALF = _SUB_COUNT >> 1
+
+_NOT_TIMING = nullcontext()
+
+
+def _bucket(value:int):
+    '''The HDR-style bucket of a non-negative integer: exact below 2**SUB_BITS, then log-linear.'''
+    if value < _SUB_COUNT:
+        return value
+    shift = value.bit_length() - SUB_BITS
+    return _SUB_COUNT + (shift - 1) * _HALF + (value >> shift) - _HALF
+
+def _bucket_value(index:int):
+    '''The middle of the range of values that fall in a bucket.'''
+    if index < _SUB_COUNT:
+        return index
+    shift, offset = divmod(index - _SUB_COUNT, _HALF)
+    shift += 1
+    low = (_HALF + offset) << shift
+    return low + ((1 << shift) - 1) / 2
+
+
+class Counter:
+    '''A value that only goes up, ex: frames received.'''
+
+    def __init__(self, registry:'MetricsRegistry', name:str, short:str=None):
+        self._registry = registry
+        self._lock = threading.Lock()
+        self.name = name
+        self.short = short
+        self.value = 0
+
+    def inc(self, amount:int=1):
+        if not self._registry.enabled:
+            return
+        with self._lock:
+            self.value += amount
+
+    def snapshot(self):
+        return self.value
+
+    def beacon(self):
+        return str(self.value)
+
+    def reset(self):
+        self.value = 0
+
+
+class Gauge:
+    '''A value that is set, ex: the last stream throughput.'''
+
+    def __init__(self, registry:'MetricsRegistry', name:str, short:str=None):
+        self._registry = registry
+        self.name = name
+        self.short = short
+        self.value = None
+
+    def set(self, value:float):
+        if not self._registry.enabled:
+            return
+        self.value = value
+
+    def snapshot(self):
+        return self.value
+
+    def beacon(self):
+        return '-' if self.value is None else f'{self.value:.4g}'
+
+    def reset(self):
+        self.value = None
+
+
+class Histogram:
+    '''The distribution of a latency, recorded in microseconds and reported in milliseconds.
+
+    Values are counted in log-linear buckets like an HDR histogram, so
+    memory stays small whatever the range, and percentiles are within a
+    few percent.
+    '''
+
+    def __init__(self, registry:'MetricsRegistry', name:str, short:str=None):
+        self._registry = registry
+        self._lock = threading.Lock()
+        self.name = name
+        self.short = short
+        self.reset()
+
+    def record(self, microseconds:float):
+        if not self._registry.enabled:
+            return
+        value = max(0, int(microseconds))
+        index = _bucket(value)
+        with self._lock:
+            self._buckets[index] = self._buckets.get(index, 0) + 1
+            self.count += 1
+            self.total += value
+            self.min = value if self.min is None else min(self.min, value)
+            self.max = value if self.max is None else max(self.max, value)
+
+    def time(self):
+        '''A context manager recording how long its body takes.'''
+        if not self._registry.enabled:
+            return _NOT_TIMING
+        return _Timer(self)
+
+    def percentile(self, percent:float):
+        '''The value in milliseconds below which percent of the recorded values fall.'''
+        with self._lock:
+            if not self.count:
+                return None
+            target = max(1, self.count * percent / 100)
+            seen = 0
+            for index in sorted(self._buckets):
+                seen += self._buckets[index]
+                if seen >= target:
+                    return min(max(_bucket_value(index), self.min), self.max) / 1000
+        return self.max / 1000
+
+    def snapshot(self):
+        if not self.count:
+            return {'count': 0}
+        return {
+            'count': self.count,
+            'min': self.min / 1000,
+            'mean': self.total / self.count / 1000,
+            'p50': self.percentile(50),
+            'p90': self.percentile(90),
+            'p99': self.percentile(99),
+            'max': self.max / 1000,
+        }
+
+    def beacon(self):
+        if not self.count:
+            return '-'
+        return f'{self.percentile(50):.3g}/{self.percentile(99):.3g}'
+
+    def reset(self):
+        self._buckets = {}
+        self.count = 0
+        self.total = 0
+        self.min = None
+        self.max = None
+
+
+class _Timer:
+
+    def __init__(self, histogram:Histogram):
+        self._histogram = histogram
+
+    def __enter__(self):
+        self._start = time.perf_counter_ns()
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self._histogram.record((time.perf_counter_ns() - self._start) / 1000)
+
+
+class MetricsRegistry:
+    '''Holds the instruments by name.'''
+
+    def __init__(self, enabled:bool=False):
+        self.enabled = enabled
+        self.started = time.time()
+        self._lock = threading.Lock()
+        self._metrics = {}
+
+    def counter(self, name:str, short:str=None):
+        return self._get(Counter, name, short)
+
+    def gauge(self, name:str, short:str=None):
+        return self._get(Gauge, name, short)
+
+    def histogram(self, name:str, short:str=None):
+        return self._get(Histogram, name, short)
+
+    def snapshot(self):
+        '''
+        Return:
+            - a dict of every metric by name, histograms as a dict of their statistics in ms.
+        '''
+        with self._lock:
+            metrics = list(self._metrics.values())
+        return {
+            'time': time.time(),
+            'uptime_s': time.time() - self.started,
+            'enabled': self.enabled,
+            'metrics': {metric.name: metric.snapshot() for metric in sorted(metrics, key=lambda metric: metric.name)},
+        }
+
+    def to_json(self, **kwargs):
+        return json.dumps(self.snapshot(), **kwargs)
+
+    def beacon_lines(self, max_length:int=32):
+        '''Pack the metrics with a short name into 'short=value' items joined by ';'.
+
+        The uptime comes first as 'up'. Histograms are sent as p50/p99 in ms.
+
+        Params:
+            - max_length (optional): the longest line, ex: the 32 bytes of a radio header.
+
+        Return:
+            - a list of strings, each at most max_length long.
+        '''
+        with self._lock:
+            metrics = [metric for metric in self._metrics.values() if metric.short]
+        items = [f'up={int(time.time() - self.started)}'] + [f'{metric.short}={metric.beacon()}' for metric in metrics]
+
+        lines = []
+        line = ''
+        for item in items:
+            item = item[:max_length]
+            if line and len(line) + 1 + len(item) > max_length:
+                lines.append(line)
+                line = ''
+            line = f'{line};{item}' if line else item
+        if line:
+            lines.append(line)
+        return lines
+
+    def reset(self):
+        '''Zero every metric, ex: after a snapshot has been downlinked.'''
+        with self._lock:
+            for metric in self._metrics.values():
+                metric.reset()
+            self.started = time.time()
+
+    def _get(self, kind, name:str, short:str):
+        with self._lock:
+            metric = self._metrics.get(name)
+            if metric is None:
+                metric = self._metrics[name] = kind(self, name, short)
+            elif not isinstance(metric, kind):
+                raise ValueError(f'metric {name} is a {type(metric).__name__}, not a {kind.__name__}')
+            return metric
+
+
+# the registry shared by all the satellite systems
+REGISTRY = MetricsRegistry()
+
+def counter(name:str, short:str=None):
+    return REGISTRY.counter(name, short)
+
+def gauge(name:str, short:str=None):
+    return REGISTRY.gauge(name, short)
+
+def histogram(name:str, short:str=None):
+    return REGISTRY.histogram(name, short)
+
+def enable(enabled:bool=True):
+    '''Start or stop recording in the shared registry.'''
+    REGISTRY.enabled = enabled
+
+def snapshot():
+    return REGISTRY.snapshot()
+
+def to_json(**kwargs):
+    return REGISTRY.to_json(**kwargs)
+
+def beacon_lines(max_length:int=32):
+    return REGISTRY.beacon_lines(max_length)
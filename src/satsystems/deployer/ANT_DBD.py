@@ -1,4 +1,4 @@
-from .deployer import Deployer, Deployable
+from .deployer import Deployer, Deployable, ARMS, FIRES, FIRE_TIME, DETECTIONS
 from typing import List
 import time
 from gpiozero import LED
@@ -17,6 +17,7 @@ class ANT_DBD(Deployer):
         '''Prepare the system for deployment.'''
 
         self.logger.critical('arming deployment!')
+        ARMS.inc()
         self.led_red.on()
         time.sleep(1)
     
@@ -27,10 +28,12 @@ class ANT_DBD(Deployer):
         self.led_red.off()
         for deployable in deployables:
             self.logger.debug(f'deploying: {deployable}')
-            self.led_yellow.on()
-            time.sleep(1)
-            self.led_yellow.off()
-            time.sleep(1)
+            with FIRE_TIME.time():
+                self.led_yellow.on()
+                time.sleep(1)
+                self.led_yellow.off()
+                time.sleep(1)
+            FIRES.inc()
 
     def detect_deployment(self, deployables:List[Deployable]):
         '''Detect whether the provided systems truly deployed.'''
@@ -38,3 +41,4 @@ class ANT_DBD(Deployer):
         self.logger.debug('confirming deployment!')
         for deployable in deployables:
             self.logger.debug(f'detecting: {deployable}')
+            DETECTIONS.inc()
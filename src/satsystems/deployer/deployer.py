@@ -1,10 +1,14 @@
 import argparse
 from ..common.logger import SatelliteLogger
+from ..common import metrics
 from dataclasses import dataclass
 from abc import ABC, abstractmethod
-import yaml
 from typing import List
 
+ARMS = metrics.counter('deployer.arms')
+FIRES = metrics.counter('deployer.fires', short='df')
+FIRE_TIME = metrics.histogram('deployer.fire_ms', short='dt')     # one deployable, from firing until done
+DETECTIONS = metrics.counter('deployer.detections')
 
 @dataclass
 class Deployable:
@@ -49,6 +53,8 @@ class Deployer(ABC):
         Raises:
             - YAMLError: if there is an issue with the config file.
         '''
+        import yaml
+
         with open(filename, "r") as stream:
             try:
                 configs = yaml.safe_load(stream)
@@ -108,9 +114,10 @@ def do_detect(ant_dbd:Deployer, options):
     ant_dbd.detect_deployment(ant_dbd.deployable_list)
 
 def main():
+    options = parse_cmdline()
+
     from .ANT_DBD import ANT_DBD
 
-    options = parse_cmdline()
     antennta_deployer = ANT_DBD()
     options.function(antennta_deployer, options)
 
@@ -26,9 +26,10 @@ def do_location(gps, options):
     gps.get_location()
 
 def main():
+    options = parse_cmdline()
+
     from .grove import Grove
 
-    options = parse_cmdline()
     gps = Grove(uid='gps_uid', port='/dev/ttyUSB2', baudrate=115200)
     options.function(gps, options)
 
@@ -1,5 +1,4 @@
-from .gui import GUI
-from ..radio.rf24 import RF24
+import argparse
 
 def do_led_flash(**kwargs):
     color = kwargs.get("led_color", "ALL")
@@ -13,13 +12,21 @@ def do_send_message(**kwargs):
     message = entry.get()
     print(f"sending {message} to satellite")
     try:
+        from ..radio.rf24 import RF24
         radio = RF24(1)
         radio.transmit(message)
     except:
         print("could not connect to radio!")
 
 
+def parse_cmdline():
+    parser = argparse.ArgumentParser(description='Ground station GUI to command the satellite.')
+    return parser.parse_args()
+
 def main():
+    parse_cmdline()
+
+    from .gui import GUI
 
     # create an instance of a GUI
     gui = GUI()
@@ -1,17 +1,119 @@
 from ..common.logger import SatelliteLogger
 from ..common.mcu import MCU
+from .scanner import BusScanner, DeviceRegistry
+from .scheduler import BusScheduler, ScheduledDevice, PRIORITY_COMMAND
+from concurrent.futures import ThreadPoolExecutor
 import argparse
 import time
 
-class OBC:
-    '''Interface class to control communication between RPi and a MCU.'''
+# the Arduino address used by the OBC examples
+DEFAULT_MCU_ADDRESS = 0x08
 
-    def __init__(self):
-        self.logger = SatelliteLogger.get_logger('obc')
 
-    def get_devices_on_bus(self, **kwargs):
-        '''Get all the devices currently active on the i2c bus.'''
-        raise NotImplementedError('Should be implemented by derived class.')
+def default_registry():
+    '''The drivers for the devices the satellite is built with.'''
+    registry = DeviceRegistry()
+    registry.register(DEFAULT_MCU_ADDRESS, 'mcu', lambda address, bus: MCU(address=address, i2c_bus=bus), PRIORITY_COMMAND)
+    return registry
+
+
+class OBC:
+    '''Interface class to control communication between RPi and a MCU.
+
+    The OBC owns the physical buses. Every driver attached to the I2C bus is
+    wrapped in a ScheduledDevice, so calls from different drivers take turns
+    on the bus by priority instead of clobbering each other. Drivers on other
+    buses (ex: a UART shared by several MCUs) can be put under the same
+    control with schedule().
+    '''
+
+    def __init__(self, bus=1, registry:DeviceRegistry=None, workers:int=8):
+        '''
+        Params:
+            - bus (optional): the I2C bus number, or an open smbus2.SMBus.
+            - registry (optional): the drivers to attach to found devices, default_registry() if not given.
+            - workers (optional): bus probes and driver boots run at once.
+        '''
+        self.logger = SatelliteLogger.get_logger('obc')
+        self.registry = registry or default_registry()
+        self.scanner = BusScanner(bus, workers)
+        self.devices = {}
+        self.buses = {}
+        self.i2c = self.bus(f'i2c-{bus}' if isinstance(bus, int) else 'i2c')
+        self._workers = workers
+
+    def bus(self, name:str):
+        '''The scheduler that owns a bus, created the first time it is asked for.'''
+        if name not in self.buses:
+            self.buses[name] = BusScheduler(name)
+        return self.buses[name]
+
+    def schedule(self, device, bus:str, priority:int):
+        '''Route every call to a driver through the scheduler of a bus.
+
+        Params:
+            - device: the driver, ex: an RF24 or an HS08.
+            - bus: the bus the driver talks on, ex: 'uart-ttyAMA0'.
+            - priority: one of the PRIORITY_ constants in obc.scheduler.
+
+        Return:
+            - a ScheduledDevice to use in place of the driver.
+        '''
+        return ScheduledDevice(self.bus(bus), device, priority)
+
+    def bus_stats(self):
+        '''
+        Return:
+            - a BusStats snapshot of every bus, see obc.scheduler.
+        '''
+        return [scheduler.stats() for scheduler in self.buses.values()]
+
+    def get_devices_on_bus(self, full:bool=False):
+        '''Get all the devices currently active on the i2c bus.
+
+        Params:
+            - full (optional): sweep every address, otherwise the scan is incremental, see BusScanner.
+
+        Return:
+            - a dict of address to the registered driver name, None for unknown devices.
+        '''
+        found = self.scanner.scan(full)
+        devices = {}
+        for address in found:
+            entry = self.registry.lookup(address)
+            devices[address] = entry[0] if entry else None
+        return devices
+
+    def attach_devices(self, full:bool=False):
+        '''Scan the bus and start a driver for every newly found device that has one.
+
+        Drivers are started in parallel, so boot time does not grow with the
+        number of subsystems. Drivers of devices that stopped answering are
+        dropped.
+
+        Return:
+            - the dict of address to ScheduledDevice for every attached device.
+        '''
+        found = self.get_devices_on_bus(full)
+        for address in set(self.devices) - set(found):
+            self.logger.warning(f'device at {address:#04x} is gone, detaching: {type(self.devices[address].device).__name__}')
+            del self.devices[address]
+
+        new = [address for address, name in found.items() if name is not None and address not in self.devices]
+        if not new:
+            return self.devices
+
+        bus = self.scanner.bus
+        with ThreadPoolExecutor(max_workers=self._workers) as pool:
+            futures = {address: pool.submit(self.registry.lookup(address)[1], address, bus) for address in new}
+        for address, future in futures.items():
+            name, _, priority = self.registry.lookup(address)
+            try:
+                self.devices[address] = ScheduledDevice(self.i2c, future.result(), priority)
+                self.logger.info(f'attached {name} at {address:#04x}')
+            except Exception as e:
+                self.logger.error(f'failed to attach {name} at {address:#04x}: {e}')
+        return self.devices
 
 
 def parse_cmdline():
@@ -36,6 +138,11 @@ def parse_cmdline():
     irx_parser.add_argument('-d', '--data', type=str, help='The string of data to be transmitted.')
     irx_parser.set_defaults(function=do_i2c_rx)
 
+    scan_parser = subparser.add_parser('scan', help='List the devices on the I2C bus.')
+    scan_parser.add_argument('-b', '--bus', type=int, default=1, help='The I2C bus number.')
+    scan_parser.add_argument('--attach', action='store_true', help='Start the drivers of the devices found.')
+    scan_parser.set_defaults(function=do_scan)
+
     return parser.parse_args()
 
 
@@ -43,11 +150,10 @@ def do_uart_tx(obc, options):
     obc.send_over_serial(options.data)
 
 def do_uart_rx(obc, options):
-    start_time = time.time()
     received = 'xxx'
     while received == 'xxx':
-        received = obc.receive_over_serial()
-        if time.time() > start_time + 60.0:
+        received = obc.wait_over_serial(60.0)
+        if received == 'xxx':
             print('no message for 60s')
     print(f'received: {received}')
 
@@ -55,19 +161,30 @@ def do_i2c_tx(obc, options):
     obc.send_over_i2c(options.data)
 
 def do_i2c_rx(obc, options):
-    start_time = time.time()
     received = 'xxx'
     while received == 'xxx':
-        received = obc.receive_over_i2c()
-        if time.time() > start_time + 60.0:
+        received = obc.receive_over_i2c(60.0)
+        if received == 'xxx':
             print('no message for 60s')
     print(f'received: {received}')
 
-def main():
-    from ..common.mcu import MCU
+def do_scan(obc, options):
+    start_time = time.time()
+    devices = obc.get_devices_on_bus(full=True)
+    print(f'found {len(devices)} devices in {time.time() - start_time:.3f} s')
+    for address, name in devices.items():
+        print(f'{address:#04x}: {name or "unknown"}')
+    if options.attach:
+        obc.attach_devices()
+        for stats in obc.bus_stats():
+            print(f'{stats.name}: {stats.requests} requests, {stats.utilization:.1%} busy')
 
+def main():
     options = parse_cmdline()
-    obc = MCU(port=options.port, address=options.address)
+    if options.function is do_scan:
+        obc = OBC(options.bus)
+    else:
+        obc = MCU(port=options.port, address=options.address)
     options.function(obc, options)
 
 if __name__ == '__main__':
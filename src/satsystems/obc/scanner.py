@@ -0,0 +1,154 @@
+from ..common.mcu import load_smbus
+from .scheduler import PRIORITY_HOUSEKEEPING
+from concurrent.futures import ThreadPoolExecutor
+import threading
+import time
+
+# the 7-bit addresses that are not reserved, the same range as i2cdetect
+FIRST_ADDRESS = 0x08
+LAST_ADDRESS = 0x77
+
+# ranges where a quick write can corrupt some EEPROMs, i2cdetect probes these with a read instead
+READ_PROBE_RANGES = (range(0x30, 0x38), range(0x50, 0x60))
+
+
+class BusScanner:
+    '''Finds the devices that answer on an I2C bus.
+
+    The first scan() sweeps the whole address space. After that, a scan
+    only re-checks the addresses known to be present (to notice removals)
+    plus sweep_size of the absent ones, rotating through them so a newly
+    plugged in device is found within a few scans without sweeping all 112
+    addresses every time. scan(full=True) forces a complete sweep.
+
+    Probes are spread over a small thread pool so slow probes (ex: a device
+    stretching the clock) overlap, the kernel still runs one transaction
+    on the bus at a time.
+    '''
+
+    def __init__(self, bus=1, workers:int=8, sweep_size:int=16):
+        '''
+        Params:
+            - bus (optional): the I2C bus number, or an open smbus2.SMBus.
+            - workers (optional): probes in flight at once.
+            - sweep_size (optional): absent addresses re-probed by each incremental scan.
+        '''
+        self._bus = bus
+        self._workers = workers
+        self._sweep_size = sweep_size
+        self._lock = threading.Lock()
+        self._present = set()
+        self._scanned = False
+        self._next_sweep = FIRST_ADDRESS
+        self.last_scan = None
+        self.probes = 0
+
+    @property
+    def bus(self):
+        '''The open bus, shared with the drivers of the devices found on it.'''
+        return self._open()
+
+    @property
+    def present(self):
+        '''The addresses found by the last scan.'''
+        return set(self._present)
+
+    def scan(self, full:bool=False):
+        '''Probe the bus.
+
+        Params:
+            - full (optional): probe every address instead of an incremental scan.
+
+        Return:
+            - the sorted list of addresses that answered.
+        '''
+        if full or not self._scanned:
+            addresses = list(range(FIRST_ADDRESS, LAST_ADDRESS + 1))
+        else:
+            addresses = sorted(self._present | set(self._sweep_addresses()))
+        return self.rescan(addresses, full or not self._scanned)
+
+    def rescan(self, addresses, full:bool=False):
+        '''Probe only the given addresses, ex: the slot a device was plugged in to.
+
+        Return:
+            - the sorted list of all addresses known to be present.
+        '''
+        bus = self._open()
+        with ThreadPoolExecutor(max_workers=self._workers) as pool:
+            answers = dict(zip(addresses, pool.map(lambda address: self.probe(address, bus), addresses)))
+
+        with self._lock:
+            if full:
+                self._present = set()
+            self._present |= {address for address, answered in answers.items() if answered}
+            self._present -= {address for address, answered in answers.items() if not answered}
+            self._scanned = True
+            self.last_scan = time.time()
+            return sorted(self._present)
+
+    def probe(self, address:int, bus=None):
+        '''Check if a device answers at address.'''
+        bus = bus or self._open()
+        with self._lock:
+            self.probes += 1
+        i2c_msg = load_smbus().i2c_msg
+        try:
+            if any(address in probe_range for probe_range in READ_PROBE_RANGES):
+                bus.i2c_rdwr(i2c_msg.read(address, 1))
+            else:
+                bus.i2c_rdwr(i2c_msg.write(address, []))    # quick write, no data
+        except OSError:
+            return False
+        return True
+
+    def _sweep_addresses(self):
+        '''The next sweep_size addresses of the rotating sweep.'''
+        count = LAST_ADDRESS - FIRST_ADDRESS + 1
+        start = self._next_sweep - FIRST_ADDRESS
+        self._next_sweep = FIRST_ADDRESS + (start + self._sweep_size) % count
+        return [FIRST_ADDRESS + (start + i) % count for i in range(min(self._sweep_size, count))]
+
+    def _open(self):
+        if isinstance(self._bus, int):
+            self._bus = load_smbus().SMBus(self._bus)
+        return self._bus
+
+
+class DeviceRegistry:
+    '''Maps I2C addresses to the drivers that control the devices found there.
+
+    A driver is any callable taking (address, bus) and returning the
+    driver object, ex: a class or a lambda around one. The priority is
+    the one its calls get on the bus, see obc.scheduler.
+
+        registry = DeviceRegistry()
+        registry.register(0x08, 'mcu', lambda address, bus: MCU(address=address, i2c_bus=bus))
+    '''
+
+    def __init__(self):
+        self._drivers = {}
+
+    def register(self, address:int, name:str, driver, priority:int=PRIORITY_HOUSEKEEPING):
+        '''
+        Raises:
+            ValueError: if the address is reserved or already has a driver.
+        '''
+        if not FIRST_ADDRESS <= address <= LAST_ADDRESS:
+            raise ValueError(f'address {address:#04x} is reserved, {FIRST_ADDRESS:#04x} to {LAST_ADDRESS:#04x} are expected.')
+        if address in self._drivers:
+            raise ValueError(f'address {address:#04x} already has a driver: {self._drivers[address][0]}')
+        self._drivers[address] = (name, driver, priority)
+
+    def lookup(self, address:int):
+        '''
+        Return:
+            - (name, driver, priority) registered for address, or None.
+        '''
+        return self._drivers.get(address)
+
+    def __contains__(self, address:int):
+        return address in self._drivers
+
+    def __iter__(self):
+        return iter(sorted(self._drivers))
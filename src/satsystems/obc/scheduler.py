@@ -0,0 +1,212 @@
+'''Time-sliced access to a shared bus.
+
+Several drivers can sit on one physical bus, ex: MCUs sharing /dev/ttyAMA0
+or I2C bus 1. If they talk at the same time their transactions interleave
+and clobber each other. A BusScheduler owns the bus: drivers submit
+requests, and a single worker thread runs them one at a time, most urgent
+first. Requests queued back to back for the same device run as one batch,
+so the bus is not handed over between them.
+
+Wrap a driver in a ScheduledDevice to route all of its calls through the
+scheduler without changing the code that uses it:
+
+    uart = BusScheduler('uart')
+    wheel = ScheduledDevice(uart, HS08(0, '/dev/ttyAMA0'), PRIORITY_ATTITUDE)
+    wheel.rotate_cw(90)     # waits for its turn on the bus
+'''
+from concurrent.futures import Future
+from collections import deque
+from dataclasses import dataclass, field, replace
+import itertools
+import threading
+import time
+
+# lower runs first
+PRIORITY_ATTITUDE = 0       # reaction wheels, detumbling
+PRIORITY_COMMAND = 1        # radio links and ground commands
+PRIORITY_NAVIGATION = 2     # GPS
+PRIORITY_HOUSEKEEPING = 3   # telemetry, status polls
+
+
+@dataclass
+class BusStats:
+    '''A snapshot of how a bus is being used.'''
+    name: str
+    requests: int = 0
+    batches: int = 0
+    failures: int = 0
+    queued: int = 0
+    busy_s: float = 0.0
+    uptime_s: float = 0.0
+    utilization: float = 0.0            # fraction of time spent running requests since the start
+    recent_utilization: float = 0.0     # the same, over the last window_s seconds
+    mean_wait_ms: float = 0.0
+    max_wait_ms: float = 0.0
+    by_priority: dict = field(default_factory=dict)
+
+    @property
+    def saturated(self):
+        return self.recent_utilization > 0.9
+
+
+class _Request:
+
+    def __init__(self, priority:int, sequence:int, device, function, args, kwargs):
+        self.priority = priority
+        self.sequence = sequence
+        self.device = device
+        self.function = function
+        self.args = args
+        self.kwargs = kwargs
+        self.future = Future()
+        self.queued_at = time.monotonic()
+
+    @property
+    def order(self):
+        return (self.priority, self.sequence)
+
+
+class BusScheduler:
+    '''Owns a bus and runs the requests for it one at a time, by priority.'''
+
+    def __init__(self, name:str, max_batch:int=8, window_s:float=10.0):
+        '''
+        Params:
+            - name: the bus, used in the stats and the worker thread name.
+            - max_batch (optional): the most requests for one device run back to back.
+            - window_s (optional): the period recent_utilization is measured over.
+        '''
+        self.name = name
+        self.max_batch = max_batch
+        self.window_s = window_s
+        self._pending = []
+        self._condition = threading.Condition()
+        self._sequence = itertools.count()
+        self._running = True
+        self._started = time.monotonic()
+        self._busy = deque()        # (start, end) of recent batches
+        self._stats = BusStats(name)
+        self._total_wait = 0.0
+        self._worker = threading.Thread(target=self._run, name=f'bus-{name}', daemon=True)
+        self._worker.start()
+
+    def submit(self, device, function, *args, priority:int=PRIORITY_HOUSEKEEPING, **kwargs):
+        '''Queue a call to function(*args, **kwargs) that uses device.
+
+        Params:
+            - device: the driver the call is for, calls for the same device are batched.
+            - function: the callable to run while holding the bus.
+            - priority (optional): one of the PRIORITY_ constants, lower runs first.
+
+        Return:
+            - a Future with the result of the call.
+        '''
+        request = _Request(priority, next(self._sequence), device, function, args, kwargs)
+        with self._condition:
+            if not self._running:
+                raise RuntimeError(f'bus {self.name} is stopped')
+            self._pending.append(request)
+            self._condition.notify()
+        return request.future
+
+    def call(self, device, function, *args, priority:int=PRIORITY_HOUSEKEEPING, timeout:float=None, **kwargs):
+        '''Like submit(), but wait for the result.'''
+        return self.submit(device, function, *args, priority=priority, **kwargs).result(timeout)
+
+    def stop(self):
+        '''Finish the queued requests and stop the worker thread.'''
+        with self._condition:
+            self._running = False
+            self._condition.notify()
+        self._worker.join()
+
+    def stats(self):
+        '''
+        Return:
+            - a BusStats snapshot.
+        '''
+        now = time.monotonic()
+        with self._condition:
+            stats = replace(self._stats, by_priority=dict(self._stats.by_priority))
+            stats.queued = len(self._pending)
+            recent = sum(min(end, now) - max(start, now - self.window_s) for start, end in self._busy if end > now - self.window_s)
+        stats.uptime_s = now - self._started
+        stats.utilization = stats.busy_s / stats.uptime_s if stats.uptime_s else 0.0
+        stats.recent_utilization = recent / min(self.window_s, stats.uptime_s) if stats.uptime_s else 0.0
+        stats.mean_wait_ms = self._total_wait / stats.requests * 1000 if stats.requests else 0.0
+        return stats
+
+    def _next_batch(self):
+        '''Take the most urgent request, and the requests for the same device that can run right after it.'''
+        first = min(self._pending, key=lambda request: request.order)
+        # a batch must not hold the bus while another device has something more urgent
+        cutoff = min((request.priority for request in self._pending if request.device is not first.device), default=None)
+        followers = sorted((request for request in self._pending
+                            if request is not first and request.device is first.device
+                            and (cutoff is None or request.priority <= cutoff)),
+                           key=lambda request: request.order)
+        batch = [first] + followers[:self.max_batch - 1]
+        for request in batch:
+            self._pending.remove(request)
+        return batch
+
+    def _run(self):
+        while True:
+            with self._condition:
+                while not self._pending and self._running:
+                    self._condition.wait()
+                if not self._pending:
+                    return
+                batch = self._next_batch()
+
+            start = time.monotonic()
+            failures = 0
+            for request in batch:
+                if not request.future.set_running_or_notify_cancel():
+                    continue
+                try:
+                    request.future.set_result(request.function(*request.args, **request.kwargs))
+                except Exception as e:
+                    failures += 1
+                    request.future.set_exception(e)
+            end = time.monotonic()
+
+            with self._condition:
+                stats = self._stats
+                stats.requests += len(batch)
+                stats.batches += 1
+                stats.failures += failures
+                stats.busy_s += end - start
+                for request in batch:
+                    wait = start - request.queued_at
+                    self._total_wait += wait
+                    stats.max_wait_ms = max(stats.max_wait_ms, wait * 1000)
+                    stats.by_priority[request.priority] = stats.by_priority.get(request.priority, 0) + 1
+                self._busy.append((start, end))
+                while self._busy and self._busy[0][1] < end - self.window_s:
+                    self._busy.popleft()
+
+
+class ScheduledDevice:
+    '''Routes every method call of a driver through a BusScheduler.'''
+
+    def __init__(self, scheduler:BusScheduler, device, priority:int=PRIORITY_HOUSEKEEPING, timeout:float=None):
+        self._scheduler = scheduler
+        self._device = device
+        self._priority = priority
+        self._timeout = timeout
+
+    @property
+    def device(self):
+        '''The wrapped driver, calls made on it directly bypass the scheduler.'''
+        return self._device
+
+    def __getattr__(self, name):
+        attribute = getattr(self._device, name)
+        if not callable(attribute):
+            return attribute
+
+        def scheduled(*args, priority:int=None, **kwargs):
+            priority = self._priority if priority is None else priority
+            return self._scheduler.call(self._device, attribute, *args, priority=priority, timeout=self._timeout, **kwargs)
+        return scheduled
@@ -0,0 +1,99 @@
+from ..common.logger import SatelliteLogger
+from ..common.aiomcu import AsyncMCU
+from .rf24 import RF24
+import time
+
+
+class AsyncRF24:
+    '''Asyncio version of RF24 for driving many radios from one event loop.
+
+    The boot handshake runs in open() rather than in the constructor so the
+    handshakes of several devices can be awaited together, see common.aiomcu.open_all.
+    '''
+
+    def __init__(self, uid, port, baud=115200, start_marker='<', end_marker='>', framing='marker'):
+        self._uid = uid
+        self.logger = SatelliteLogger.get_logger('radio')
+        self._arduino = AsyncMCU(port, baud, start_marker, end_marker, framing)
+        self.supported_modes = ['T', 'S', 'R']      # transmit, stream, receive
+
+    async def open(self):
+        '''Connect to the MCU and perform the radio boot handshake.'''
+        if self._uid not in [0, 1]:
+            raise ValueError(f'uid must be 0 or 1, not {self._uid}')
+
+        try:
+            await self._arduino.open()
+        except Exception as e:
+            self.logger.critical(f'failed to open connection to MCU on port: {self._arduino._port}')
+            raise e
+
+        await self._wait_for_msg('ready: serial')
+        await self._arduino.send_over_serial(str(self._uid))
+        await self._wait_for_msg('ready: radio')
+        self.logger.info(f'radio {self._uid} booted')
+
+    def close(self):
+        self._arduino.close()
+
+    async def transmit(self, data:str):
+        '''Send a string of characters to the other radio, await for a response.
+
+        Params:
+            - data: 32 characters (string or bytes) to send.
+        '''
+        await self._transmit_header(data)
+        self.logger.debug('transmitted: %s', data)
+        got_back = await self.receive()
+        if got_back == 'xxx':
+            self.logger.warning(f'failed to receive acknowledgement')
+        self.logger.debug('received in return: %s', got_back)
+
+    async def receive(self, timeout:float=60.0):
+        '''Attempt to receive a single message from the other radio.
+
+        Params:
+            - timeout (optional): duration in which to receive a message.
+
+        Return:
+            - if received, the string sent from the arduino over serial.
+            - if not received, 'xxx'
+        '''
+        received = await self._arduino.receive_over_serial(timeout)
+        if received == 'xxx':
+            self.logger.warning(f'no message received within {timeout} s.')
+
+        return received
+
+    async def _wait_for_msg(self, msg:str='ready: serial', timeout:int=10):
+        start_time = time.time()
+        incoming = ''
+        while incoming.find(msg) == -1:
+            remaining = start_time + timeout - time.time()
+            if remaining <= 0:
+                self.logger.warning(f'no message received, expected: {msg}')
+                break
+            incoming = await self._arduino.receive_over_serial(remaining)
+            if not (incoming == 'xxx'):
+                self.logger.debug(incoming)
+
+    async def _transmit_header(self, data:str, mode:str='T', num_payloads:int=1):
+        '''Send a single header message. See RF24._transmit_header.'''
+        data_len = len(data)
+
+        if not data: # must not be an empty string
+            raise ValueError('passed in an empty string!')
+
+        if data_len > 32: # max 32 bytes for a single transmission
+            raise ValueError(f'string is too long, {data_len} is greater than 32 characters')
+
+        formatted_data = self._format_header(mode, num_payloads, data)
+        try:
+            await self._arduino.send_over_serial(formatted_data)
+        except Exception as e:
+            self.logger.error(f'failed to transmit: {formatted_data}')
+            raise e
+
+        return data_len
+
+    _format_header = RF24._format_header
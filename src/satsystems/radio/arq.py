@@ -0,0 +1,319 @@
+'''Reliable file transfer over a lossy radio link.
+
+The transfer uses selective-repeat ARQ. Every data packet carries a sequence
+number and a CRC32, and the receiver keeps a map of which packets it has.
+After each round of data packets the sender asks for the receiver's status
+and gets back bitmaps of only the missing packets. Only those are resent, so a
+lost packet costs one packet of airtime instead of a full re-stream.
+
+Packets are plain bytes. A link is any object with:
+    - packet_size: the largest packet the link can carry, in bytes.
+    - send(packet): transmit a single packet.
+    - receive(timeout): return the next packet, or None if none arrived in time.
+
+LoopbackLink provides a pair of in-process links with configurable loss and
+corruption, standing in for two Arduinos and their radios.
+'''
+from dataclasses import dataclass
+from .filesource import FileSource
+import queue
+import random
+import struct
+import time
+import zlib
+
+META = b'M'         # start of a transfer: number of packets, file size, file crc
+DATA = b'D'         # sequence number followed by a slice of the file
+QUERY = b'Q'        # sender asks for the receiver's status
+NACK = b'N'         # bitmap of missing packets, more flag set if another NACK follows
+FINISHED = b'F'     # the receiver has the whole file
+
+CRC_SIZE = 4
+DATA_HEADER_SIZE = 1 + 4
+META_FORMAT = '>III'         # number of packets, file size, file crc
+NACK_FORMAT = '>BI'          # more flag, sequence number of the first bit
+
+
+class PacketError(ValueError):
+    '''Raised when a packet is corrupt or malformed.'''
+
+
+def encode_packet(kind:bytes, body:bytes=b''):
+    '''Build a packet with its CRC32 trailer.'''
+    packet = kind + body
+    return packet + struct.pack('>I', zlib.crc32(packet))
+
+def decode_packet(packet:bytes):
+    '''Check a packet's CRC32 trailer.
+
+    Return:
+        - (kind, body) of the packet.
+
+    Raises:
+        PacketError: if the packet is too short or the CRC does not match.
+    '''
+    if len(packet) < 1 + CRC_SIZE:
+        raise PacketError(f'packet of {len(packet)} bytes is too short')
+    content, (crc,) = packet[:-CRC_SIZE], struct.unpack('>I', packet[-CRC_SIZE:])
+    if zlib.crc32(content) != crc:
+        raise PacketError('crc mismatch')
+    return content[:1], content[1:]
+
+def data_size(packet_size:int):
+    '''The number of file bytes that fit in a data packet.'''
+    return packet_size - DATA_HEADER_SIZE - CRC_SIZE
+
+
+@dataclass
+class TransferStats:
+    '''A summary of a reliable transfer.'''
+    num_bytes: int = 0
+    num_packets: int = 0
+    packets_sent: int = 0
+    retransmitted: int = 0
+    corrupt: int = 0
+    rounds: int = 0
+    elapsed: float = 0.0
+
+
+class ReliableSender:
+    '''Send a file over a link using selective-repeat ARQ.'''
+
+    def __init__(self, link, timeout:float=2.0, max_retries:int=10):
+        '''
+        Params:
+            - link: the link to send over, see module docstring.
+            - timeout (optional): seconds to wait for the receiver's status.
+            - max_retries (optional): status requests to make without an answer before giving up.
+        '''
+        self._link = link
+        self._timeout = timeout
+        self._max_retries = max_retries
+
+    def send_file(self, filename:str):
+        '''Send a file. See send().'''
+        with FileSource(filename, data_size(self._link.packet_size)) as source:
+            return self.send(source)
+
+    def send(self, source):
+        '''Send everything in a source until the receiver has all of it.
+
+        Params:
+            - source: an open FileSource (or anything with the same size,
+                num_payloads, payload_size and payload(index) members), whose
+                payload size fits in a data packet of this link.
+
+        Return:
+            - TransferStats for the transfer.
+
+        Raises:
+            TimeoutError: if the receiver stops answering.
+        '''
+        if source.payload_size > data_size(self._link.packet_size):
+            raise ValueError(f'payloads of {source.payload_size} bytes do not fit in {self._link.packet_size} byte packets')
+
+        start_time = time.time()
+        stats = TransferStats(num_bytes=source.size, num_packets=source.num_payloads)
+        file_crc = 0
+        for payload in source:
+            file_crc = zlib.crc32(payload, file_crc)
+
+        meta = encode_packet(META, struct.pack(META_FORMAT, source.num_payloads, source.size, file_crc))
+        missing = self._request_status(meta)
+        sent = bytearray(source.num_payloads)   # one flag per packet, 1 once it has been sent
+        while missing is not None:
+            stats.rounds += 1
+            for seq in missing:
+                self._link.send(encode_packet(DATA, struct.pack('>I', seq) + source.payload(seq)))
+                stats.packets_sent += 1
+                # the first NACKs are capped, so later rounds also carry packets never sent before
+                stats.retransmitted += sent[seq]
+                sent[seq] = 1
+            missing = self._request_status(encode_packet(QUERY))
+
+        stats.elapsed = time.time() - start_time
+        return stats
+
+    def _request_status(self, request:bytes):
+        '''Send a META or QUERY packet and collect the receiver's reply.
+
+        Return:
+            - the sequence numbers the receiver is missing, or None once it has everything.
+        '''
+        for _ in range(self._max_retries):
+            self._link.send(request)
+            missing = []
+            answered = False
+            while True:
+                packet = self._link.receive(self._timeout)
+                if packet is None:
+                    break
+                try:
+                    kind, body = decode_packet(packet)
+                except PacketError:
+                    continue
+                if kind == FINISHED:
+                    return None
+                if kind != NACK:
+                    continue
+                answered = True
+                more, base = struct.unpack(NACK_FORMAT, body[:5])
+                bitmap = body[5:]
+                missing.extend(base + bit for bit in range(len(bitmap) * 8) if bitmap[bit >> 3] & (1 << (bit & 7)))
+                if not more:
+                    break
+            if answered:
+                return missing
+        raise TimeoutError(f'no status from the receiver after {self._max_retries} requests')
+
+
+class ReliableReceiver:
+    '''Receive a file sent by a ReliableSender.'''
+
+    def __init__(self, link, timeout:float=30.0, linger:float=2.0, max_nacks:int=16):
+        '''
+        Params:
+            - link: the link to receive on, see module docstring.
+            - timeout (optional): seconds without any packet before giving up.
+            - linger (optional): seconds to keep answering the sender after the file is complete.
+            - max_nacks (optional): the most NACK packets sent in reply to a single status request.
+        '''
+        self._link = link
+        self._timeout = timeout
+        self._linger = linger
+        self._max_nacks = max_nacks
+        self._bitmap_bits = (link.packet_size - 1 - struct.calcsize(NACK_FORMAT) - CRC_SIZE) * 8
+
+    def receive(self, sink):
+        '''Receive a single transfer.
+
+        Params:
+            - sink: an open FileSink (or anything with a write(bytes) method).
+                Data is written strictly in order.
+
+        Return:
+            - TransferStats for the transfer.
+
+        Raises:
+            TimeoutError: if the sender goes quiet before the transfer completes.
+            PacketError: if the reassembled file does not match the sender's CRC.
+        '''
+        start_time = time.time()
+        stats = TransferStats()
+        received = None     # one flag per packet, 1 once the packet has arrived
+        pending = {}        # packets that arrived ahead of the next one to be written
+        next_seq = 0
+        file_crc = 0
+        expected_crc = None
+
+        while True:
+            complete = received is not None and next_seq == len(received)
+            packet = self._link.receive(self._linger if complete else self._timeout)
+            if packet is None:
+                if complete:
+                    break
+                raise TimeoutError(f'transfer stalled with {next_seq} of {stats.num_packets} packets written')
+            try:
+                kind, body = decode_packet(packet)
+            except PacketError:
+                stats.corrupt += 1
+                continue
+
+            if kind == META:
+                num_packets, num_bytes, crc = struct.unpack(META_FORMAT, body)
+                if received is None:
+                    received = bytearray(num_packets)
+                    stats.num_packets = num_packets
+                    stats.num_bytes = num_bytes
+                    expected_crc = crc
+                self._send_status(received)
+            elif kind == QUERY and received is not None:
+                self._send_status(received)
+            elif kind == QUERY:
+                # a QUERY only follows a META that was answered, so this one is left over from
+                # the previous transfer whose FINISHED got lost, let that sender finish
+                self._link.send(encode_packet(FINISHED))
+            elif kind == DATA and received is not None:
+                stats.packets_sent += 1
+                (seq,) = struct.unpack('>I', body[:4])
+                if seq >= len(received) or received[seq]:
+                    continue
+                received[seq] = 1
+                pending[seq] = body[4:]
+                while next_seq in pending:
+                    data = pending.pop(next_seq)
+                    sink.write(data)
+                    file_crc = zlib.crc32(data, file_crc)
+                    next_seq += 1
+                if next_seq == len(received) and file_crc != expected_crc:
+                    raise PacketError('file crc mismatch after reassembly')
+
+        stats.retransmitted = stats.packets_sent - stats.num_packets
+        stats.elapsed = time.time() - start_time
+        return stats
+
+    def _send_status(self, received:bytearray):
+        '''Reply with FINISHED, or with NACK bitmaps of the first missing packets.'''
+        seq = received.find(0)
+        if seq == -1:
+            self._link.send(encode_packet(FINISHED))
+            return
+
+        nacks = []
+        while seq != -1 and len(nacks) < self._max_nacks:
+            base = seq
+            bitmap = bytearray(self._bitmap_bits // 8)
+            while seq != -1 and seq < base + self._bitmap_bits:
+                offset = seq - base
+                bitmap[offset >> 3] |= 1 << (offset & 7)
+                seq = received.find(0, seq + 1)
+            nacks.append((base, bitmap))
+
+        for i, (base, bitmap) in enumerate(nacks):
+            more = int(i < len(nacks) - 1)
+            self._link.send(encode_packet(NACK, struct.pack(NACK_FORMAT, more, base) + bytes(bitmap)))
+
+
+class LoopbackLink:
+    '''One end of an in-process link, a stand-in for an Arduino and its radio.
+
+    Create connected ends with LoopbackLink.pair().
+    '''
+
+    def __init__(self, packet_size:int=32, loss:float=0.0, corruption:float=0.0, rng=None):
+        self.packet_size = packet_size
+        self.loss = loss
+        self.corruption = corruption
+        self.sent = 0
+        self.dropped = 0
+        self._rng = rng or random.Random()
+        self._inbox = queue.Queue()
+        self._peer = None
+
+    @classmethod
+    def pair(cls, packet_size:int=32, loss:float=0.0, corruption:float=0.0, seed=None):
+        '''Create two connected ends that share the same loss and corruption rates.'''
+        rng = random.Random(seed)
+        a = cls(packet_size, loss, corruption, rng)
+        b = cls(packet_size, loss, corruption, rng)
+        a._peer, b._peer = b, a
+        return a, b
+
+    def send(self, packet:bytes):
+        if len(packet) > self.packet_size:
+            raise ValueError(f'packet is too long, {len(packet)} is greater than {self.packet_size} bytes')
+        self.sent += 1
+        if self._rng.random() < self.loss:
+            self.dropped += 1
+            return
+        if self._rng.random() < self.corruption:
+            packet = bytearray(packet)
+            packet[self._rng.randrange(len(packet))] ^= 0xFF
+            packet = bytes(packet)
+        self._peer._inbox.put(packet)
+
+    def receive(self, timeout:float=None):
+        try:
+            return self._inbox.get(timeout=timeout)
+        except queue.Empty:
+            return None
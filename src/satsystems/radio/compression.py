@@ -0,0 +1,252 @@
+'''Compression stage for radio payloads.
+
+Telemetry and logs are mostly text and compress well, so compressing them
+before they are split into 32 byte payloads means fewer payloads on air.
+
+A codec is picked by name when a stream or message is sent, and the name is
+carried in the header so the receiving radio knows how to undo it:
+
+    - streams: the header data becomes 'receive_stream;<name>'.
+    - single messages: the payload is '~', the codec's one byte tag, then
+        the compressed message.
+
+Codecs:
+    - zlib: raw deflate, a good default for files.
+    - lzma: raw LZMA2, smaller output at a higher CPU cost.
+    - dict: raw deflate primed with TELEMETRY_DICTIONARY, so that short
+        messages (which are too small to build up their own history) still
+        compress. Both radios must use the same dictionary.
+
+Run the module to benchmark airtime saved against Pi CPU cost:
+
+    python -m satsystems.radio.compression -f data/test-data.txt
+'''
+import argparse
+import lzma
+import time
+import zlib
+
+MESSAGE_MARKER = b'~'
+
+# raised by the decompressors when the data is corrupt
+CORRUPT_DATA_ERRORS = (zlib.error, lzma.LZMAError)
+
+# words and phrases that show up in telemetry, beacons and logs, most common last
+TELEMETRY_DICTIONARY = (
+    b'temperature: pressure: humidity: altitude: latitude: longitude: '
+    b'voltage: current: power: battery: solar: rpm: speed: torque: '
+    b'gyro: accel: mag: x: y: z: error: warn: info: debug: '
+    b'deployed stowed ready: radio0 ready: radio1 ready: serial '
+    b'receive_stream stop_stream ACK STOP VA3TFO healthy '
+    b'true false none 0.0 0.00 1.0 -1.0 '
+)
+
+
+class Codec:
+    '''Base class, subclasses provide the incremental compressor and decompressor.'''
+
+    name = None
+    tag = None      # a single byte that identifies the codec in a compressed message
+
+    def __init__(self, level:int=None):
+        self.level = self.default_level if level is None else level
+
+    def compressor(self):
+        '''An object with compress(data) and flush() methods.'''
+        raise NotImplementedError
+
+    def decompressor(self):
+        '''An object with a decompress(data) method and an eof attribute.'''
+        raise NotImplementedError
+
+    def compress(self, data:bytes):
+        compressor = self.compressor()
+        return compressor.compress(data) + compressor.flush()
+
+    def decompress(self, data:bytes):
+        '''
+        Raises:
+            ValueError: if the data is corrupt or truncated.
+        '''
+        decompressor = self.decompressor()
+        try:
+            decompressed = decompressor.decompress(data)
+        except CORRUPT_DATA_ERRORS as e:
+            raise ValueError(f'corrupt {self.name} data: {e}')
+        if not decompressor.eof:
+            raise ValueError(f'truncated {self.name} data')
+        return decompressed
+
+
+class ZlibCodec(Codec):
+
+    name = 'zlib'
+    tag = b'z'
+    default_level = 6
+
+    def compressor(self):
+        return zlib.compressobj(self.level, zlib.DEFLATED, -zlib.MAX_WBITS)
+
+    def decompressor(self):
+        return zlib.decompressobj(-zlib.MAX_WBITS)
+
+
+class LzmaCodec(Codec):
+
+    name = 'lzma'
+    tag = b'l'
+    default_level = 6
+
+    def _filters(self):
+        return [{'id': lzma.FILTER_LZMA2, 'preset': self.level}]
+
+    def compressor(self):
+        return lzma.LZMACompressor(format=lzma.FORMAT_RAW, filters=self._filters())
+
+    def decompressor(self):
+        return lzma.LZMADecompressor(format=lzma.FORMAT_RAW, filters=self._filters())
+
+
+class DictCodec(Codec):
+
+    name = 'dict'
+    tag = b'd'
+    default_level = 9
+
+    def __init__(self, level:int=None, dictionary:bytes=TELEMETRY_DICTIONARY):
+        super().__init__(level)
+        self.dictionary = dictionary
+
+    def compressor(self):
+        return zlib.compressobj(self.level, zlib.DEFLATED, -zlib.MAX_WBITS, zdict=self.dictionary)
+
+    def decompressor(self):
+        return zlib.decompressobj(-zlib.MAX_WBITS, zdict=self.dictionary)
+
+
+CODECS = {codec.name: codec for codec in (ZlibCodec, LzmaCodec, DictCodec)}
+
+
+def get_codec(name:str, level:int=None):
+    '''Create a codec by name.
+
+    Raises:
+        ValueError: if there is no codec with that name.
+    '''
+    if name not in CODECS:
+        raise ValueError(f'unknown compression: {name}, one of {", ".join(CODECS)} is expected.')
+    return CODECS[name](level)
+
+def codec_for_tag(tag:bytes):
+    '''Create the codec a compressed message was made with, None if the tag is unknown.'''
+    for codec in CODECS.values():
+        if codec.tag == tag:
+            return codec()
+    return None
+
+def compress_chunks(chunks, codec:Codec, size:int):
+    '''Compress an iterable of byte strings and cut the output into packets.
+
+    Params:
+        - chunks: the data to compress, ex: the payloads of a FileSource.
+        - codec: the codec to compress with.
+        - size: the length of every packet but the last.
+
+    Return:
+        - a list of packets.
+    '''
+    compressor = codec.compressor()
+    compressed = bytearray()
+    for chunk in chunks:
+        compressed += compressor.compress(chunk)
+    compressed += compressor.flush()
+    return [bytes(compressed[i:i + size]) for i in range(0, len(compressed), size)]
+
+def compress_message(data:bytes, codec:Codec):
+    '''Compress a single message, the result starts with MESSAGE_MARKER and the codec tag.'''
+    return MESSAGE_MARKER + codec.tag + codec.compress(data)
+
+def decompress_message(message:bytes):
+    '''Undo compress_message.
+
+    Return:
+        - the original message, or None if message is not a compressed message.
+    '''
+    if not message.startswith(MESSAGE_MARKER):
+        return None
+    codec = codec_for_tag(message[1:2])
+    if codec is None:
+        return None
+    try:
+        return codec.decompress(message[2:])
+    except ValueError:
+        return None
+
+
+def benchmark(data:bytes, codecs=None, payload_size:int=32, payload_time:float=0.001, messages=()):
+    '''Compress data with every codec and level, and measure the payloads saved and the CPU time spent.
+
+    Params:
+        - data: the file contents to compress.
+        - codecs (optional): a list of (name, level) pairs, every codec at a
+            low, default and high level if not given.
+        - payload_size (optional): the bytes carried by a single payload.
+        - payload_time (optional): the seconds of airtime a single payload takes.
+        - messages (optional): short messages, each compressed on its own.
+
+    Return:
+        - a list of dicts, one per codec and level.
+    '''
+    if codecs is None:
+        codecs = [(name, level) for name in CODECS for level in sorted({1, CODECS[name].default_level, 9})]
+    plain_payloads = -(-len(data) // payload_size)
+
+    results = []
+    for name, level in codecs:
+        codec = get_codec(name, level)
+        start = time.process_time()
+        compressed = codec.compress(data)
+        compress_time = time.process_time() - start
+        start = time.process_time()
+        codec.decompress(compressed)
+        decompress_time = time.process_time() - start
+
+        payloads = -(-len(compressed) // payload_size)
+        message_bytes = sum(len(compress_message(message, codec)) for message in messages)
+        results.append({
+            'codec': name,
+            'level': level,
+            'ratio': len(data) / max(1, len(compressed)),
+            'payloads': payloads,
+            'airtime_saved_s': (plain_payloads - payloads) * payload_time,
+            'airtime_saved': 1 - payloads / max(1, plain_payloads),
+            'compress_ms': compress_time * 1000,
+            'decompress_ms': decompress_time * 1000,
+            'message_ratio': sum(map(len, messages)) / message_bytes if messages else None,
+        })
+    return results
+
+
+def parse_cmdline():
+    parser = argparse.ArgumentParser(description='Benchmark compression of radio payloads.')
+    parser.add_argument('-f', '--filename', type=str, default='data/test-data.txt', help='The file to compress.')
+    parser.add_argument('--payload-size', type=int, default=32, help='Bytes carried by a single payload.')
+    parser.add_argument('--payload-time', type=float, default=0.001, help='Seconds of airtime a single payload takes.')
+    return parser.parse_args()
+
+def main():
+    options = parse_cmdline()
+    with open(options.filename, mode='rb') as file:
+        data = file.read()
+    messages = [line for line in data.splitlines() if line.strip()]
+
+    print(f'{len(data)} bytes, {-(-len(data) // options.payload_size)} payloads uncompressed')
+    print(f'{"codec":>6} {"level":>5} {"ratio":>6} {"payloads":>8} {"saved":>6} {"saved s":>8} {"comp ms":>8} {"dec ms":>7} {"msg ratio":>9}')
+    for result in benchmark(data, payload_size=options.payload_size, payload_time=options.payload_time, messages=messages):
+        message_ratio = '-' if result['message_ratio'] is None else f'{result["message_ratio"]:.2f}'
+        print(f'{result["codec"]:>6} {result["level"]:>5} {result["ratio"]:>6.2f} {result["payloads"]:>8} '
+              f'{result["airtime_saved"]:>6.1%} {result["airtime_saved_s"]:>8.3f} {result["compress_ms"]:>8.2f} '
+              f'{result["decompress_ms"]:>7.2f} {message_ratio:>9}')
+
+if __name__ == '__main__':
+    main()
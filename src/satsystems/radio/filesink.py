@@ -0,0 +1,90 @@
+import os
+import tempfile
+from ..common.files import file_mode
+
+
+class FileSink:
+    '''Buffered, atomic destination for a received stream.
+
+    The output is written to a temporary file in the same directory,
+    which is held open for the whole stream and written in large blocks.
+    commit() renames it over the target file in one step, so readers
+    never see a partially received file. If the stream is aborted the
+    temporary file is removed and the target is left untouched.
+
+    Use as a context manager, the file is committed if the block exits
+    normally and aborted if it raises:
+
+        with FileSink('output.txt', fsync_every=100) as sink:
+            sink.write(payload)
+    '''
+
+    def __init__(self, filename:str, buffer_size:int=64 * 1024, fsync_every:int=0, fsync_on_commit:bool=True):
+        '''
+        Params:
+            - filename: the final path of the received file.
+            - buffer_size (optional): the number of bytes buffered before writing to disk.
+            - fsync_every (optional): force the data to disk every N payloads, 0 to disable.
+            - fsync_on_commit (optional): force the data to disk before the rename.
+        '''
+        if not filename.strip():
+            raise FileNotFoundError('No file specified to be written.')
+
+        self.filename = filename
+        self.buffer_size = buffer_size
+        self.fsync_every = fsync_every
+        self.fsync_on_commit = fsync_on_commit
+        self.num_payloads = 0
+        self.num_bytes = 0
+        self._temp_path = None
+        self._file = None
+
+    def open(self):
+        directory, name = os.path.split(os.path.abspath(self.filename))
+        fd, self._temp_path = tempfile.mkstemp(prefix=f'.{name}.', suffix='.part', dir=directory)
+        self._file = os.fdopen(fd, mode='wb', buffering=self.buffer_size)
+        return self
+
+    def write(self, data):
+        '''Write a single payload, a string (written as UTF-8) or bytes.'''
+        if isinstance(data, str):
+            data = data.encode('utf-8')
+        self._file.write(data)
+        self.num_payloads += 1
+        self.num_bytes += len(data)
+        if self.fsync_every and self.num_payloads % self.fsync_every == 0:
+            self._sync()
+
+    def commit(self):
+        '''Flush everything to disk and move the file into place.'''
+        if self._file is None:
+            return
+        if self.fsync_on_commit:
+            self._sync()
+        self._file.close()
+        self._file = None
+        os.chmod(self._temp_path, file_mode(self.filename))
+        os.replace(self._temp_path, self.filename)
+        self._temp_path = None
+
+    def abort(self):
+        '''Throw away everything written so far.'''
+        if self._file is not None:
+            self._file.close()
+            self._file = None
+        if self._temp_path is not None:
+            os.remove(self._temp_path)
+            self._temp_path = None
+
+    def _sync(self):
+        self._file.flush()
+        os.fsync(self._file.fileno())
+
+    def __enter__(self):
+        return self.open()
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        if exc_type is None:
+            self.commit()
+        else:
+            self.abort()
@@ -0,0 +1,134 @@
+import mmap
+import os
+
+
+class FileSource:
+    '''Lazily provide the contents of a file as fixed size payloads.
+
+    The file is memory-mapped rather than read into RAM, so only the
+    payloads that are actually sent are ever touched. Files are treated
+    as raw bytes, which means text and binary files (ex: JPEGs) are
+    handled the same way. The payload count comes from os.stat.
+
+    Use as a context manager:
+
+        with FileSource('image.jpg') as source:
+            for payload in source:
+                ...
+    '''
+
+    def __init__(self, filename:str, payload_size:int=32):
+        if not filename.strip():
+            raise FileNotFoundError('No file specified to be read.')
+
+        self.filename = filename
+        self.payload_size = payload_size
+        self.size = os.stat(filename).st_size
+        self._file = None
+        self._map = None
+
+    @property
+    def num_payloads(self):
+        '''The number of payloads needed to send the whole file.'''
+        return -(-self.size // self.payload_size)
+
+    def open(self):
+        self._file = open(self.filename, mode='rb')
+        if self.size > 0:
+            try:
+                self._map = mmap.mmap(self._file.fileno(), 0, access=mmap.ACCESS_READ)
+            except (OSError, ValueError):
+                self._map = None    # not mappable, fall back to chunked reads
+        return self
+
+    def close(self):
+        if self._map is not None:
+            self._map.close()
+            self._map = None
+        if self._file is not None:
+            self._file.close()
+            self._file = None
+
+    def payload(self, index:int):
+        '''Get a single payload.
+
+        Params:
+            - index: the position of the payload in the file, starting at 0.
+
+        Return:
+            - up to payload_size bytes. Only the last payload may be shorter.
+        '''
+        if not 0 <= index < self.num_payloads:
+            raise IndexError(f'payload {index} is out of range for {self.num_payloads} payloads')
+
+        start = index * self.payload_size
+        if self._map is not None:
+            return self._map[start:start + self.payload_size]
+        self._file.seek(start)
+        return self._file.read(self.payload_size)
+
+    def contains_any(self, values:bytes, chunk_size:int=1 << 20):
+        '''Whether any of the given byte values appear in the file, ex: the frame markers.'''
+        with open(self.filename, mode='rb') as file:
+            while True:
+                chunk = file.read(chunk_size)
+                if not chunk:
+                    return False
+                if len(chunk.translate(None, values)) != len(chunk):
+                    return True
+
+    def payloads(self, start:int=0, stop:int=None):
+        '''Lazily yield the payloads from index start up to (not including) stop.'''
+        if stop is None:
+            stop = self.num_payloads
+        for index in range(start, min(stop, self.num_payloads)):
+            yield self.payload(index)
+
+    def __iter__(self):
+        return self.payloads()
+
+    def __len__(self):
+        return self.num_payloads
+
+    def __enter__(self):
+        return self.open()
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+
+class PacketSource:
+    '''Provide ready made payloads through the same interface as FileSource.'''
+
+    def __init__(self, packets):
+        self._packets = list(packets)
+        self.size = sum(len(packet) for packet in self._packets)
+        self.payload_size = max((len(packet) for packet in self._packets), default=0)
+
+    @property
+    def num_payloads(self):
+        return len(self._packets)
+
+    def open(self):
+        return self
+
+    def close(self):
+        pass
+
+    def payload(self, index:int):
+        return self._packets[index]
+
+    def payloads(self, start:int=0, stop:int=None):
+        return iter(self._packets[start:stop])
+
+    def __iter__(self):
+        return self.payloads()
+
+    def __len__(self):
+        return self.num_payloads
+
+    def __enter__(self):
+        return self.open()
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
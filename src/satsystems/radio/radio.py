@@ -1,18 +1,22 @@
 from ..common.logger import SatelliteLogger
-from ..common.mcu import MCU
+from ..common import metrics
+from .compression import CODECS
 import argparse
 import time
 
 class Radio:
     '''Interface class to control a radio.'''
 
-    def __init__(self, uid, port, baud=115200, start_marker='<', end_marker='>'):
+    def __init__(self, uid, port, baud=115200, start_marker='<', end_marker='>', threaded=False, framing='marker', serial_port=None):
 
         self._uid = uid
+        self._framing = framing
+        self._marker_bytes = (start_marker + end_marker).encode('utf-8') + b'\0'     # what marker framing cannot carry
         self.logger = SatelliteLogger.get_logger('radio')
 
+        from ..common.mcu import MCU
         try:
-            self._arduino = MCU(port, 0, baud, start_marker, end_marker)
+            self._arduino = MCU(port, 0, baud, start_marker, end_marker, threaded, framing, serial_port)
         except Exception as e:
             self.logger.critical(f'failed to open connection to MCU on port: {port}')
             raise e
@@ -21,7 +25,7 @@ class Radio:
         self._set_uid()
         self._wait_for_msg('ready: radio')
 
-    def transmit(self, data:str):
+    def transmit(self, data:str, compression:str=None):
         '''Send a message.'''
         raise NotImplementedError('Should be implemented by derived class.')
 
@@ -29,7 +33,7 @@ class Radio:
         '''Receive a message.'''
         raise NotImplementedError('Should be implemented by derived class.')
 
-    def stream(self, filename:str):
+    def stream(self, filename:str, pipelined:bool=False, fec:bool=False, compression:str=None, level:int=None):
         '''Stream data in a file.'''
         raise NotImplementedError('Should be implemented by derived class.')
 
@@ -37,7 +41,7 @@ class Radio:
         '''Transmit a beacon message.'''
         raise NotImplementedError('Should be implemented by derived class.')
 
-    def monitor(self):
+    def monitor(self, filename:str, stop_message:str='STOP', fsync_every:int=0):
         '''Constantly listen for a signal.'''
         raise NotImplementedError('Should be implemented by derived class.')
 
@@ -51,10 +55,11 @@ class Radio:
         start_time = time.time()
         incoming = ''
         while incoming.find(msg) == -1:
-            if time.time() > start_time + timeout:
+            remaining = start_time + timeout - time.time()
+            if remaining <= 0:
                 self.logger.warning(f'no message received, expected: {msg}')
                 break
-            incoming = self._arduino.receive_over_serial()
+            incoming = self._arduino.wait_over_serial(remaining)
             if not (incoming == 'xxx'):
                 self.logger.debug(incoming)
 
@@ -63,35 +68,50 @@ def parse_cmdline():
     parser = argparse.ArgumentParser(description='Control Radio Module.')
     parser.add_argument('-p', '--port', metavar='port', type=str, help='The port the radio is connected to.')
     parser.add_argument('-i', '--uid', metavar='uid', type=int, help='The unique identification number of the connected radio.')
+    parser.add_argument('--binary', action='store_true', help='Use binary safe COBS framing, the radio firmware must be built with BINARY_FRAMING.')
+    parser.add_argument('--async-log', action='store_true', help='Write logs from a background thread so streams never wait on disk.')
+    parser.add_argument('--binary-log', type=str, help='Also write the logs to this binary log, ex: flight.bin, see "satsystems logger cat".')
+    parser.add_argument('--metrics', type=str, nargs='?', const='-', help='Record metrics, and save them as JSON to this file when done, "-" to print them.')
 
     subparser = parser.add_subparsers()
 
     transmit_parser = subparser.add_parser('transmit', help='Transmit data.')
     transmit_parser.add_argument('-d', '--data', type=str, help='The string of data to be transmitted.')
+    transmit_parser.add_argument('-c', '--compress', choices=CODECS, help='Compress the message, ex: "dict" for short telemetry.')
     transmit_parser.set_defaults(function=do_transmit)
 
     monitor_parser = subparser.add_parser('monitor', help='Monitor incoming data until "STOP" is received.')
     monitor_parser.add_argument('-f', '--filename', type=str, default='output-logs.txt', help='The filename to save the incoming data.')
+    monitor_parser.add_argument('--fsync-every', type=int, default=0, help='Force received stream data to disk every N payloads.')
     monitor_parser.set_defaults(function=do_monitor)
 
     beacon_parser = subparser.add_parser('beacon', help='Send out a beacon signal.')
-    beacon_parser.add_argument('-s', '--status', type=str, default='healthy', help='The status of the satellite.')
+    beacon_parser.add_argument('-s', '--status', type=str, help='The status of the satellite, the metrics if recorded (see --metrics) or "healthy" if not given.')
     beacon_parser.add_argument('-k', '--keep-listening', action='store_true', help='The satellite listens for a response after the beacon.')
     beacon_parser.set_defaults(function=do_beacon)
 
     stream_parser = subparser.add_parser('stream', help='Stream a file to another radio.')
     stream_parser.add_argument('-f', '--filename', type=str, default='data/test-data.txt', help='The full path of the text file to be streamed.')
+    stream_parser.add_argument('--pipelined', action='store_true', help='Batch payloads and use flow control instead of fixed delays.')
+    stream_parser.add_argument('--reliable', action='store_true', help='Retransmit lost or corrupt packets, the other radio must run receive-file.')
+    stream_parser.add_argument('--fec', action='store_true', help='Add forward error correction so lost packets can be rebuilt without retransmission.')
+    stream_parser.add_argument('-c', '--compress', choices=CODECS, help='Compress the file before it is split into payloads.')
+    stream_parser.add_argument('--level', type=int, help='The compression level, the codec default if not given.')
     stream_parser.set_defaults(function=do_stream)
 
+    receive_file_parser = subparser.add_parser('receive-file', help='Receive a file streamed with --reliable.')
+    receive_file_parser.add_argument('-f', '--filename', type=str, default='output-file', help='The filename to save the incoming file.')
+    receive_file_parser.set_defaults(function=do_receive_file)
+
     return parser.parse_args()
 
 def do_transmit(radio, options):
     data = options.data
-    radio.transmit(data)
+    radio.transmit(data, options.compress)
 
 def do_monitor(radio, options):
     filename = options.filename
-    radio.monitor(filename)
+    radio.monitor(filename, fsync_every=options.fsync_every)
 
 def do_beacon(radio, options):
     stats = options.status
@@ -100,14 +120,33 @@ def do_beacon(radio, options):
 
 def do_stream(radio, options):
     input_stream = options.filename
-    radio.stream(input_stream)
+    if options.reliable:
+        radio.send_reliable(input_stream)
+    else:
+        radio.stream(input_stream, options.pipelined, options.fec, compression=options.compress, level=options.level)
+
+def do_receive_file(radio, options):
+    radio.receive_reliable(options.filename)
 
 def main():
+    options = parse_cmdline()
+
     from .rf24 import RF24
 
-    options = parse_cmdline()
-    radio = RF24(uid=options.uid, port=options.port)
+    if options.async_log:
+        SatelliteLogger.use_async()
+    if options.binary_log:
+        SatelliteLogger.use_binary(options.binary_log)
+    if options.metrics:
+        metrics.enable()
+    radio = RF24(uid=options.uid, port=options.port, framing='cobs' if options.binary else 'marker')
     options.function(radio, options)
 
+    if options.metrics == '-':
+        print(metrics.to_json(indent=2))
+    elif options.metrics:
+        with open(options.metrics, mode='w') as file:
+            file.write(metrics.to_json(indent=2))
+
 if __name__ == '__main__':
     main()
@@ -1,28 +1,57 @@
-from setuptools import Command
 from .radio import Radio
+from .filesource import FileSource, PacketSource
+from .filesink import FileSink
+from .arq import ReliableSender, ReliableReceiver, PacketError, TransferStats, data_size
+from .compression import CODECS, MESSAGE_MARKER, CORRUPT_DATA_ERRORS, get_codec, compress_chunks, compress_message, decompress_message
+from ..common import metrics
+import base64
+import binascii
+import os
 import time
 
+TRANSMITS = metrics.counter('rf24.transmits', short='tx')
+ACK_FAILURES = metrics.counter('rf24.ack_failures', short='af')
+TRANSMIT_TIME = metrics.histogram('rf24.transmit_ms', short='tl')     # until the acknowledgement, or the timeout
+RECEIVE_TIMEOUTS = metrics.counter('rf24.receive_timeouts')
+STREAM_PAYLOADS = metrics.counter('rf24.stream_payloads', short='sp')
+STREAM_ABORTS = metrics.counter('rf24.stream_aborts', short='sa')
+STREAM_RATE = metrics.gauge('rf24.stream_bytes_per_s', short='sr')
+DROPPED_PACKETS = metrics.counter('rf24.dropped_packets', short='dp')  # corrupt or undecodable packets received
+
+
+class StreamAborted(RuntimeError):
+    '''Raised when the radio aborts a stream before every payload was sent.'''
+
+
 class RF24(Radio):
 
-    def __init__(self, uid, port, baud=115200, start_marker='<', end_marker='>'):
-        super().__init__(uid, port, baud, start_marker, end_marker)
+    def __init__(self, uid, port, baud=115200, start_marker='<', end_marker='>', threaded=False, framing='marker', serial_port=None):
+        super().__init__(uid, port, baud, start_marker, end_marker, threaded, framing, serial_port)
 
-        self.supported_modes = ['T', 'S', 'R']      # transmit, stream, receive
+        self.supported_modes = ['T', 'S', 'R', 'P'] # transmit, stream, receive, pipelined stream
         self.logger.info(f'radio {uid} booted')
 
-    def transmit(self, data:str):
+    def transmit(self, data:str, compression:str=None):
         '''Send a string of characters to the other radio, await for a response.
 
         Params:
             - data: 32 characters (string or bytes) to send.
+            - compression (optional): name of the codec to compress the message
+                with (see compression), longer messages can then fit in a payload.
+                The message is sent uncompressed if that is not any shorter.
         '''
-
-        self._transmit_header(data)
-        self.logger.debug(f'transmitted: {data}')
-        got_back = self.receive()
+        if compression:
+            data = self._compress_message(data, compression)
+
+        with TRANSMIT_TIME.time():
+            self._transmit_header(data)
+            self.logger.debug('transmitted: %s', data)
+            got_back = self.receive()
+        TRANSMITS.inc()
         if got_back == 'xxx':
+            ACK_FAILURES.inc()
             self.logger.warning(f'failed to receive acknowledgement')
-        self.logger.debug(f'received in return: {got_back}')
+        self.logger.debug('received in return: %s', got_back)
 
     def receive(self, timeout:float=60.0):
         '''Attempt to receive a single message from the other radio.
@@ -34,74 +63,256 @@ class RF24(Radio):
             - if received, the string sent from the arduino over serial.
             - if not received, 'xxx'
         '''
-        start_time = time.time()
-        received = 'xxx'
-        while received == 'xxx':
-            received = self._arduino.receive_over_serial()
-            if time.time() > start_time + timeout:
-                self.logger.warning(f'no message received within {timeout} s.')
-                break
-
-        return received
-
-    def stream(self, filename:str):
+        received = self._arduino.wait_bytes_over_serial(timeout)
+        if received is None:
+            RECEIVE_TIMEOUTS.inc()
+            self.logger.warning(f'no message received within {timeout} s.')
+            return 'xxx'
+
+        if received.startswith(MESSAGE_MARKER):
+            received = self._decompress_message(received)
+        return received.decode('utf-8', errors='replace')
+
+    def _compress_message(self, data, compression:str):
+        '''Compress a single message, with text framing the compressed part is base64 encoded.'''
+        if isinstance(data, str):
+            data = data.encode('utf-8')
+        message = compress_message(data, get_codec(compression))
+        message = message[:2] + RF24Link(self).encode(message[2:])
+        if len(message) >= len(data) and len(data) <= 32:
+            return data
+        self.logger.debug('compressed message from %d to %d bytes', len(data), len(message))
+        return message
+
+    def _decompress_message(self, received:bytes):
+        '''Undo _compress_message, messages that only look compressed are returned as they are.'''
+        encoded = RF24Link(self).decode(received[2:])
+        if encoded is None:
+            return received
+        message = decompress_message(received[:2] + encoded)
+        return received if message is None else message
+
+    def stream(self, filename:str, pipelined:bool=False, fec:bool=False, fec_k:int=16, fec_m:int=4,
+               compression:str=None, level:int=None):
         '''
         Stream a file to the other radio.
 
         Params:
             - filename: the file to be transmitted.
+            - pipelined (optional): batch payloads into as few serial writes as
+                possible, paced by credits from the radio instead of fixed sleeps.
+            - fec (optional): add forward error correction, the other radio can
+                rebuild the file as long as fec_k of every fec_k + fec_m packets arrive.
+            - fec_k, fec_m (optional): data and parity packets per FEC block.
+            - compression (optional): name of the codec to compress the file
+                with (see compression), the other radio decompresses it as it arrives.
+            - level (optional): the compression level, the codec's default if not given.
+
+        Return:
+            - the achieved throughput in bytes per second.
+
+        Raises:
+            ValueError: if the file holds bytes the marker framing would cut
+                payloads at (the markers or NUL) and it is sent uncompressed.
+            StreamAborted: if the radio aborts a pipelined stream.
+            TimeoutError: if the radio stops granting credits to a pipelined stream.
         '''
         if not filename.strip():
             raise FileNotFoundError('No file specified to be streamed.')
 
-        # extra the meta data from the file to be sent
-        num_characters = self._file_length(filename)
-        num_payloads = int(num_characters / 32) + 1 # max number of characters that can be sent with the RF24 radios is 32
-        self.logger.debug(f'reading {num_characters} characters ({num_payloads} payloads) from file: {filename}')
-
-        self._transmit_header('receive_stream', 's', num_payloads)
+        start_time = time.time()
+        codec = get_codec(compression, level) if compression else None
+        if fec:
+            header = 'receive_fec'
+            source = PacketSource(self._fec_payloads(filename, fec_k, fec_m, codec))
+        elif codec is not None:
+            header = 'receive_stream'
+            source = PacketSource(self._compressed_payloads(filename, codec))
+        else:
+            header = 'receive_stream'
+            source = FileSource(filename)
+            if self._framing == 'marker' and source.contains_any(self._marker_bytes):
+                raise ValueError(f'{filename} holds marker or NUL bytes that marker framing cannot carry, '
+                                 'use binary framing or compression (which encodes payloads as text).')
+        if codec is not None:
+            header += ';' + codec.name
+
+        with source:
+            self.logger.debug(f'streaming {source.size} bytes ({source.num_payloads} payloads) from file: {filename}')
+            if pipelined:
+                num_bytes = self._stream_pipelined(source, header)
+            else:
+                num_bytes = self._stream_paced(source, header)
+
+        bytes_per_second = num_bytes / (time.time() - start_time)
+        STREAM_RATE.set(bytes_per_second)
+        self.logger.info(f'streamed {num_bytes} bytes at {bytes_per_second:.1f} B/s')
+        return bytes_per_second
+
+    def _stream_paced(self, source, header:str):
+        '''Stream payloads one per serial write, paced with fixed delays.'''
+
+        self._transmit_header(header, 's', source.num_payloads)
         time.sleep(1)
-        with open(filename, mode='r', encoding='utf8') as file:
-            lines = file.read()
-            start = 0
-            stop = 32
-            for i in range(num_payloads):
-                to_send = lines[start:stop]
-                self.logger.debug(f'stream [{i}]: {to_send}')
-                self._transmit_raw(to_send)
-                start = stop
-                stop = start + 32
-                time.sleep(0.001) # do not comment out else packets will be dropped
+        for i, to_send in enumerate(source):
+            self.logger.debug('stream [%d]: %s', i, to_send)
+            self._transmit_raw(to_send)
+            STREAM_PAYLOADS.inc()
+            time.sleep(0.001) # do not comment out else packets will be dropped
         time.sleep(1)
         self._transmit_header('stop_stream')
+        return source.size
+
+    def _stream_pipelined(self, source, header:str, timeout:float=10.0):
+        '''Stream payloads using credit based flow control.
+
+        The radio grants an initial window of credits when it enters pipelined
+        stream mode and returns one credit ('c') each time it takes a payload
+        off the serial port. Payloads are written in batches as large as the
+        available credits. After an error the replies are drained up to the
+        radio's 'stream: done', so none are left for the next command.
+        '''
+        num_payloads = source.num_payloads
+        self._transmit_header(header, 'P', num_payloads)
+        sent = 0
+        credits = 0
+        done = False
+        aborted = None
+        while not done:
+            replies = [self._arduino.wait_over_serial(timeout)] + self._arduino.receive_frames_over_serial()
+            for reply in replies:
+                if reply == 'xxx' and aborted:
+                    done = True     # the radio never confirmed the end, nothing more is coming
+                elif reply == 'xxx':
+                    raise TimeoutError(f'stream stalled after {sent} of {num_payloads} payloads')
+                elif reply == 'c':
+                    credits += 1
+                elif reply.startswith('credit:'):
+                    credits += int(reply.split(':')[1])
+                elif reply == 'stream: done':
+                    done = True
+                elif reply.startswith('error'):
+                    STREAM_ABORTS.inc()
+                    self.logger.error(f'stream aborted after {sent} of {num_payloads} payloads: {reply}')
+                    aborted = reply
+
+            batch = list(source.payloads(sent, sent + credits))
+            if batch and not (done or aborted):
+                self._arduino.send_frames_over_serial(batch)
+                self.logger.debug('stream [%d:%d]', sent, sent + len(batch))
+                STREAM_PAYLOADS.inc(len(batch))
+                sent += len(batch)
+                credits -= len(batch)
+
+        self._transmit_header('stop_stream')
+        if aborted:
+            raise StreamAborted(f'stream aborted after {sent} of {num_payloads} payloads: {aborted}')
+        return min(sent * source.payload_size, source.size)
+
+    def _fec_payloads(self, filename:str, k:int, m:int, codec=None):
+        from .fec import FecEncoder
+
+        link = RF24Link(self)
+        encoder = FecEncoder(k, m, data_size(link.packet_size))
+        with open(filename, mode='rb') as file:
+            data = file.read()
+        if codec is not None:
+            data = codec.compress(data)
+        return [link.encode(packet) for packet in encoder.packets(data)]
+
+    def _compressed_payloads(self, filename:str, codec):
+        '''Compress a file into payloads, with text framing each one is base64 encoded.'''
+        link = RF24Link(self)
+        with FileSource(filename, 64 * 1024) as source:
+            packets = compress_chunks(source, codec, link.packet_size)
+        self.logger.debug(f'compressed {source.size} bytes to {sum(map(len, packets))} bytes with {codec.name}')
+        return [link.encode(packet) for packet in packets]
+
+    def send_reliable(self, filename:str, timeout:float=2.0):
+        '''Send a file with sequence numbers, CRCs and selective retransmission.
+
+        Only packets the other radio reports missing are sent again. The other
+        radio must be running receive_reliable().
+
+        Params:
+            - filename: the file to be transmitted.
+            - timeout (optional): seconds to wait for the other radio's status.
+
+        Return:
+            - the TransferStats of the transfer.
+        '''
+        stats = ReliableSender(RF24Link(self), timeout).send_file(filename)
+        self.logger.info(f'sent {stats.num_bytes} bytes reliably in {stats.rounds} rounds, '
+                         f'{stats.retransmitted} of {stats.packets_sent} packets were retransmissions')
+        return stats
+
+    def receive_reliable(self, filename:str, timeout:float=60.0):
+        '''Receive a file sent by send_reliable() on the other radio.
 
-    def monitor(self, filename:str, stop_message:str='STOP'):
+        Params:
+            - filename: where to save the received file.
+            - timeout (optional): seconds without any packet before giving up.
+
+        Return:
+            - the TransferStats of the transfer.
+        '''
+        with FileSink(filename) as sink:
+            stats = ReliableReceiver(RF24Link(self), timeout).receive(sink)
+        DROPPED_PACKETS.inc(stats.corrupt)
+        self.logger.info(f'received {stats.num_bytes} bytes reliably into: {filename}, {stats.corrupt} corrupt packets dropped')
+        return stats
+
+    def monitor(self, filename:str, stop_message:str='STOP', fsync_every:int=0):
         '''Constantly listen for a signal until a certian message is received.
 
         Params:
             - stop_message: the message to stop the monitoring.
             - filename: specify where to save a stream if one is received
                 during the monitoring.
+            - fsync_every (optional): while saving a stream, force the data to
+                disk every N payloads, 0 to only do so when the stream ends.
         '''
         received = 'xxx'
         while received != stop_message:
             received = self.receive()
+            header, _, compression = received.partition(';')
 
-            if received == 'receive_stream':
+            if header in ('receive_stream', 'receive_fec') and compression and compression not in CODECS:
+                # a corrupt or unknown codec name, the payloads that follow cannot be decoded
+                self.logger.warning('skipping a stream compressed with an unknown codec: %s', compression)
+            elif header == 'receive_stream':
                 self.logger.debug('receiving a stream')
-                self._receive_stream(filename)
+                self._receive_stream(filename, fsync_every, compression=compression or None)
                 self.logger.debug('ending a stream')
+            elif header == 'receive_fec':
+                self.logger.debug('receiving an fec stream')
+                self._receive_fec_stream(filename, compression=compression or None)
+                self.logger.debug('ending an fec stream')
             elif not (received == 'xxx'):
-                self.logger.info(f'received: {received}')
+                self.logger.info('received: %s', received)
+
+    def beacon(self, status:str=None, keep_listening=False, pulse_count:int=5):
+        '''Transmit a beacon message.
 
-    def beacon(self, status:str='healthy', keep_listening=False, pulse_count:int=5):
-        '''Transmit a beacon message.'''
+        Params:
+            - status (optional): the status sent after the call sign. If not
+                given, a snapshot of the metrics when they are enabled (see
+                common.metrics), split over as many headers as it needs, or
+                'healthy' when they are not.
+        '''
+        if status is not None:
+            lines = [status]
+        elif metrics.REGISTRY.enabled:
+            lines = metrics.beacon_lines()
+        else:
+            lines = ['healthy']
 
         for i in range(pulse_count):
             self._transmit_header('VA3TFO')
             time.sleep(1)
-            self._transmit_header(status)
-            time.sleep(1)
+            for line in lines:
+                self._transmit_header(line)
+                time.sleep(1)
         
         got_back = 'xxx'
         if keep_listening:
@@ -112,19 +323,86 @@ class RF24(Radio):
             self.logger.debug(f'received after beacon: {got_back}')
         return got_back"""
 
-    def _receive_stream(self, filename:str):
+    def _receive_stream(self, filename:str, fsync_every:int=0, timeout:float=60.0, compression:str=None):
         '''
         Receive a streamed file from another radio.
-        '''
-        received = 'xxx'
-        while received != 'stop_stream':
-            if not (received == 'xxx'):
-                with open(filename, mode='a', encoding='utf8') as file:
-                    file.write(received)
-            received = self.receive()
 
-    def _transmit_raw(self, data:str):
-        '''Transmit 32 characters to the radio. No formatting for raw transmission.
+        Payloads are written through a FileSink, the file only appears at
+        filename (replacing any previous file) once 'stop_stream' arrives.
+
+        Params:
+            - filename: where to save the received file.
+            - fsync_every (optional): force the data to disk every N payloads, 0 to disable.
+            - timeout (optional): warn if no payload arrives within this many seconds.
+            - compression (optional): name of the codec the stream was compressed
+                with, payloads are decompressed as they arrive.
+        '''
+        link = RF24Link(self)
+        decompressor = get_codec(compression).decompressor() if compression else None
+        try:
+            with FileSink(filename, fsync_every=fsync_every) as sink:
+                while True:
+                    received = self._arduino.wait_bytes_over_serial(timeout)
+                    if received is None:
+                        self.logger.warning(f'no message received within {timeout} s.')
+                    elif received == b'stop_stream':
+                        break
+                    elif decompressor is None:
+                        sink.write(received)
+                    else:
+                        packet = link.decode(received)
+                        if packet is None:
+                            raise ValueError('payload is not valid base64')
+                        sink.write(decompressor.decompress(packet))
+                if decompressor is not None and not decompressor.eof:
+                    raise ValueError('stream ended before the compressed data did')
+        except (ValueError, *CORRUPT_DATA_ERRORS) as e:
+            DROPPED_PACKETS.inc()
+            self.logger.error(f'discarding {compression} stream, it can not be decompressed: {e}')
+            return
+        self.logger.debug(f'received {sink.num_bytes} bytes ({sink.num_payloads} payloads) into: {filename}')
+
+    def _receive_fec_stream(self, filename:str, timeout:float=60.0, compression:str=None):
+        '''
+        Receive a file streamed with forward error correction and rebuild it
+        from whichever packets arrived.
+        '''
+        from .fec import FecReceiver
+
+        link = RF24Link(self)
+        stats = TransferStats()
+        decoder = None
+        while True:
+            received = self._arduino.wait_bytes_over_serial(timeout)
+            if received is None:
+                self.logger.warning(f'no message received within {timeout} s.')
+            elif received == b'stop_stream':
+                break
+            else:
+                packet = link.decode(received)
+                if packet is None:
+                    DROPPED_PACKETS.inc()
+                else:
+                    decoder = FecReceiver.feed(packet, decoder, stats)
+
+        DROPPED_PACKETS.inc(stats.corrupt)
+        if decoder is None or not decoder.complete:
+            missing = 'all' if decoder is None else decoder.missing_blocks
+            self.logger.error(f'fec stream can not be rebuilt, {missing} blocks are missing too many packets')
+            return
+        data = decoder.data()
+        if compression:
+            try:
+                data = get_codec(compression).decompress(data)
+            except ValueError as e:
+                self.logger.error(f'discarding fec stream, it can not be decompressed: {e}')
+                return
+        with FileSink(filename) as sink:
+            sink.write(data)
+        self.logger.debug(f'rebuilt {stats.num_bytes} bytes from {stats.packets_sent} packets, {stats.corrupt} corrupt packets dropped')
+
+    def _transmit_raw(self, data):
+        '''Transmit 32 characters (string or bytes) to the radio. No formatting for raw transmission.
 
         Params:
             data: the raw data to be transmitted to the other radio.
@@ -150,7 +428,7 @@ class RF24(Radio):
 
         return data_len
 
-    def _transmit_header(self, data:str, mode:str='T', num_payloads:int=1):
+    def _transmit_header(self, data, mode:str='T', num_payloads:int=1):
         '''Send a single header message.
 
         Params:
@@ -180,22 +458,88 @@ class RF24(Radio):
 
         return data_len
 
-    def _format_header(self, mode:str, num_payloads:int, data:str):
+    def _format_header(self, mode:str, num_payloads:int, data):
         '''Formart the data to what the arduino expects for transmissions.
 
         Return:
-            - formatted data string to be then called with _send_to_arduino
+            - formatted data string (or bytes, if data is bytes) to be then called with _send_to_arduino
         '''
         mode = mode.upper()
         if mode not in self.supported_modes:
-            raise IndexError(f'Using unsupported mode: {mode}, "T", "S", or "R" are expected.')
+            raise IndexError(f'Using unsupported mode: {mode}, "T", "S", "R", or "P" are expected.')
 
-        return mode + ':' + str(num_payloads) + ':' + data
+        header = mode + ':' + str(num_payloads) + ':'
+        if isinstance(data, bytes):
+            return header.encode('ascii') + data
+        return header + data
 
     @staticmethod
     def _file_length(filename:str):
+        '''The size of a file in bytes, taken from the file system without reading it.'''
         if not filename.strip():
             raise FileNotFoundError('No file specified, can not determine length.')
 
-        with open(filename, mode='r', encoding='utf8') as file:
-            return(len(file.read()))
+        return os.stat(filename).st_size
+
+
+class RF24Link:
+    '''Adapts an RF24 radio to the packet link used by the reliable transfer in arq.
+
+    With binary framing packets are sent as they are and fill the whole 32
+    byte payload. With text framing each packet is base64 encoded so it
+    survives the markers on the serial port, a 24 byte packet then fills a
+    32 character payload.
+    '''
+
+    def __init__(self, radio:RF24, ack_timeout:float=1.0):
+        self._radio = radio
+        self._ack_timeout = ack_timeout
+        self._inbox = []
+        self._binary = radio._framing == 'cobs'
+        self.packet_size = 32 if self._binary else 24
+
+    def send(self, packet:bytes):
+        '''Transmit a packet and wait for the radio to report the outcome.
+
+        Return:
+            - True if the other radio acknowledged the packet.
+        '''
+        self._radio._transmit_header(self.encode(packet))
+        deadline = time.monotonic() + self._ack_timeout
+        while True:
+            frame = self._radio._arduino.wait_bytes_over_serial(max(0, deadline - time.monotonic()))
+            if frame is None or frame.startswith((b'warn', b'error')):
+                return False
+            if frame == b'ACK':
+                return True
+            self._inbox.append(frame)   # a packet from the other radio arrived in the meantime
+
+    def receive(self, timeout:float):
+        '''Return the next packet from the other radio, or None if none arrived in time.'''
+        deadline = time.monotonic() + timeout
+        while True:
+            if self._inbox:
+                frame = self._inbox.pop(0)
+            else:
+                frame = self._radio._arduino.wait_bytes_over_serial(max(0, deadline - time.monotonic()))
+                if frame is None:
+                    return None
+            packet = self.decode(frame)
+            if packet is not None:
+                return packet
+            # not a packet, ex: a status message from the radio
+
+    def encode(self, packet:bytes):
+        '''Turn a packet into a payload that can be framed on the serial port.'''
+        if self._binary:
+            return packet
+        return base64.b64encode(packet)
+
+    def decode(self, frame:bytes):
+        '''Turn a received payload back into a packet, None if it is not one.'''
+        if self._binary:
+            return frame
+        try:
+            return base64.b64decode(frame, validate=True)
+        except binascii.Error:
+            return None
@@ -7,13 +7,13 @@ import time
 class Reactionwheel:
     '''Interface class to control a reaction wheel.'''
 
-    def __init__(self, uid, port, baud=115200, start_marker='<', end_marker='>'):
+    def __init__(self, uid, port, baud=115200, start_marker='<', end_marker='>', threaded=False):
 
         self._uid = uid
         self.logger = SatelliteLogger.get_logger('reactionwheel')
 
         try:
-            self._arduino = MCU(port, baud, start_marker, end_marker)
+            self._arduino = MCU(port, 0, baud, start_marker, end_marker, threaded)
         except Exception as e:
             self.logger.critical(f'failed to open connection to MCU on port: {port}')
             raise e
@@ -44,10 +44,11 @@ class Reactionwheel:
         start_time = time.time()
         incoming = ''
         while incoming.find(msg) == -1:
-            if time.time() > start_time + timeout:
+            remaining = start_time + timeout - time.time()
+            if remaining <= 0:
                 self.logger.warning(f'no message received, expected: {msg}')
                 break
-            incoming = self._arduino.receive_over_serial()
+            incoming = self._arduino.wait_over_serial(remaining)
             if not (incoming == 'xxx'):
                 self.logger.debug(incoming)
 
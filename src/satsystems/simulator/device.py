@@ -0,0 +1,157 @@
+from ..common.framing import MarkerFramer, CobsFramer
+import os
+import select
+import threading
+import time
+import tty
+
+
+class SimulatedDevice:
+    '''Base class for an Arduino simulated behind a pseudo-terminal.
+
+    A pty pair is created, the host side (port) can be passed anywhere a
+    device path such as /dev/ttyACM0 is expected, ex: MCU(port). The
+    simulator runs in a background thread on the other side of the pair,
+    parsing frames from the host and answering them like the firmware.
+    To stay in-process, pass the device end of a LoopbackSerial pair as
+    serial_port instead, and the host end to MCU's serial_port.
+
+    Until the host answers the boot handshake, the boot message is repeated
+    every boot_interval seconds. This stands in for the reset a real
+    Arduino does when its port is opened, so the host never misses it.
+
+    Subclasses implement on_frame() and may implement on_poll().
+    '''
+
+    # the longest the simulator thread waits for data before calling on_poll()
+    POLL_INTERVAL = 0.01
+
+    def __init__(self, baud:int=115200, framing:str='marker', start_marker:str='<', end_marker:str='>', boot_interval:float=0.5,
+                 serial_port=None):
+        '''
+        Params:
+            - baud (optional): limit the serial port to this many bits per
+                second in both directions, 0 for no limit.
+            - framing (optional): 'marker' or 'cobs', see common.framing.
+            - boot_interval (optional): seconds between repeated boot messages.
+            - serial_port (optional): talk over this port (ex: a LoopbackSerial)
+                instead of creating a pty.
+        '''
+        if framing == 'cobs':
+            self._framer = CobsFramer()
+        elif framing == 'marker':
+            self._framer = MarkerFramer(start_marker, end_marker)
+        else:
+            raise ValueError(f'unknown framing: {framing}, "marker" or "cobs" are expected.')
+
+        self.framing = framing
+        self.baud = baud
+        self.boot_interval = boot_interval
+        self.booted = False
+        self._serial_port = serial_port
+        if serial_port is None:
+            self._master, self._slave = os.openpty()
+            tty.setraw(self._slave)
+            self.port = os.ttyname(self._slave)
+        else:
+            self._master = self._slave = None
+            self.port = serial_port.port
+        self._write_lock = threading.Lock()
+        self._running = False
+        self._thread = None
+
+    def start(self):
+        '''Start the simulator thread.'''
+        if self._thread is None:
+            self._running = True
+            self._thread = threading.Thread(target=self._run, name=f'{type(self).__name__}:{self.port}', daemon=True)
+            self._thread.start()
+        return self
+
+    def stop(self):
+        '''Stop the simulator thread and close the pty.'''
+        self._running = False
+        if self._thread is not None:
+            self._thread.join()
+            self._thread = None
+        if self._serial_port is not None:
+            return
+        for fd in (self._master, self._slave):
+            try:
+                os.close(fd)
+            except OSError:
+                pass
+
+    def send(self, message):
+        '''Send a single framed message to the host.
+
+        Params:
+            - message: the message as a string or bytes.
+        '''
+        data = self._framer.frame(message)
+        with self._write_lock:
+            if self._serial_port is not None:
+                self._serial_port.write(data)
+            else:
+                os.write(self._master, data)
+            self._throttle(len(data))
+
+    def boot_message(self):
+        '''The message repeated until the handshake completes.'''
+        return 'ready: serial'
+
+    def on_handshake(self, frame:bytes):
+        '''Handle the host's answer to the boot message.
+
+        Return:
+            - True once the handshake is complete.
+        '''
+        return True
+
+    def on_frame(self, frame:bytes):
+        '''Handle a single message from the host, after the handshake.'''
+        raise NotImplementedError('Should be implemented by derived class.')
+
+    def on_poll(self):
+        '''Called on every pass of the simulator thread, at least every POLL_INTERVAL.'''
+
+    def _run(self):
+        next_boot = 0.0
+        while self._running:
+            if not self.booted and time.monotonic() >= next_boot:
+                self.send(self.boot_message())
+                next_boot = time.monotonic() + self.boot_interval
+
+            try:
+                data = self._read()
+            except OSError:
+                break   # the pty was closed
+            if data:
+                self._throttle(len(data))
+                for frame in self._framer.feed(data):
+                    if not self.booted:
+                        self.booted = self.on_handshake(frame)
+                    else:
+                        self.on_frame(frame)
+            self.on_poll()
+
+    def _read(self):
+        '''Wait up to POLL_INTERVAL for data from the host, b'' if none arrived.'''
+        if self._serial_port is not None:
+            self._serial_port.timeout = self.POLL_INTERVAL
+            return self._serial_port.read(max(1, self._serial_port.in_waiting))
+        readable, _, _ = select.select([self._master], [], [], self.POLL_INTERVAL)
+        if not readable:
+            return b''
+        return os.read(self._master, 4096)
+
+    def _throttle(self, num_bytes:int):
+        '''Sleep for as long as num_bytes take on a serial port at the configured baud rate.'''
+        if self.baud:
+            time.sleep(num_bytes * 10 / self.baud)  # 8N1, 10 bits per byte
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.stop()
@@ -0,0 +1,74 @@
+import threading
+import time
+
+
+class LoopbackSerial:
+    '''In-process stand-in for serial.Serial.
+
+    Bytes written to one end can be read from the other end. Only the parts
+    of the pyserial interface used by MCU are provided. Create connected
+    ends with LoopbackSerial.pair(), one for the host (ex: MCU's serial_port)
+    and one for a simulated device (ex: SimulatedTranseiver's serial_port).
+    '''
+
+    def __init__(self, port:str='loopback', timeout:float=None):
+        self.port = port
+        self.timeout = timeout
+        self.is_open = True
+        self.bytes_written = 0
+        self._buffer = bytearray()
+        self._condition = threading.Condition()
+        self._peer = None
+
+    @classmethod
+    def pair(cls, name:str='loopback'):
+        '''Create two connected ends.
+
+        Return:
+            - (host, device) ends.
+        '''
+        host = cls(f'{name}:host')
+        device = cls(f'{name}:device')
+        host._peer, device._peer = device, host
+        return host, device
+
+    @property
+    def in_waiting(self):
+        with self._condition:
+            return len(self._buffer)
+
+    def read(self, size:int=1):
+        '''Read up to size bytes, blocking for at most timeout seconds (forever if None).
+
+        Like pyserial, fewer bytes are returned if the timeout expires first.
+        '''
+        deadline = None if self.timeout is None else time.monotonic() + self.timeout
+        with self._condition:
+            while len(self._buffer) < size and self.is_open:
+                remaining = None if deadline is None else deadline - time.monotonic()
+                if remaining is not None and remaining <= 0:
+                    break
+                self._condition.wait(remaining)
+            data = bytes(self._buffer[:size])
+            del self._buffer[:size]
+            return data
+
+    def write(self, data:bytes):
+        peer = self._peer
+        with peer._condition:
+            peer._buffer += data
+            peer._condition.notify_all()
+        self.bytes_written += len(data)
+        return len(data)
+
+    def flush(self):
+        pass
+
+    def reset_input_buffer(self):
+        with self._condition:
+            self._buffer.clear()
+
+    def close(self):
+        with self._condition:
+            self.is_open = False
+            self._condition.notify_all()
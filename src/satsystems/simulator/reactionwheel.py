@@ -0,0 +1,26 @@
+from .device import SimulatedDevice
+
+
+class SimulatedReactionwheel(SimulatedDevice):
+    '''Simulates the handshake of a reaction wheel's motor controller.
+
+    Answers 'ready: serial' and the wheel number from the host with
+    'ready: reactionwheel'. Later messages are recorded in received, the
+    wheel does not move.
+    '''
+
+    def __init__(self, baud:int=115200, framing:str='marker', **kwargs):
+        super().__init__(baud, framing, **kwargs)
+        self.wheel_number = None
+        self.received = []
+
+    def on_handshake(self, frame:bytes):
+        digits = frame.strip()
+        if not digits.isdigit():
+            return False
+        self.wheel_number = int(digits)
+        self.send('ready: reactionwheel')
+        return True
+
+    def on_frame(self, frame:bytes):
+        self.received.append(frame)
@@ -0,0 +1,58 @@
+from ..common.logger import SatelliteLogger
+from .transeiver import SimulatedTranseiver
+from .reactionwheel import SimulatedReactionwheel
+import argparse
+import time
+
+
+def parse_cmdline():
+    parser = argparse.ArgumentParser(description='Simulate satellite hardware behind pseudo-terminals.')
+    parser.add_argument('--baud', type=int, default=115200, help='Serial port speed limit in bits per second, 0 for no limit.')
+    parser.add_argument('--binary', action='store_true', help='Use binary safe COBS framing, as with BINARY_FRAMING in the firmware.')
+
+    subparser = parser.add_subparsers()
+
+    radio_parser = subparser.add_parser('radio', help='Simulate a pair of transeivers in range of each other.')
+    radio_parser.add_argument('--latency', type=float, default=0.0, help='Seconds each payload spends on air.')
+    radio_parser.add_argument('--loss', type=float, default=0.0, help='The probability that a payload is lost on air.')
+    radio_parser.add_argument('--seed', type=int, help='Seed for the packet loss, for repeatable runs.')
+    radio_parser.set_defaults(function=do_radio)
+
+    reactionwheel_parser = subparser.add_parser('reactionwheel', help='Simulate reaction wheel motor controllers.')
+    reactionwheel_parser.add_argument('-n', '--count', type=int, default=1, help='The number of reaction wheels to simulate.')
+    reactionwheel_parser.set_defaults(function=do_reactionwheel)
+
+    return parser.parse_args()
+
+def do_radio(options):
+    framing = 'cobs' if options.binary else 'marker'
+    seed = options.seed
+    radio_0 = SimulatedTranseiver(options.baud, framing, options.latency, options.loss, seed)
+    radio_1 = SimulatedTranseiver(options.baud, framing, options.latency, options.loss, None if seed is None else seed + 1)
+    radio_0.link(radio_1)
+    return [radio_0, radio_1]
+
+def do_reactionwheel(options):
+    framing = 'cobs' if options.binary else 'marker'
+    return [SimulatedReactionwheel(options.baud, framing) for _ in range(options.count)]
+
+def main():
+    options = parse_cmdline()
+    logger = SatelliteLogger.get_logger('simulator')
+
+    devices = options.function(options)
+    for device in devices:
+        device.start()
+        logger.info(f'simulated {type(device).__name__} on port: {device.port}')
+
+    try:
+        while True:
+            time.sleep(1)
+    except KeyboardInterrupt:
+        pass
+    finally:
+        for device in devices:
+            device.stop()
+
+if __name__ == '__main__':
+    main()
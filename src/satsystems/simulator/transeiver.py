@@ -0,0 +1,152 @@
+from .device import SimulatedDevice
+import queue
+import random
+import time
+
+PAYLOAD_SIZE = 32
+ACK = b'ACK'
+
+
+class SimulatedTranseiver(SimulatedDevice):
+    '''Simulates an Arduino running firmware/transeiver and its nRF24 radio.
+
+    Implements the same serial protocol as the firmware:
+        - the boot handshake: 'ready: serial', the radio number from the
+            host, then 'ready: radioN'.
+        - 'T:<n>:<data>' transmits one payload and forwards the ACK payload
+            (or an error) to the host.
+        - 'S:<n>:<data>' and 'P:<n>:<data>' stream the next n frames, 'P'
+            with credit based flow control.
+        - while receiving, every payload from the other radio is sent to the host.
+
+    Radios are joined with link(), an unlinked radio's transmissions fail
+    like they do when the other radio is out of range. Each attempt to send
+    a payload over the air takes latency seconds and is lost with
+    probability loss. As in the firmware, a lost transmit is reported to the
+    host and lost stream payloads are retried.
+
+    Use as a context manager:
+
+        with SimulatedTranseiver() as a, SimulatedTranseiver() as b:
+            a.link(b)
+            radio = RF24(0, a.port)
+    '''
+
+    STREAM_WINDOW = 2       # credits granted at the start of a pipelined stream
+    MAX_FAILURES = 100      # failed stream payloads before the stream is aborted
+
+    def __init__(self, baud:int=115200, framing:str='marker', latency:float=0.0, loss:float=0.0, seed=None, **kwargs):
+        '''
+        Params:
+            - baud (optional): serial port speed limit in bits per second, 0 for no limit.
+            - framing (optional): 'marker' or 'cobs', matches BINARY_FRAMING in the firmware.
+            - latency (optional): seconds each payload spends on air.
+            - loss (optional): the probability that a payload is lost on air.
+            - seed (optional): seed for the loss, for repeatable runs.
+        '''
+        super().__init__(baud, framing, **kwargs)
+        self.latency = latency
+        self.loss = loss
+        self.radio_number = None
+        self.peer = None
+        self.sent = 0
+        self.dropped = 0
+        self._rng = random.Random(seed)
+        self._inbox = queue.Queue()
+        self._streaming = False
+        self._stream_remaining = 0
+        self._stream_pipelined = False
+        self._stream_failures = 0
+
+    def link(self, other:'SimulatedTranseiver'):
+        '''Put two radios in range of each other.'''
+        self.peer = other
+        other.peer = self
+
+    def on_handshake(self, frame:bytes):
+        digits = frame.strip()
+        if not digits.isdigit():
+            return False
+        self.radio_number = int(int(digits) == 1)
+        self.send(f'ready: radio{self.radio_number}')
+        return True
+
+    def on_frame(self, frame:bytes):
+        if self._streaming:
+            self._stream_payload(frame[:PAYLOAD_SIZE])
+            return
+
+        parts = frame.split(b':', 2)
+        if len(parts) < 3:
+            self.send('error: malformed header')
+            return
+        mode, num_payloads, data = parts
+        mode = mode[:1].upper()
+        payload = data[:PAYLOAD_SIZE]
+
+        if mode == b'T':
+            if self._transmit(payload):
+                self._send_payload(ACK)
+            else:
+                self.send('error: transmission failed or timed out')
+        elif mode in (b'S', b'P'):
+            self._transmit(payload)
+            self._streaming = True
+            self._stream_remaining = int(num_payloads) if num_payloads.strip().isdigit() else 0
+            self._stream_pipelined = mode == b'P'
+            self._stream_failures = 0
+            if self._stream_pipelined:
+                self.send(f'credit: {self.STREAM_WINDOW}')
+            if self._stream_remaining == 0:
+                self._end_stream()
+        elif mode != b'R':
+            self.send(f'error: unknown mode: {mode.decode("ascii", errors="replace")}')
+
+    def on_poll(self):
+        if self._streaming:
+            return      # the radio does not listen while it streams
+        while True:
+            try:
+                payload = self._inbox.get_nowait()
+            except queue.Empty:
+                break
+            self._send_payload(payload)
+
+    def _stream_payload(self, payload:bytes):
+        if self._stream_pipelined:
+            self.send('c')
+        while not self._transmit(payload):
+            self._stream_failures += 1
+            if self._stream_failures >= self.MAX_FAILURES:
+                self.send(f'error: too many failures detected, aborting at payload: {self.sent}')
+                self._end_stream()
+                return
+        self._stream_remaining -= 1
+        if self._stream_remaining <= 0:
+            self._end_stream()
+
+    def _end_stream(self):
+        if self._stream_pipelined:
+            self.send('stream: done')
+        self._streaming = False
+
+    def _transmit(self, payload:bytes):
+        '''Send a payload over the air.
+
+        Return:
+            - True if the other radio received it.
+        '''
+        if self.latency:
+            time.sleep(self.latency)
+        self.sent += 1
+        if self.peer is None or self._rng.random() < self.loss:
+            self.dropped += 1
+            return False
+        self.peer._inbox.put(payload)
+        return True
+
+    def _send_payload(self, payload:bytes):
+        '''Forward a payload to the host, text framing ends it at the first zero like the firmware.'''
+        if self.framing == 'marker':
+            payload = payload.split(b'\x00', 1)[0]
+        self.send(payload)